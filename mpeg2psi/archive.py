@@ -0,0 +1,350 @@
+"""section archive module
+
+	Provides ArchiveWriter and ArchiveReader classes for an append only section archive file. Raw sections are
+	stored back to back, each one after a small record header holding its PID, table ID, table ID extension,
+	version, section number and capture time. The reader maps the file into memory and builds its index from the
+	record headers alone, section data is only touched when a section is asked for. The index is stored next to
+	the archive so that reopening it only reads the headers of the records appended since.
+"""
+
+import bisect
+import mmap
+import os
+import struct
+import time
+
+import section_parser as sparse
+import section_factory
+
+ARCHIVE_MAGIC   = 'PSIA'
+ARCHIVE_VERSION = 1
+INDEX_MAGIC     = 'PSAX'
+INDEX_VERSION   = 1
+INDEX_SUFFIX    = '.aidx'
+
+_FILE_HEADER    = struct.Struct('>4sB')          # magic, format version
+_RECORD_HEADER  = struct.Struct('>HBHBBBdH')     # pid, table id, table id extension, version, section number,
+                                                 # flags, capture time, section data length
+_FLAG_EXTENDED  = 0x01
+_INDEX_HEADER   = struct.Struct('>4sBIQ')        # magic, format version, entry count, archive offset indexed to
+_INDEX_ENTRY    = struct.Struct('>HBHBBdQH')     # one index entry tuple
+
+# index entry fields
+PID                = 0
+TABLE_ID           = 1
+TABLE_ID_EXTENSION = 2
+VERSION            = 3
+SECTION_NUMBER     = 4
+CAPTURE_TIME       = 5
+OFFSET             = 6
+LENGTH             = 7
+
+class ArchiveWriter(object):
+	"""Appends raw sections to an archive file"""
+	def __init__(self, filename):
+		"""Constructor
+
+		Opens the archive for appending, the file is created if it does not exist.
+		Arguments:
+			filename -- name of the archive file
+		"""
+		self.file = open(filename, 'ab')
+		if self.file.tell() == 0:
+			self.file.write(_FILE_HEADER.pack(ARCHIVE_MAGIC, ARCHIVE_VERSION))
+
+	def write(self, pid, data, capture_time=None):
+		"""Appends a section to the archive
+
+		Arguments:
+			pid -- PID the section was carried on
+			data -- array of data bytes of the entire section
+			capture_time -- time the section was received in seconds (default None, the current time)
+		"""
+		if capture_time is None: capture_time = time.time()
+		length = sparse.get_section_length(data) + 3
+		if sparse.get_section_syntax_indicator(data):
+			header = _RECORD_HEADER.pack(pid, sparse.get_table_id(data), sparse.get_table_id_extension(data),
+			                             sparse.get_version_number(data), sparse.get_section_number(data),
+			                             _FLAG_EXTENDED, capture_time, length)
+		else:
+			header = _RECORD_HEADER.pack(pid, sparse.get_table_id(data), 0, 0, 0, 0, capture_time, length)
+		self.file.write(header)
+		self.file.write(str(bytearray(data[0:length])))
+
+	def write_section(self, pid, section, capture_time=None):
+		"""Appends a complete Section object to the archive"""
+		self.write(pid, section.data_cache, capture_time)
+
+	def flush(self):
+		self.file.flush()
+
+	def close(self):
+		self.file.close()
+
+def get_index_filename(filename):
+	"""Gets the name of the header index file stored next to an archive"""
+	return filename + INDEX_SUFFIX
+
+class ArchiveReader(object):
+	"""Reads an archive file through a memory map
+
+	The index is a list of tuples (pid, table id, table id extension, version, section number, capture time,
+	offset, length), one per section in the order they were written. The module level constants PID, TABLE_ID...
+	name the tuple fields. On top of it a dictionary per key field maps each value to the index positions
+	holding it and the positions are kept sorted by capture time, so ArchiveReader.find() never walks the whole
+	index. The index is stored next to the archive (archive name + INDEX_SUFFIX) and opening the archive again
+	only reads the record headers appended since.
+	"""
+	def __init__(self, filename, store_index=True):
+		"""Constructor
+
+		Arguments:
+			filename -- name of the archive file
+			store_index -- if True the index is loaded from and stored to the index file (default True)
+		"""
+		self.filename = filename
+		self.file     = open(filename, 'rb')
+		self.index    = []
+		size = os.fstat(self.file.fileno()).st_size
+		if size == 0: raise ValueError('empty archive')
+		self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+		magic, version = _FILE_HEADER.unpack_from(self.map, 0)
+		if magic != ARCHIVE_MAGIC: raise ValueError('not a section archive')
+		if version != ARCHIVE_VERSION: raise ValueError('unsupported archive version %d'%(version))
+		offset = _FILE_HEADER.size
+		if store_index: offset = self._load_index(size)
+		offset, added = self._build_index(offset, size)
+		self._build_key_index()
+		if store_index and added:
+			try:
+				self.save_index(offset)
+			except (IOError, OSError):
+				pass # read only location, the headers are read again next time
+
+	def _build_index(self, offset, size):
+		"""Reads the record headers from an offset, returns the offset after the last complete record and the
+		number of records read"""
+		unpack = _RECORD_HEADER.unpack_from
+		added = 0
+		while offset + _RECORD_HEADER.size <= size:
+			pid, table_id, ext, ver, scn, flags, capture_time, length = unpack(self.map, offset)
+			if offset + _RECORD_HEADER.size + length > size: break # last record cut short by a writer that did not finish
+			offset += _RECORD_HEADER.size
+			self.index.append((pid, table_id, ext, ver, scn, capture_time, offset, length))
+			offset += length
+			added += 1
+		return offset, added
+
+	def _build_key_index(self):
+		self._keys = [{}, {}, {}, {}, {}] # PID ... SECTION_NUMBER field -> {value: [index positions]}
+		for i, entry in enumerate(self.index):
+			for field in (PID, TABLE_ID, TABLE_ID_EXTENSION, VERSION, SECTION_NUMBER):
+				found = self._keys[field].get(entry[field])
+				if found is None: self._keys[field][entry[field]] = [i]
+				else: found.append(i)
+		self._time_order = sorted(range(len(self.index)), key=lambda i: self.index[i][CAPTURE_TIME])
+		self._times      = [self.index[i][CAPTURE_TIME] for i in self._time_order]
+
+	def _load_index(self, size):
+		"""Loads the stored index if it matches the archive, returns the archive offset to carry on reading from"""
+		start = _FILE_HEADER.size
+		index_filename = get_index_filename(self.filename)
+		if not os.path.exists(index_filename): return start
+		f = open(index_filename, 'rb')
+		try:
+			data = f.read()
+		finally:
+			f.close()
+		if len(data) < _INDEX_HEADER.size: return start
+		magic, version, count, end = _INDEX_HEADER.unpack_from(data, 0)
+		if magic != INDEX_MAGIC or version != INDEX_VERSION or end > size: return start
+		if len(data) != _INDEX_HEADER.size + count * _INDEX_ENTRY.size: return start
+		index = [_INDEX_ENTRY.unpack_from(data, offset)
+		         for offset in xrange(_INDEX_HEADER.size, len(data), _INDEX_ENTRY.size)]
+		if index:
+			# the archive must still hold the last indexed record, otherwise it is not the file indexed
+			last = index[-1]
+			header = _RECORD_HEADER.unpack_from(self.map, last[OFFSET] - _RECORD_HEADER.size)
+			if header[0:5] + header[6:8] != last[0:6] + last[7:8]: return start
+		self.index = index
+		return end
+
+	def save_index(self, end=None):
+		"""Writes the index to the index file
+
+		Arguments:
+			end -- archive offset after the last indexed record (default None, worked out from the index)
+		"""
+		if end is None:
+			end = self.index and self.index[-1][OFFSET] + self.index[-1][LENGTH] or _FILE_HEADER.size
+		records = [_INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, len(self.index), end)]
+		for entry in self.index: records.append(_INDEX_ENTRY.pack(*entry))
+		f = open(get_index_filename(self.filename), 'wb')
+		try:
+			f.write(''.join(records))
+		finally:
+			f.close()
+
+	def __len__(self):
+		return len(self.index)
+
+	def find(self, pid=None, table_id=None, table_id_extension=None, version=None, section_number=None,
+	         start_time=None, end_time=None):
+		"""Finds the sections matching all the given keys
+
+		Arguments left as None match any value. start_time and end_time limit the capture time to
+		start_time <= capture time < end_time. The positions of the most selective key (or of the capture time
+		range) are looked up and only those are checked against the other keys.
+		Returns:
+			A list of index positions in ascending order
+		"""
+		keys = [(field, value) for field, value in ((PID, pid), (TABLE_ID, table_id),
+		                                           (TABLE_ID_EXTENSION, table_id_extension), (VERSION, version),
+		                                           (SECTION_NUMBER, section_number)) if value is not None]
+		timed = start_time is not None or end_time is not None
+		candidates = None
+		for field, value in keys:
+			found = self._keys[field].get(value, ())
+			if candidates is None or len(found) < len(candidates): candidates = found
+		if timed:
+			first, last = 0, len(self._times)
+			if start_time is not None: first = bisect.bisect_left(self._times, start_time)
+			if end_time is not None: last = bisect.bisect_left(self._times, end_time)
+			if candidates is None or last - first < len(candidates):
+				candidates = sorted(self._time_order[first:last])
+				timed = False
+		elif candidates is None:
+			return range(len(self.index))
+		index = self.index
+		found = []
+		for i in candidates:
+			entry = index[i]
+			if timed:
+				if start_time is not None and entry[CAPTURE_TIME] < start_time: continue
+				if end_time is not None and entry[CAPTURE_TIME] >= end_time: continue
+			for field, value in keys:
+				if entry[field] != value: break
+			else:
+				found.append(i)
+		return found
+
+	def get_view(self, i):
+		"""Gets a read only view of the raw section data at an index position without copying it"""
+		entry = self.index[i]
+		return buffer(self.map, entry[OFFSET], entry[LENGTH])
+
+	def get_section(self, i, trusted=False):
+		"""Builds the typed section object (see section_factory) for the section at an index position
+
+		Arguments:
+			i -- index position
+			trusted -- if True the trusted variant of the section class is built, without checking or parsing
+			anything up front (default False)
+		"""
+		return section_factory.create_section(bytearray(self.get_view(i)), trusted)
+
+	def close(self):
+		self.map.close()
+		self.file.close()
+
+'''UNIT TESTS -------------------------------------------------------------------------------------------------------------
+---------------------------------------------------------------------------------------------------------------------------
+'''
+if __name__ == '__main__':
+	import unittest
+	import tempfile
+	import _known_tables
+
+	nit_data   = _known_tables.get_sample_nit_data()
+	cat_data   = _known_tables.get_sample_cat_data()[0]
+	pat_data   = _known_tables.get_sample_pat_data()[0]
+
+	class Archive(unittest.TestCase):
+		def setUp(self):
+			fd, self.filename = tempfile.mkstemp()
+			os.close(fd)
+			writer = ArchiveWriter(self.filename)
+			writer.write(0x00, pat_data, 100.0)
+			writer.write(0x01, cat_data, 101.0)
+			writer.write(0x10, nit_data[0], 102.0)
+			writer.close()
+			writer = ArchiveWriter(self.filename)
+			writer.write(0x10, nit_data[1], 103.0)
+			writer.close()
+			self.reader = ArchiveReader(self.filename)
+
+		def tearDown(self):
+			self.reader.close()
+			for name in (self.filename, get_index_filename(self.filename)):
+				if os.path.exists(name): os.remove(name)
+
+		def testIndex(self):
+			self.assertEqual(4, len(self.reader))
+			self.assertEqual((0x10, 0x40, 6144, 1, 1, 103.0), self.reader.index[3][0:6])
+
+		def testFind(self):
+			self.assertEqual([2, 3], self.reader.find(pid=0x10))
+			self.assertEqual([3], self.reader.find(table_id=0x40, section_number=1))
+			self.assertEqual([1, 2], self.reader.find(start_time=101.0, end_time=103.0))
+			self.assertEqual([], self.reader.find(pid=0x10, version=2))
+			self.assertEqual([], self.reader.find(end_time=50.0))
+			self.assertEqual([0, 1, 2, 3], self.reader.find())
+			self.assertEqual([2], self.reader.find(pid=0x10, start_time=99.0, end_time=103.0))
+
+		def testFindOutOfOrder(self):
+			writer = ArchiveWriter(self.filename)
+			writer.write(0x01, cat_data, 50.0)
+			writer.close()
+			reader = ArchiveReader(self.filename)
+			self.assertEqual([0, 4], reader.find(start_time=0.0, end_time=101.0))
+			self.assertEqual([1, 4], reader.find(table_id=0x01))
+			reader.close()
+
+		def testStoredIndex(self):
+			self.assertTrue(os.path.exists(get_index_filename(self.filename)))
+			writer = ArchiveWriter(self.filename)
+			writer.write(0x01, cat_data, 104.0)
+			writer.close()
+			reader = ArchiveReader(self.filename)
+			built = ArchiveReader(self.filename, store_index=False)
+			self.assertEqual(built.index, reader.index)
+			self.assertEqual([1, 4], reader.find(pid=0x01))
+			reader.close()
+			built.close()
+
+		def testStaleIndex(self):
+			# an index stored for another archive of the same name is not used
+			self.reader.close()
+			os.remove(self.filename)
+			writer = ArchiveWriter(self.filename)
+			writer.write(0x01, cat_data, 1.0)
+			writer.write(0x10, nit_data[0], 2.0)
+			writer.write(0x00, pat_data, 3.0)
+			writer.write(0x00, pat_data, 4.0)
+			writer.write(0x00, pat_data, 5.0)
+			writer.close()
+			self.reader = ArchiveReader(self.filename)
+			self.assertEqual(5, len(self.reader))
+			self.assertEqual([2, 3, 4], self.reader.find(pid=0x00))
+
+		def testSections(self):
+			self.assertEqual(str(bytearray(cat_data)), str(self.reader.get_view(1)))
+			pat = self.reader.get_section(0)
+			self.assertEqual('Pat', type(pat).__name__)
+			self.assertEqual(22, len(pat.table))
+			self.assertEqual(0xD9787E8A, self.reader.get_section(2).crc)
+			self.assertEqual(0xD9787E8A, self.reader.get_section(2, trusted=True).crc)
+			trusted = self.reader.get_section(0, trusted=True)
+			self.assertTrue(isinstance(trusted, type(pat)))
+			self.assertEqual(pat.table, trusted.table)
+			self.assertEqual(10, len(list(self.reader.get_section(2, trusted=True).iter_transport_streams())))
+
+		def testTruncated(self):
+			f = open(self.filename, 'ab')
+			f.write(_RECORD_HEADER.pack(0, 0, 0, 0, 0, 0, 0.0, 100) + 'short')
+			f.close()
+			reader = ArchiveReader(self.filename)
+			self.assertEqual(4, len(reader))
+			reader.close()
+
+	unittest.main()
@@ -0,0 +1,239 @@
+"""assembler pool module
+
+	Provides an AssemblerPool class to reassemble sections for many PIDs at once within a fixed memory budget.
+	Partial sections are kept in a buffer per PID. Once the budget is exceeded, or a partial section
+	is too old, the least recently used partial sections are dropped and the drop is counted against its PID.
+"""
+
+import time
+from collections import OrderedDict
+
+import section_parser as sparse
+import section_factory
+
+STUFFING_BYTE     = 0xFF
+MAX_SECTION_SIZE  = 4096
+MAX_PSI_SECTION_LENGTH     = 1021 # section_length limit for PSI (non private) sections
+MAX_PRIVATE_SECTION_LENGTH = 4093 # section_length limit for private sections
+
+class AssemblerPool(object):
+	"""A bounded memory pool of per PID section assemblers
+
+	Section payload data is pushed in per PID with AssemblerPool.add_data() and the completed sections are
+	returned as they become available. Memory held by partial sections never goes above the memory budget.
+	A partial section with an out of range section length is dropped as soon as its header is seen, and
+	AssemblerPool.discard() drops a partial section known to be broken (for instance after packet loss).
+	"""
+	def __init__(self, memory_budget=1 << 20, max_age=None, clock=time.time, factory=None):
+		"""Constructor
+
+		Arguments:
+			memory_budget -- maximum number of bytes held in partial sections over all PIDs (default 1MB)
+			max_age -- number of seconds after which an unfinished partial section is dropped (default None, never)
+			clock -- function returning the current time in seconds (default time.time)
+			factory -- function building a section object from a block of section data (default None,
+			section_factory.create_section)
+		"""
+		if memory_budget < MAX_SECTION_SIZE:
+			raise ValueError('memory budget must hold at least one full section (%d bytes)'%(MAX_SECTION_SIZE))
+		self.memory_budget = memory_budget
+		self.max_age       = max_age
+		self.clock         = clock
+		self.factory       = factory or section_factory.create_section
+		self.memory        = 0
+		self.drops         = {}
+		self.length_errors = 0
+		self._partials     = OrderedDict() # pid -> [buffer, time of last data], least recently used first
+
+	def _release(self, pid, dropped=False):
+		"""Releases the partial section held for the PID"""
+		buf = self._partials.pop(pid)[0]
+		self.memory -= len(buf)
+		if dropped: self.drops[pid] = self.drops.get(pid, 0) + 1
+
+	def _evict(self, now):
+		"""Drops partial sections that are too old and then least recently used ones until back in budget"""
+		if self.max_age is not None:
+			oldest = now - self.max_age
+			for pid in list(self._partials):
+				if self._partials[pid][1] >= oldest: break
+				self._release(pid, True)
+		while self.memory > self.memory_budget:
+			self._release(next(iter(self._partials)), True)
+
+	def add_data(self, pid, data, start=False):
+		"""Adds section payload data for a PID
+
+		Arguments:
+			pid -- PID the data was carried on
+			data -- array of data bytes. If start is True this must begin with the first byte of a section
+			start -- True if a new section starts at the beginning of data (default False)
+		Returns:
+			A list of the sections completed by the data (empty if none)
+		"""
+		now = self.clock()
+		partial = self._partials.get(pid)
+		if start:
+			if partial: self._release(pid, True)
+			partial = [bytearray(), now]
+		elif partial:
+			del self._partials[pid]
+		else:
+			return [] # no section start seen on this PID yet
+		self._partials[pid] = partial
+		partial[1] = now
+
+		buf = partial[0]
+		before = len(buf)
+		buf.extend(data)
+		sections = []
+		while len(buf) >= 3:
+			if buf[0] == STUFFING_BYTE:
+				del buf[:]
+				break
+			section_length = sparse.get_section_length(buf)
+			if section_length > (buf[1] & 0x40 and MAX_PRIVATE_SECTION_LENGTH or MAX_PSI_SECTION_LENGTH):
+				# corrupt header, wait for the next section start rather than the bogus length
+				self.length_errors += 1
+				self.drops[pid] = self.drops.get(pid, 0) + 1
+				del buf[:]
+				break
+			length = section_length + 3
+			if len(buf) < length: break
+			sections.append(self.factory(buf[0:length]))
+			del buf[0:length]
+		self.memory += len(buf) - before
+		if not buf: self._release(pid)
+		self._evict(now)
+		return sections
+
+	def discard(self, pid):
+		"""Drops the partial section of the PID, counting it as a drop
+
+		Returns:
+			True if there was a partial section to drop
+		"""
+		if pid not in self._partials: return False
+		self._release(pid, True)
+		return True
+
+	def has_partial(self, pid):
+		"""True if a partial section is pending for the PID"""
+		return pid in self._partials
+
+	def get_drop_count(self, pid):
+		"""Gets the number of partial sections dropped for the PID"""
+		return self.drops.get(pid, 0)
+
+	def pending_pids(self):
+		"""Gets the PIDs with a partial section pending, least recently used first"""
+		return list(self._partials)
+
+	def reset(self, pid=None):
+		"""Drops the partial section for the PID (or all PIDs if None) without counting it as a drop"""
+		for p in ([pid] if pid is not None else list(self._partials)):
+			if p in self._partials: self._release(p)
+
+'''UNIT TESTS -------------------------------------------------------------------------------------------------------------
+---------------------------------------------------------------------------------------------------------------------------
+'''
+if __name__ == '__main__':
+	import unittest
+	import _known_tables
+
+	nit_data_0 = _known_tables.get_sample_nit_data()[0]
+	cat_data   = _known_tables.get_sample_cat_data()[0]
+	pat_data   = _known_tables.get_sample_pat_data()[0]
+
+	class FakeClock(object):
+		def __init__(self): self.now = 0.0
+		def __call__(self): return self.now
+
+	class Pool(unittest.TestCase):
+		def setUp(self):
+			self.clock = FakeClock()
+			self.pool  = AssemblerPool(memory_budget=MAX_SECTION_SIZE, max_age=1.0, clock=self.clock)
+
+		def testPartialData(self):
+			sections = []
+			for i in range(0, len(nit_data_0), 184):
+				sections += self.pool.add_data(0x10, nit_data_0[i:i+184], start=(i == 0))
+			self.assertEqual(1, len(sections))
+			self.assertEqual(0xD9787E8A, sections[0].crc, 'bad crc')
+			self.assertEqual(0, self.pool.memory)
+			self.assertEqual([], self.pool.pending_pids())
+
+		def testTypedSections(self):
+			sections = self.pool.add_data(0, pat_data + [0xFF] * 20, start=True)
+			self.assertEqual(1, len(sections))
+			self.assertEqual('Pat', type(sections[0]).__name__)
+			self.assertEqual(0, self.pool.memory)
+
+		def testSeveralSections(self):
+			sections = self.pool.add_data(1, cat_data + cat_data[0:5], start=True)
+			self.assertEqual(1, len(sections))
+			self.assertEqual(5, self.pool.memory)
+			sections = self.pool.add_data(1, cat_data[5:])
+			self.assertEqual(1, len(sections))
+			self.assertEqual(0, self.pool.memory)
+
+		def testNoStart(self):
+			self.assertEqual([], self.pool.add_data(1, cat_data))
+			self.assertEqual(0, self.pool.memory)
+
+		def testRestartDrops(self):
+			self.pool.add_data(1, cat_data[0:5], start=True)
+			self.assertEqual(1, len(self.pool.add_data(1, cat_data, start=True)))
+			self.assertEqual(1, self.pool.get_drop_count(1))
+
+		def testBudget(self):
+			for pid in range(100):
+				self.pool.add_data(pid, nit_data_0[0:100], start=True)
+				self.assertTrue(self.pool.memory <= MAX_SECTION_SIZE)
+			self.assertEqual(40, len(self.pool.pending_pids()))
+			self.assertEqual(1, self.pool.get_drop_count(0))
+			self.assertEqual(0, self.pool.get_drop_count(99))
+			self.assertEqual(60, sum(self.pool.drops.values()))
+
+		def testLru(self):
+			for pid in range(40):
+				self.pool.add_data(pid, nit_data_0[0:100], start=True)
+			self.pool.add_data(0, nit_data_0[100:110])
+			self.pool.add_data(40, nit_data_0[0:100], start=True)
+			self.assertEqual(0, self.pool.get_drop_count(0))
+			self.assertEqual(1, self.pool.get_drop_count(1))
+
+		def testAge(self):
+			self.pool.add_data(1, nit_data_0[0:100], start=True)
+			self.clock.now = 0.5
+			self.pool.add_data(2, nit_data_0[0:100], start=True)
+			self.clock.now = 1.2
+			self.pool.add_data(3, nit_data_0[0:100], start=True)
+			self.assertEqual([2, 3], self.pool.pending_pids())
+			self.assertEqual(1, self.pool.get_drop_count(1))
+
+		def testBadLength(self):
+			bad = list(cat_data)
+			bad[1] = 0xBF # section length 0xFFF
+			self.assertEqual([], self.pool.add_data(1, bad, start=True))
+			self.assertEqual(1, self.pool.length_errors)
+			self.assertEqual(0, self.pool.memory)
+			self.assertEqual([], self.pool.add_data(1, cat_data))
+			self.assertEqual(1, len(self.pool.add_data(1, cat_data, start=True)))
+			self.assertEqual(1, self.pool.get_drop_count(1))
+
+		def testDiscard(self):
+			self.pool.add_data(1, nit_data_0[0:100], start=True)
+			self.assertTrue(self.pool.discard(1))
+			self.assertFalse(self.pool.discard(1))
+			self.assertEqual([], self.pool.add_data(1, nit_data_0[100:]))
+			self.assertEqual(1, self.pool.get_drop_count(1))
+
+		def testRelease(self):
+			self.pool.add_data(1, cat_data[0:5], start=True)
+			self.assertEqual(5, self.pool.memory)
+			self.assertEqual(1, len(self.pool.add_data(1, cat_data[5:])))
+			self.assertFalse(self.pool.has_partial(1))
+			self.assertEqual(0, self.pool.memory)
+
+	unittest.main()
@@ -0,0 +1,92 @@
+"""Conditional Access Table module
+
+	Provides a CAT Section class to encapsulate information about a MPEG2-TS Conditional Access Table section.
+	The descriptor loop is walked from the section data when asked for, nothing is decoded when parsing.
+"""
+
+import field_spec
+import descriptor
+from section import Section, TrustedSection
+
+CA_DESCRIPTOR_TAG = 0x09
+
+# Payload of a CA descriptor
+CA_DESCRIPTOR_FIELDS = [
+	('ca_system_id', 0, 0, 16, 'conditional access system ID'),
+	('ca_pid',       2, 3, 13, 'PID of the ECM/EMM stream'),
+]
+_CA_FIELDS = field_spec.compile_fields(CA_DESCRIPTOR_FIELDS, relative=True)
+_get_ca_system_id = _CA_FIELDS['get_ca_system_id']
+_get_ca_pid       = _CA_FIELDS['get_ca_pid']
+
+class Cat(Section):
+	"""Conditional Access Table class
+
+	Inherits from Section and gives access to the CA descriptors of a Conditional Access Table section
+	described as a part of MPEG2 PSI
+	"""
+	TABLE_ID = 0x01
+
+	def iter_descriptors(self):
+		"""Walks the descriptor loop of the section
+
+		Yields:
+			(tag, payload) for each descriptor, payload being a copy of the descriptor payload bytes
+		"""
+		if not self.complete: return
+		data = self.data_cache
+		for tag, start, length in descriptor.iter_descriptors(data, 8, self.length - 4):
+			yield tag, data[start:start+length]
+
+	def iter_ca_systems(self):
+		"""Walks the CA descriptors of the section
+
+		Yields:
+			(CA system ID, CA PID) for each CA descriptor
+		"""
+		if not self.complete: return
+		data = self.data_cache
+		for tag, start, length in descriptor.iter_descriptors(data, 8, self.length - 4):
+			if tag == CA_DESCRIPTOR_TAG and length >= 4:
+				yield _get_ca_system_id(data, start), _get_ca_pid(data, start)
+
+	def __str__(self):
+		res = super(Cat, self).__str__()
+		resar = res.split('\n')
+		resar[0] = 'CAT:'
+		res = '\n'.join(resar)
+		res += ' CA systems:\n'
+		for system, pid in self.iter_ca_systems():
+			res += '\tsystem[%x] - pid[%x]\n'%(system, pid)
+		return res
+
+class TrustedCat(TrustedSection, Cat):
+	"""Conditional Access Table built from trusted data
+
+	Inherits from TrustedSection and Cat. Nothing is checked when the object is built, the loops are walked
+	from the section data as for Cat.
+	"""
+
+'''UNIT TESTS -------------------------------------------------------------------------------------------------------------
+---------------------------------------------------------------------------------------------------------------------------
+'''
+if __name__ == '__main__':
+	import unittest
+	import _known_tables
+	cat_data = _known_tables.get_sample_cat_data()[0]
+
+	class KnownSections(unittest.TestCase):
+		def testCat(self):
+			cat = Cat(cat_data)
+			self.assertEqual(1, cat.table_id, 'incorrect table id')
+			self.assertEqual(0x9064C6D0, cat.crc, 'bad crc')
+			self.assertEqual([(0x09, [0x06, 0x06, 0x05, 0x00])], list(cat.iter_descriptors()))
+			self.assertEqual([(0x0606, 0x0500)], list(cat.iter_ca_systems()))
+
+		def testIncomplete(self):
+			cat = Cat(cat_data[0:10])
+			self.assertEqual([], list(cat.iter_descriptors()))
+			cat.add_data(cat_data[10:])
+			self.assertEqual([(0x0606, 0x0500)], list(cat.iter_ca_systems()))
+
+	unittest.main()
@@ -0,0 +1,212 @@
+"""demux module
+
+	Provides a Demux class that reassembles sections from transport stream packets. Continuity counter gaps,
+	transport errors and bad pointer fields drop the partial section of the PID straight away, and reassembly
+	starts again at the next packet with the payload unit start indicator set.
+"""
+
+import ts_packet
+from assembler_pool import AssemblerPool
+
+TS_PACKET_SIZE = ts_packet.TS_PACKET_SIZE
+
+_get_sync_byte                    = ts_packet.get_sync_byte
+_get_transport_error_indicator    = ts_packet.get_transport_error_indicator
+_get_payload_unit_start_indicator = ts_packet.get_payload_unit_start_indicator
+_get_pid                          = ts_packet.get_pid
+_get_continuity_counter           = ts_packet.get_continuity_counter
+_get_payload_offset               = ts_packet.get_payload_offset
+
+class Demux(object):
+	"""Transport stream packet to section demultiplexer
+
+	Packets are passed in with Demux.feed() (one packet) or Demux.feed_packets() (a buffer of packets), both
+	return the completed sections as (pid, section) tuples.
+	"""
+	def __init__(self, pids=None, pool=None):
+		"""Constructor
+
+		Arguments:
+			pids -- set of PIDs to reassemble sections for (default None, every PID)
+			pool -- AssemblerPool to reassemble with (default None, a new one with the default budget)
+		"""
+		self.pids           = pids
+		self.pool           = pool or AssemblerPool()
+		self.packets        = 0
+		self.sync_errors    = 0
+		self.cc_errors      = {}   # pid -> number of continuity counter errors
+		self.pointer_errors = 0
+		self._continuity    = {}   # pid -> last continuity counter
+
+	def _check_continuity(self, data, offset, pid, payload):
+		"""Checks the continuity counter of a packet
+
+		Returns:
+			False if the packet is a duplicate that should be skipped, otherwise True. A gap drops the partial
+			section of the PID.
+		"""
+		cc = _get_continuity_counter(data, offset)
+		last = self._continuity.get(pid)
+		self._continuity[pid] = cc
+		if last is None: return True
+		if payload is None: return True # adaptation only packets do not increment the counter
+		if cc == (last + 1) & 0x0f: return True
+		if cc == last: return False # duplicate packet
+		if (ts_packet.has_adaptation_field(data, offset) and ts_packet.get_adaptation_field_length(data, offset) and
+		    ts_packet.get_discontinuity_indicator(data, offset)):
+			return True
+		self.cc_errors[pid] = self.cc_errors.get(pid, 0) + 1
+		self.pool.discard(pid)
+		return True
+
+	def feed(self, data, offset=0):
+		"""Passes a transport stream packet to the demux
+
+		Arguments:
+			data -- array of data bytes holding the packet (read in place)
+			offset -- offset of the packet in data (default 0)
+		Returns:
+			A list of (pid, section) tuples for the sections completed by the packet
+		"""
+		self.packets += 1
+		if _get_sync_byte(data, offset) != ts_packet.SYNC_BYTE:
+			self.sync_errors += 1
+			return []
+		pid = _get_pid(data, offset)
+		if self.pids is not None and pid not in self.pids: return []
+		if _get_transport_error_indicator(data, offset):
+			self.pool.discard(pid)
+			self._continuity.pop(pid, None)
+			return []
+		payload = _get_payload_offset(data, offset)
+		if not self._check_continuity(data, offset, pid, payload): return []
+		if payload is None: return []
+
+		end = offset + TS_PACKET_SIZE
+		if not _get_payload_unit_start_indicator(data, offset):
+			if not self.pool.has_partial(pid): return []
+			return [(pid, section) for section in self.pool.add_data(pid, data[payload:end])]
+
+		start = payload + 1 + data[payload]
+		if start >= end:
+			self.pointer_errors += 1
+			self.pool.discard(pid)
+			return []
+		sections = []
+		if start > payload + 1 and self.pool.has_partial(pid):
+			sections = self.pool.add_data(pid, data[payload+1:start])
+			self.pool.discard(pid) # whatever is left did not make a whole section
+		sections += self.pool.add_data(pid, data[start:end], start=True)
+		return [(pid, section) for section in sections]
+
+	def feed_packets(self, data, offset=0, end=None):
+		"""Passes a buffer of back to back transport stream packets to the demux
+
+		Arguments:
+			data -- array of data bytes holding the packets
+			offset -- offset of the first packet in data (default 0)
+			end -- offset after the last packet (default None, the end of data)
+		Returns:
+			A list of (pid, section) tuples for the completed sections
+		"""
+		if end is None: end = len(data)
+		sections = []
+		while offset + TS_PACKET_SIZE <= end:
+			found = self.feed(data, offset)
+			if found: sections += found
+			offset += TS_PACKET_SIZE
+		return sections
+
+	def get_cc_error_count(self, pid=None):
+		"""Gets the number of continuity counter errors for the PID (or all PIDs if None)"""
+		if pid is None: return sum(self.cc_errors.values())
+		return self.cc_errors.get(pid, 0)
+
+'''UNIT TESTS -------------------------------------------------------------------------------------------------------------
+---------------------------------------------------------------------------------------------------------------------------
+'''
+if __name__ == '__main__':
+	import unittest
+	import _known_tables
+
+	nit_data_0 = _known_tables.get_sample_nit_data()[0]
+	nit_data_1 = _known_tables.get_sample_nit_data()[1]
+	cat_data   = _known_tables.get_sample_cat_data()[0]
+
+	def packetize(*sections):
+		packets = []
+		cc = 0
+		for data in sections:
+			new, cc = ts_packet.packetize_section(data, 0x10, cc)
+			packets += new
+		return packets
+
+	def tables(found):
+		return [(pid, section.table_id, section.section_number) for pid, section in found]
+
+	class Resync(unittest.TestCase):
+		def setUp(self):
+			self.demux = Demux()
+
+		def feed(self, packets):
+			found = []
+			for packet in packets: found += self.demux.feed(packet)
+			return found
+
+		def testClean(self):
+			found = self.demux.feed_packets(bytearray().join(packetize(nit_data_0, nit_data_1)))
+			self.assertEqual([(0x10, 0x40, 0), (0x10, 0x40, 1)], tables(found))
+			self.assertEqual(0xCF1BECB1, found[1][1].crc)
+
+		def testLostPacket(self):
+			packets = packetize(nit_data_0, nit_data_1)
+			del packets[2]
+			self.assertEqual([(0x10, 0x40, 1)], tables(self.feed(packets)))
+			self.assertEqual(1, self.demux.get_cc_error_count(0x10))
+			self.assertEqual(1, self.demux.pool.get_drop_count(0x10))
+			self.assertEqual(0, self.demux.pool.memory)
+
+		def testDuplicate(self):
+			packets = packetize(nit_data_0)
+			packets.insert(2, packets[1])
+			self.assertEqual([(0x10, 0x40, 0)], tables(self.feed(packets)))
+			self.assertEqual(0, self.demux.get_cc_error_count())
+
+		def testTransportError(self):
+			packets = packetize(nit_data_0, cat_data)
+			packets[3][1] |= 0x80
+			self.assertEqual([(0x10, 0x01, 0)], tables(self.feed(packets)))
+
+		def testBadLength(self):
+			bad = list(nit_data_1)
+			bad[1] |= 0x0F
+			bad[2] = 0xFF
+			found = self.feed(packetize(bad, cat_data))
+			self.assertEqual([(0x10, 0x01, 0)], tables(found))
+			self.assertEqual(1, self.demux.pool.length_errors)
+
+		def testPointerField(self):
+			# the end of the NIT and the start of the CAT share a packet
+			packets = packetize(nit_data_0)[0:5]
+			tail = bytearray(nit_data_0[183 + 4 * 184:])
+			last = ts_packet.create_packet(0x10, 5, True)
+			last[4] = len(tail)
+			last[5:5+len(tail)+len(cat_data)] = tail + bytearray(cat_data)
+			self.assertEqual([(0x10, 0x40, 0), (0x10, 0x01, 0)], tables(self.feed(packets + [last])))
+			self.assertEqual(0, self.demux.pool.get_drop_count(0x10))
+
+		def testBadPointerField(self):
+			packets = packetize(cat_data, cat_data)
+			packets[1][4] = 200
+			self.assertEqual([(0x10, 0x01, 0)], tables(self.feed(packets)))
+			self.assertEqual(1, self.demux.pointer_errors)
+
+		def testNoStart(self):
+			packets = packetize(nit_data_0, cat_data)
+			self.assertEqual([(0x10, 0x01, 0)], tables(self.feed(packets[1:])))
+
+		def testPidFilter(self):
+			self.demux.pids = set([0x11])
+			self.assertEqual([], self.feed(packetize(cat_data)))
+
+	unittest.main()
@@ -0,0 +1,82 @@
+"""descriptor module
+
+	Provides functions to walk a descriptor loop in place. Descriptors are not decoded or copied as the loop
+	is walked, only their tag, offset and length are read, so a caller looking for one descriptor only pays
+	for the descriptors ahead of it.
+"""
+
+import field_spec
+
+# Header of every descriptor
+DESCRIPTOR_FIELDS = [
+	('descriptor_tag',    0, 0, 8, 'descriptor tag'),
+	('descriptor_length', 1, 0, 8, 'descriptor length'),
+]
+_FIELDS = field_spec.compile_fields(DESCRIPTOR_FIELDS, relative=True)
+get_descriptor_tag    = _FIELDS['get_descriptor_tag']
+get_descriptor_length = _FIELDS['get_descriptor_length']
+
+NETWORK_NAME_TAG          = 0x40
+SERVICE_LIST_TAG          = 0x41
+SATELLITE_DELIVERY_TAG    = 0x43
+CABLE_DELIVERY_TAG        = 0x44
+TERRESTRIAL_DELIVERY_TAG  = 0x5A
+DELIVERY_SYSTEM_TAGS      = (SATELLITE_DELIVERY_TAG, CABLE_DELIVERY_TAG, TERRESTRIAL_DELIVERY_TAG)
+
+def iter_descriptors(data, offset, end):
+	"""Walks a descriptor loop
+
+	A descriptor running past the end of the loop ends the walk.
+	Arguments:
+		data -- array of data bytes holding the loop
+		offset -- offset of the first descriptor in data
+		end -- offset after the last byte of the loop
+	Yields:
+		(tag, payload offset, payload length) for each descriptor, the payload being the bytes following the
+		descriptor tag and length
+	"""
+	while offset + 2 <= end:
+		tag    = get_descriptor_tag(data, offset)
+		length = get_descriptor_length(data, offset)
+		if offset + 2 + length > end: return
+		yield tag, offset + 2, length
+		offset += 2 + length
+
+def find_descriptor(data, offset, end, tags):
+	"""Finds the first descriptor of a loop with one of the given tags
+
+	Arguments:
+		data -- array of data bytes holding the loop
+		offset -- offset of the first descriptor in data
+		end -- offset after the last byte of the loop
+		tags -- tag or tuple of tags to look for
+	Returns:
+		(tag, payload) where payload is a copy of the descriptor payload bytes, or None if there is none
+	"""
+	if not isinstance(tags, tuple): tags = (tags,)
+	for tag, start, length in iter_descriptors(data, offset, end):
+		if tag in tags: return tag, data[start:start+length]
+	return None
+
+'''UNIT TESTS -------------------------------------------------------------------------------------------------------------
+---------------------------------------------------------------------------------------------------------------------------
+'''
+if __name__ == '__main__':
+	import unittest
+
+	loop = [0x40, 0x02, 0x41, 0x42, 0x09, 0x00, 0x43, 0x03, 0x01, 0x02, 0x03, 0x44, 0x05, 0x00]
+
+	class Descriptors(unittest.TestCase):
+		def testIterate(self):
+			self.assertEqual([(0x40, 2, 2), (0x09, 6, 0), (0x43, 8, 3)], list(iter_descriptors(loop, 0, len(loop))))
+
+		def testBounds(self):
+			self.assertEqual([(0x09, 6, 0)], list(iter_descriptors(loop, 4, 6)))
+			self.assertEqual([], list(iter_descriptors(loop, 0, 3)))
+
+		def testFind(self):
+			self.assertEqual((0x43, [1, 2, 3]), find_descriptor(loop, 0, len(loop), DELIVERY_SYSTEM_TAGS))
+			self.assertEqual((0x40, [0x41, 0x42]), find_descriptor(loop, 0, len(loop), NETWORK_NAME_TAG))
+			self.assertEqual(None, find_descriptor(loop, 0, len(loop), 0x44))
+
+	unittest.main()
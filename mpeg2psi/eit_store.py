@@ -0,0 +1,412 @@
+"""EIT store module
+
+	Provides an EitStore class that keeps the events of DVB Event Information Table sections in columns (typed
+	arrays, one per field) instead of Section objects. Repeated sections are skipped on their version and CRC
+	before any event is read, repeated events are stored once and the descriptor loops of all events share one
+	byte pool, compacted once the loops of replaced events take up more than half of it. Each service keeps its
+	events sorted by start time so that a time range query is a binary search. Sections that are incomplete or
+	fail their CRC check are counted and dropped, as Demux and MuxCounters do.
+"""
+
+import array
+import bisect
+
+import field_spec
+import section_parser as sparse
+import section_builder as sbuild
+
+EIT_TABLE_IDS = range(0x4E, 0x70) # present/following and schedule, actual and other transport stream
+
+UNIX_EPOCH_MJD = 40587 # 1970-01-01
+
+# Start of the EIT payload (offsets from the start of the section)
+EIT_FIELDS = [
+	('transport_stream_id',         8,  0, 16, 'transport stream ID'),
+	('original_network_id',         10, 0, 16, 'original network ID'),
+	('segment_last_section_number', 12, 0, 8,  'segment last section number'),
+	('last_table_id',               13, 0, 8,  'last table ID'),
+]
+_FIELDS = field_spec.compile_fields(EIT_FIELDS)
+_get_transport_stream_id = _FIELDS['get_transport_stream_id']
+_get_original_network_id = _FIELDS['get_original_network_id']
+
+# One entry of the event loop
+EIT_EVENT_FIELDS = [
+	('event_id',                0,  0, 16, 'event ID'),
+	('start_mjd',               2,  0, 16, 'start date as a modified Julian date'),
+	('running_status',          10, 0, 3,  'running status'),
+	('free_ca_mode',            10, 3, 1,  'free CA mode'),
+	('descriptors_loop_length', 10, 4, 12, 'descriptors loop length'),
+]
+_EVENT_FIELDS = field_spec.compile_fields(EIT_EVENT_FIELDS, relative=True)
+_get_event_id                = _EVENT_FIELDS['get_event_id']
+_get_start_mjd               = _EVENT_FIELDS['get_start_mjd']
+_get_running_status          = _EVENT_FIELDS['get_running_status']
+_get_descriptors_loop_length = _EVENT_FIELDS['get_descriptors_loop_length']
+
+EVENT_LOOP_OFFSET = 14
+EVENT_HEADER_SIZE = 12
+
+COMPACT_MIN_SIZE = 64 * 1024 # bytes of replaced descriptor loops before the pool is compacted
+
+def _bcd(value):
+	return (value >> 4) * 10 + (value & 0x0f)
+
+def decode_duration(data, offset=0):
+	"""Decodes a 3 byte BCD duration (hours, minutes, seconds) into seconds"""
+	return _bcd(data[offset]) * 3600 + _bcd(data[offset+1]) * 60 + _bcd(data[offset+2])
+
+def decode_time(data, offset=0):
+	"""Decodes a 5 byte MJD + BCD time into seconds since the Unix epoch (UTC)
+
+	Returns:
+		The time or None if the time is undefined (all bits set)
+	"""
+	mjd = (data[offset] << 8) | data[offset+1]
+	if mjd == 0xffff and data[offset+2] == 0xff: return None
+	return (mjd - UNIX_EPOCH_MJD) * 86400 + decode_duration(data, offset + 2)
+
+class EitStore(object):
+	"""Columnar store of EIT events
+
+	Events are identified by (original network ID, transport stream ID, service ID, event ID) and are held as
+	rows of the column arrays below, a row number being the index of the event in every column. An event
+	sent again with new data is updated in place. An event left out of a new version of the section that last
+	carried it is removed and its row is reused for a later event.
+	"""
+	def __init__(self, check_crc=True, compact_min_size=COMPACT_MIN_SIZE):
+		"""Constructor
+
+		Arguments:
+			check_crc -- if True the CRC of each new section is checked (default True)
+			compact_min_size -- bytes of replaced descriptor loops below which the pool is never compacted
+			                    (default COMPACT_MIN_SIZE)
+		"""
+		self.check_crc             = check_crc
+		self.compact_min_size      = compact_min_size
+		self.original_network_ids  = array.array('H')
+		self.transport_stream_ids  = array.array('H')
+		self.service_ids           = array.array('H')
+		self.event_ids             = array.array('H')
+		self.start_times           = array.array('l')
+		self.durations             = array.array('l')
+		self.running_statuses      = array.array('B')
+		self.descriptor_offsets    = array.array('L')
+		self.descriptor_lengths    = array.array('H')
+		self.descriptor_pool       = bytearray()
+		self.pool_garbage          = 0 # bytes of the pool no longer used by any event
+		self.sections_skipped      = 0
+		self.length_errors         = 0
+		self.crc_errors            = 0
+		self._sections  = {} # (onid, tsid, service id, table id, section number) -> (version, crc)
+		self._carried   = {} # section key -> frozenset of the event keys in its current version
+		self._owners    = {} # event key -> key of the section that last carried the event
+		self._rows      = {} # (onid, tsid, service id, event id) -> row
+		self._free_rows = [] # rows of removed events
+		self._services  = {} # (onid, tsid, service id) -> (array of start times, array of rows), sorted by start
+		self._longest   = {} # (onid, tsid, service id) -> longest event duration
+		self._by_id     = {} # service id -> list of (onid, tsid, service id)
+
+	def __len__(self):
+		return len(self._rows)
+
+	def _index(self, service, start, row):
+		"""Adds a row to the start time index of its service"""
+		index = self._services.get(service)
+		if index is None:
+			index = (array.array('l'), array.array('L'))
+			self._services[service] = index
+			self._by_id.setdefault(service[2], []).append(service)
+		i = bisect.bisect_right(index[0], start)
+		index[0].insert(i, start)
+		index[1].insert(i, row)
+
+	def _unindex(self, service, start, row):
+		"""Removes a row from the start time index of its service"""
+		starts, rows = self._services[service]
+		i = bisect.bisect_left(starts, start)
+		while rows[i] != row: i += 1
+		del starts[i]
+		del rows[i]
+
+	def add_section(self, section):
+		"""Adds the events of an EIT section
+
+		A section already added with the same version and CRC is skipped without reading its events. An
+		incomplete section, or one whose length cannot hold the EIT header, counts as a length error and one
+		whose CRC does not match its data as a CRC error; neither is read.
+		Arguments:
+			section -- complete Section (or subclass) object of an EIT section
+		Returns:
+			The number of events added, changed or removed
+		"""
+		data = section.data_cache
+		table_id = sparse.get_table_id(data)
+		if table_id not in EIT_TABLE_IDS: raise ValueError('not an EIT section (table id 0x%02x)'%(table_id))
+		length = sparse.get_section_length(data) + 3
+		if not section.complete or len(data) < length or length < EVENT_LOOP_OFFSET + 4:
+			self.length_errors += 1
+			return 0
+		end = length - 4
+		service = (_get_original_network_id(data), _get_transport_stream_id(data), sparse.get_table_id_extension(data))
+		key = service + (table_id, sparse.get_section_number(data))
+		seen = (sparse.get_version_number(data), tuple(data[end:end+4]))
+		if self._sections.get(key) == seen:
+			self.sections_skipped += 1
+			return 0
+		if self.check_crc and not sbuild.check_crc(data[0:length]):
+			self.crc_errors += 1
+			return 0
+		self._sections[key] = seen
+
+		changed = 0
+		carried = set()
+		offset = EVENT_LOOP_OFFSET
+		while offset + EVENT_HEADER_SIZE <= end:
+			descriptors = offset + EVENT_HEADER_SIZE
+			stop = descriptors + _get_descriptors_loop_length(data, offset)
+			if stop > end: break
+			event = service + (_get_event_id(data, offset),)
+			carried.add(event)
+			if self._add_event(service, event, data, offset, descriptors, stop): changed += 1
+			offset = stop
+		for event in self._carried.get(key, ()):
+			if event not in carried and self._owners.get(event) == key:
+				self._remove_event(event)
+				changed += 1
+		for event in carried:
+			if event in self._rows: self._owners[event] = key
+		self._carried[key] = frozenset(carried)
+		return changed
+
+	def _add_event(self, service, key, data, offset, descriptors, stop):
+		"""Adds or updates one event, returns True if the store changed"""
+		start    = decode_time(data, offset + 2)
+		if start is None: return False # no schedule time, nothing to index it by
+		duration = decode_duration(data, offset + 7)
+		status   = _get_running_status(data, offset)
+		blob     = data[descriptors:stop]
+		row = self._rows.get(key)
+		if row is not None:
+			pool_offset = self.descriptor_offsets[row]
+			old_blob = self.descriptor_pool[pool_offset:pool_offset + self.descriptor_lengths[row]]
+			if (self.start_times[row] == start and self.durations[row] == duration and
+			    self.running_statuses[row] == status and old_blob == bytearray(blob)):
+				return False
+			if self.start_times[row] != start:
+				self._unindex(service, self.start_times[row], row)
+				self._index(service, start, row)
+			self.start_times[row]      = start
+			self.durations[row]        = duration
+			self.running_statuses[row] = status
+			if old_blob != bytearray(blob):
+				self.pool_garbage += len(old_blob)
+				self.descriptor_offsets[row] = len(self.descriptor_pool)
+				self.descriptor_lengths[row] = len(blob)
+				self.descriptor_pool.extend(blob)
+				self._maybe_compact()
+		elif self._free_rows:
+			row = self._free_rows.pop()
+			self._rows[key] = row
+			self.original_network_ids[row] = service[0]
+			self.transport_stream_ids[row] = service[1]
+			self.service_ids[row]          = service[2]
+			self.event_ids[row]            = key[3]
+			self.start_times[row]          = start
+			self.durations[row]            = duration
+			self.running_statuses[row]     = status
+			self.descriptor_offsets[row]   = len(self.descriptor_pool)
+			self.descriptor_lengths[row]   = len(blob)
+			self.descriptor_pool.extend(blob)
+			self._index(service, start, row)
+		else:
+			row = len(self.event_ids)
+			self._rows[key] = row
+			self.original_network_ids.append(service[0])
+			self.transport_stream_ids.append(service[1])
+			self.service_ids.append(service[2])
+			self.event_ids.append(key[3])
+			self.start_times.append(start)
+			self.durations.append(duration)
+			self.running_statuses.append(status)
+			self.descriptor_offsets.append(len(self.descriptor_pool))
+			self.descriptor_lengths.append(len(blob))
+			self.descriptor_pool.extend(blob)
+			self._index(service, start, row)
+		if duration > self._longest.get(service, 0): self._longest[service] = duration
+		return True
+
+	def _remove_event(self, key):
+		"""Removes an event, freeing its row and its descriptor loop"""
+		row = self._rows.pop(key)
+		del self._owners[key]
+		self._unindex(key[0:3], self.start_times[row], row)
+		self.pool_garbage += self.descriptor_lengths[row]
+		self.descriptor_lengths[row] = 0
+		self._free_rows.append(row)
+		self._maybe_compact()
+
+	def _maybe_compact(self):
+		"""Compacts the descriptor pool once replaced loops take more than compact_min_size and half of it"""
+		if self.pool_garbage > self.compact_min_size and self.pool_garbage * 2 > len(self.descriptor_pool):
+			self._compact()
+
+	def _compact(self):
+		"""Copies the descriptor loops still in use into a new pool, dropping those of replaced events
+
+		The old pool is left as it is, so views handed out by EitStore.get_descriptors() stay valid.
+		"""
+		pool, offsets, lengths = self.descriptor_pool, self.descriptor_offsets, self.descriptor_lengths
+		compacted = bytearray()
+		for row in xrange(len(offsets)):
+			offset = offsets[row]
+			offsets[row] = len(compacted)
+			compacted.extend(buffer(pool, offset, lengths[row]))
+		self.descriptor_pool = compacted
+		self.pool_garbage = 0
+
+	def find_events(self, service_id, start_time, end_time, original_network_id=None, transport_stream_id=None):
+		"""Finds the events of a service running at any point between two times
+
+		Arguments:
+			service_id -- service ID
+			start_time -- start of the time range, in seconds since the Unix epoch
+			end_time -- end of the time range (excluded)
+			original_network_id -- original network ID of the service (default None, any)
+			transport_stream_id -- transport stream ID of the service (default None, any)
+		Returns:
+			The list of rows of the events, sorted by start time for each service
+		"""
+		found = []
+		for service in self._by_id.get(service_id, ()):
+			if original_network_id is not None and service[0] != original_network_id: continue
+			if transport_stream_id is not None and service[1] != transport_stream_id: continue
+			starts, rows = self._services[service]
+			i = bisect.bisect_right(starts, start_time - self._longest.get(service, 0))
+			last = bisect.bisect_left(starts, end_time)
+			durations = self.durations
+			for j in xrange(i, last):
+				if starts[j] + durations[rows[j]] > start_time: found.append(rows[j])
+		return found
+
+	def get_event(self, row):
+		"""Gets (service id, event id, start time, duration, running status) of the event at a row
+
+		Only rows handed out by EitStore.find_events() since the last EitStore.add_section() are valid, the row of
+		a removed event being reused.
+		"""
+		return (self.service_ids[row], self.event_ids[row], self.start_times[row], self.durations[row],
+		        self.running_statuses[row])
+
+	def get_descriptors(self, row):
+		"""Gets a read only view of the descriptor loop of the event at a row without copying it"""
+		return buffer(self.descriptor_pool, self.descriptor_offsets[row], self.descriptor_lengths[row])
+
+'''UNIT TESTS -------------------------------------------------------------------------------------------------------------
+---------------------------------------------------------------------------------------------------------------------------
+'''
+if __name__ == '__main__':
+	import unittest
+	from section import Section
+	import stream_generator
+	from stream_generator import StreamGenerator, build_section, encode_time, encode_duration
+
+	BASE_TIME = (stream_generator.BASE_MJD - UNIX_EPOCH_MJD) * 86400
+	HOUR = 3600
+
+	def eit(service_id, version, events, section_number=0, table_id=0x50):
+		payload = [0x00, 0x01, 0x00, 0x01, 0, table_id]
+		for event_id, start, duration, name in events:
+			descriptors = [0x4D, 5 + len(name)] + list(bytearray('eng')) + [len(name)] + list(bytearray(name)) + [0]
+			payload += [event_id >> 8, event_id & 0xff] + encode_time(start) + encode_duration(duration)
+			payload += [0x80 | (len(descriptors) >> 8), len(descriptors) & 0xff] + descriptors
+		return Section(build_section(table_id, service_id, version, section_number, 0, payload, True))
+
+	class Store(unittest.TestCase):
+		def setUp(self):
+			self.store = EitStore()
+
+		def testTime(self):
+			self.assertEqual(BASE_TIME + 86400 + 3723, decode_time(encode_time(86400 + 3723)))
+			self.assertEqual(5400, decode_duration(encode_duration(5400)))
+			self.assertEqual(None, decode_time([0xff] * 5))
+
+		def testGenerated(self):
+			generator = StreamGenerator(programs=3, eit_schedule_sections=4, psi_interval=2000)
+			sections = []
+			for key, pid, build in generator._tables():
+				if pid == stream_generator.EIT_PID:
+					sections += [Section(data) for data in generator.get_sections(key, pid, build)]
+			for section in sections + sections: self.store.add_section(section)
+			self.assertEqual(3 * 16, len(self.store))
+			self.assertEqual(len(sections), self.store.sections_skipped)
+			rows = self.store.find_events(2, BASE_TIME + 2 * HOUR, BASE_TIME + 3 * HOUR)
+			self.assertEqual([4, 5], [self.store.get_event(row)[1] for row in rows])
+			self.assertEqual('Event 4', str(self.store.get_descriptors(rows[0]))[6:13])
+
+		def testRange(self):
+			self.store.add_section(eit(7, 0, [(1, 0, 6 * HOUR, 'long'), (2, 6 * HOUR, HOUR, 'a'),
+			                                  (3, 7 * HOUR, HOUR, 'b'), (4, 8 * HOUR, HOUR, 'c')]))
+			ids = lambda rows: [self.store.get_event(row)[1] for row in rows]
+			self.assertEqual([1], ids(self.store.find_events(7, BASE_TIME + 5 * HOUR, BASE_TIME + 6 * HOUR)))
+			self.assertEqual([1, 2], ids(self.store.find_events(7, BASE_TIME + 5 * HOUR, BASE_TIME + 6 * HOUR + 1)))
+			self.assertEqual([3, 4], ids(self.store.find_events(7, BASE_TIME + 7 * HOUR + 30, BASE_TIME + 9 * HOUR)))
+			self.assertEqual([], ids(self.store.find_events(7, BASE_TIME + 9 * HOUR, BASE_TIME + 10 * HOUR)))
+			self.assertEqual([], ids(self.store.find_events(8, BASE_TIME, BASE_TIME + 10 * HOUR)))
+			self.assertEqual([], ids(self.store.find_events(7, BASE_TIME, BASE_TIME + HOUR, original_network_id=2)))
+
+		def testUpdate(self):
+			self.assertEqual(2, self.store.add_section(eit(7, 0, [(1, 0, HOUR, 'a'), (2, HOUR, HOUR, 'b')])))
+			pool = len(self.store.descriptor_pool)
+			# new version: event 1 unchanged, event 2 moved and renamed, event 3 added
+			self.assertEqual(2, self.store.add_section(eit(7, 1, [(1, 0, HOUR, 'a'), (2, 3 * HOUR, HOUR, 'c'),
+			                                                      (3, HOUR, HOUR, 'd')])))
+			self.assertEqual(3, len(self.store))
+			self.assertEqual(pool + 2 * len(self.store.get_descriptors(0)), len(self.store.descriptor_pool))
+			ids = [self.store.get_event(row)[1] for row in self.store.find_events(7, BASE_TIME, BASE_TIME + 5 * HOUR)]
+			self.assertEqual([1, 3, 2], ids)
+			self.assertEqual('c', str(self.store.get_descriptors(1))[6])
+			# event 2 cancelled, then event 4 added in its row
+			self.assertEqual(1, self.store.add_section(eit(7, 2, [(1, 0, HOUR, 'a'), (3, HOUR, HOUR, 'd')])))
+			self.assertEqual(2, len(self.store))
+			ids = [self.store.get_event(row)[1] for row in self.store.find_events(7, BASE_TIME, BASE_TIME + 5 * HOUR)]
+			self.assertEqual([1, 3], ids)
+			self.assertEqual(1, self.store.add_section(eit(7, 3, [(1, 0, HOUR, 'a'), (3, HOUR, HOUR, 'd'),
+			                                                      (4, 2 * HOUR, HOUR, 'e')])))
+			self.assertEqual(3, len(self.store.event_ids))
+			ids = [self.store.get_event(row)[1] for row in self.store.find_events(7, BASE_TIME, BASE_TIME + 5 * HOUR)]
+			self.assertEqual([1, 3, 4], ids)
+			# an event moved to another section is not removed by a new version of the section it left
+			self.store.add_section(eit(7, 0, [(4, 2 * HOUR, HOUR, 'e')], section_number=1))
+			self.assertEqual(0, self.store.add_section(eit(7, 4, [(1, 0, HOUR, 'a'), (3, HOUR, HOUR, 'd')])))
+			self.assertEqual(3, len(self.store))
+
+		def testCompact(self):
+			self.store = EitStore(compact_min_size=100)
+			self.store.add_section(eit(7, 0, [(1, 0, HOUR, 'kept'), (2, HOUR, HOUR, 'name 0')]))
+			kept = str(self.store.get_descriptors(0))
+			for version in xrange(1, 32):
+				view = self.store.get_descriptors(1)
+				name = str(view)[6:-1]
+				self.store.add_section(eit(7, version, [(1, 0, HOUR, 'kept'), (2, HOUR, HOUR, 'name %d'%(version))]))
+				self.assertEqual(name, str(view)[6:-1])
+				self.assertEqual('name %d'%(version), str(self.store.get_descriptors(1))[6:-1])
+			self.assertTrue(len(self.store.descriptor_pool) <= 2 * (100 + len(kept)) + 2 * 15)
+			self.assertEqual(kept, str(self.store.get_descriptors(0)))
+			self.assertEqual(2, len(self.store))
+
+		def testInvalid(self):
+			section = eit(7, 0, [(1, 0, HOUR, 'a')])
+			bad = list(section.data_cache)
+			bad[-1] ^= 0xff
+			self.assertEqual(0, self.store.add_section(Section(bad)))
+			self.assertEqual(1, self.store.crc_errors)
+			self.assertEqual(0, self.store.add_section(Section(section.data_cache[:-5])))
+			self.assertEqual(1, self.store.length_errors)
+			self.assertEqual(0, len(self.store))
+			self.assertEqual(1, self.store.add_section(section))
+
+		def testNotEit(self):
+			self.assertRaises(ValueError, self.store.add_section, Section(build_section(0x42, 1, 0, 0, 0, [0] * 8)))
+
+	unittest.main()
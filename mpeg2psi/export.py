@@ -0,0 +1,246 @@
+"""export module
+
+	Provides NdjsonWriter and ColumnarWriter classes to stream parsed sections to a file. The NDJSON writer
+	writes one JSON object per line straight from the header fields (and Pat.table). The columnar writer
+	collects the header fields into typed arrays, one per column, and writes them out in blocks of big endian
+	values of a fixed size whatever the platform.
+	Both write as they go so memory use does not depend on the number of sections exported.
+"""
+
+import array
+import math
+import struct
+
+# Columns of the columnar format: (name, struct format code of the big endian standard size value, section
+# attribute)
+COLUMNS = [
+	('pid',                    'H', None),
+	('capture_time',           'd', None),
+	('table_id',               'B', 'table_id'),
+	('section_length',         'H', 'section_length'),
+	('table_id_extension',     'H', 'table_id_extension'),
+	('version',                'B', 'version'),
+	('current_next_indicator', 'B', 'current_next_indicator'),
+	('section_number',         'B', 'section_number'),
+	('last_section_number',    'B', 'last_section_number'),
+	('crc',                    'I', 'crc'),
+]
+
+COLUMNAR_MAGIC   = 'PSIC'
+_BLOCK_HEADER    = struct.Struct('>4sI') # magic, row count
+
+# array type code able to hold the values of each struct format code on every platform
+_ARRAY_CODES = {'B': 'B', 'H': 'H', 'I': 'L', 'd': 'd'}
+
+_SHORT_RECORD = ('{"pid":%s,"time":%s,"table_id":%d,"section_syntax_indicator":%s,"private_indicator":%s,'
+                 '"section_length":%d')
+_LONG_RECORD  = (',"table_id_extension":%d,"version":%d,"current_next_indicator":%s,"section_number":%d,'
+                 '"last_section_number":%d,"crc":%d')
+_JSON_BOOL    = {True: 'true', False: 'false'}
+
+def _json_value(value):
+	"""Formats an int or float as JSON, None and non finite floats (which JSON cannot hold) as null"""
+	if value is None: return 'null'
+	if isinstance(value, float):
+		if math.isinf(value) or math.isnan(value): return 'null'
+		return repr(value)
+	return '%d'%(value)
+
+class NdjsonWriter(object):
+	"""Writes sections as newline delimited JSON
+
+	Lines are written out in batches of batch_lines.
+	"""
+	def __init__(self, f, batch_lines=1024):
+		"""Constructor
+
+		Arguments:
+			f -- file object opened for writing
+			batch_lines -- number of lines collected before each write (default 1024)
+		"""
+		self.file        = f
+		self.batch_lines = batch_lines
+		self.count       = 0
+		self._lines      = []
+
+	def write(self, section, pid=None, capture_time=None):
+		"""Writes a complete section
+
+		Arguments:
+			section -- complete Section (or subclass) object
+			pid -- PID the section was carried on (default None)
+			capture_time -- time the section was received in seconds (default None)
+		"""
+		line = _SHORT_RECORD%(_json_value(pid), _json_value(capture_time), section.table_id,
+		                      _JSON_BOOL[section.section_syntax_indicator], _JSON_BOOL[section.private_indicator],
+		                      section.section_length)
+		if section.extended_header:
+			line += _LONG_RECORD%(section.table_id_extension, section.version,
+			                      _JSON_BOOL[section.current_next_indicator], section.section_number,
+			                      section.last_section_number, section.crc)
+		table = getattr(section, 'table', None)
+		if table is not None:
+			line += ',"programs":{%s}'%(','.join(['"%d":%d'%(prog, table[prog]) for prog in sorted(table)]))
+		self._lines.append(line + '}\n')
+		self.count += 1
+		if len(self._lines) >= self.batch_lines: self.flush()
+
+	def flush(self):
+		"""Writes out the collected lines"""
+		if self._lines:
+			self.file.write(''.join(self._lines))
+			self._lines = []
+
+	def close(self):
+		self.flush()
+
+class ColumnarWriter(object):
+	"""Writes section header fields in column blocks
+
+	Each block is a header (magic, row count) followed by every column in COLUMNS order, each value big endian
+	with the standard size of its struct format code. Short sections have their long header columns set to 0.
+	"""
+	def __init__(self, f, block_rows=4096):
+		"""Constructor
+
+		Arguments:
+			f -- file object opened for binary writing
+			block_rows -- number of rows per block (default 4096)
+		"""
+		self.file       = f
+		self.block_rows = block_rows
+		self.count      = 0
+		self._columns   = [array.array(_ARRAY_CODES[code]) for name, code, attr in COLUMNS]
+
+	def write(self, section, pid=0, capture_time=0.0):
+		"""Adds a complete section as a row
+
+		Arguments:
+			section -- complete Section (or subclass) object
+			pid -- PID the section was carried on (default 0)
+			capture_time -- time the section was received in seconds (default 0.0)
+		"""
+		columns = self._columns
+		columns[0].append(pid)
+		columns[1].append(capture_time)
+		columns[2].append(section.table_id)
+		columns[3].append(section.section_length)
+		if section.extended_header:
+			columns[4].append(section.table_id_extension)
+			columns[5].append(section.version)
+			columns[6].append(section.current_next_indicator and 1 or 0)
+			columns[7].append(section.section_number)
+			columns[8].append(section.last_section_number)
+			columns[9].append(section.crc)
+		else:
+			for column in columns[4:]: column.append(0)
+		self.count += 1
+		if len(columns[0]) >= self.block_rows: self.flush()
+
+	def flush(self):
+		"""Writes out the collected rows as a block"""
+		rows = len(self._columns[0])
+		if not rows: return
+		data = [_BLOCK_HEADER.pack(COLUMNAR_MAGIC, rows)]
+		for (name, code, attr), column in zip(COLUMNS, self._columns):
+			data.append(struct.pack('>%d%s'%(rows, code), *column))
+			del column[:]
+		self.file.write(''.join(data))
+
+	def close(self):
+		self.flush()
+
+def read_columnar(f):
+	"""Reads back a file written by ColumnarWriter
+
+	Arguments:
+		f -- file object opened for binary reading
+	Yields:
+		One dictionary per block mapping column names to arrays of values
+	"""
+	while True:
+		header = f.read(_BLOCK_HEADER.size)
+		if len(header) < _BLOCK_HEADER.size: return
+		magic, rows = _BLOCK_HEADER.unpack(header)
+		if magic != COLUMNAR_MAGIC: raise ValueError('not a columnar section block')
+		block = {}
+		for name, code, attr in COLUMNS:
+			layout = '>%d%s'%(rows, code)
+			block[name] = array.array(_ARRAY_CODES[code], struct.unpack(layout, f.read(struct.calcsize(layout))))
+		yield block
+
+'''UNIT TESTS -------------------------------------------------------------------------------------------------------------
+---------------------------------------------------------------------------------------------------------------------------
+'''
+if __name__ == '__main__':
+	import unittest
+	import json
+	from StringIO import StringIO
+	import _known_tables
+	from section import Section
+	from pat import Pat
+
+	nit_data_0 = _known_tables.get_sample_nit_data()[0]
+	cat_data   = _known_tables.get_sample_cat_data()[0]
+	pat_data   = _known_tables.get_sample_pat_data()[0]
+
+	class Ndjson(unittest.TestCase):
+		def testLines(self):
+			f = StringIO()
+			writer = NdjsonWriter(f, batch_lines=2)
+			writer.write(Pat(pat_data), 0, 1.5)
+			writer.write(Section(cat_data), 1)
+			self.assertEqual(2, len(f.getvalue().splitlines()))
+			writer.write(Section(nit_data_0))
+			writer.close()
+			lines = [json.loads(line) for line in f.getvalue().splitlines()]
+			self.assertEqual(3, len(lines))
+			self.assertEqual(1.5, lines[0]['time'])
+			self.assertEqual(22, len(lines[0]['programs']))
+			self.assertEqual(1984, lines[0]['programs']['1605'])
+			self.assertEqual(0x9064C6D0, lines[1]['crc'])
+			self.assertEqual(None, lines[2]['pid'])
+			self.assertEqual(True, lines[2]['private_indicator'])
+			self.assertEqual(6144, lines[2]['table_id_extension'])
+
+		def testShortSection(self):
+			f = StringIO()
+			section = Section([0x72, 0x30, 0x02, 0xFF, 0xFF])
+			writer = NdjsonWriter(f)
+			writer.write(section)
+			writer.close()
+			line = json.loads(f.getvalue())
+			self.assertEqual(0x72, line['table_id'])
+			self.assertFalse('version' in line)
+
+		def testValues(self):
+			f = StringIO()
+			writer = NdjsonWriter(f)
+			writer.write(Section(cat_data), 10L, float('nan'))
+			writer.write(Section(cat_data), 11, float('inf'))
+			writer.write(Section(cat_data), 12, 1e20)
+			writer.close()
+			text = f.getvalue()
+			self.assertFalse('L' in text or 'nan' in text or 'inf' in text)
+			lines = [json.loads(line, parse_constant=lambda name: self.fail(name)) for line in text.splitlines()]
+			self.assertEqual([(10, None), (11, None), (12, 1e20)], [(line['pid'], line['time']) for line in lines])
+
+	class Columnar(unittest.TestCase):
+		def testBlocks(self):
+			f = StringIO()
+			writer = ColumnarWriter(f, block_rows=2)
+			for i in range(5):
+				writer.write(Section(nit_data_0), 0x10, float(i))
+			writer.write(Pat(pat_data), 0, 5.0)
+			writer.close()
+			f.seek(0)
+			blocks = list(read_columnar(f))
+			self.assertEqual([2, 2, 2], [len(block['pid']) for block in blocks])
+			self.assertEqual([4.0, 5.0], list(blocks[2]['capture_time']))
+			self.assertEqual([0x40, 0x00], list(blocks[2]['table_id']))
+			self.assertEqual([0xD9787E8A, 0xAAFE7CBF], list(blocks[2]['crc']))
+			self.assertEqual([6144, 16], list(blocks[2]['table_id_extension']))
+			# 2 + 8 + 1 + 2 + 2 + 1 + 1 + 1 + 1 + 4 bytes per row on every platform
+			self.assertEqual(3 * (_BLOCK_HEADER.size + 2 * 23), len(f.getvalue()))
+
+	unittest.main()
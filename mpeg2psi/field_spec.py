@@ -0,0 +1,198 @@
+"""field spec module
+
+	Provides functions to generate bit field getter and setter functions from a declarative field spec. Every
+	field is described once by a tuple (name, byte offset, first bit, bit width, description[, notes]), where
+	first bit is the position of the most significant bit of the field within the byte at byte offset (0 being
+	the MSB) and the optional notes explain what the field means. The getters and setters are generated as
+	source code once, at import time, with the masks and shifts of the field worked out so that parsing and
+	building always agree on the bit layout. Their docstrings are generated from the description, the notes and
+	the bit layout.
+"""
+
+# Basic section header, see section_parser and section_builder
+SECTION_HEADER_FIELDS = [
+	('table_id',                 0, 0, 8,  'table ID',
+	 'Identifies the table the section belongs to.'),
+	('section_syntax_indicator', 1, 0, 1,  'section syntax indicator',
+	 'If True, then this is an extended table. If False then it is a simple section.'),
+	('private_indicator',        1, 1, 1,  'private section indicator',
+	 'If True, then this is a private table. If False then it is a normal mpeg ts table (PAT, PMT, CAT).\n'
+	 'The two bits that follow it (bits 2 and 3 of the byte) are reserved.'),
+	('section_length',           1, 4, 12, 'section length',
+	 'Number of bytes of the section following the section length field, the CRC included. The entire\n'
+	 'section is section length + 3 bytes.'),
+	('table_id_extension',       3, 0, 16, 'table id extension',
+	 'Meaning depends on the table, the transport stream ID for a PAT or the program number for a PMT.'),
+	('version_number',           5, 2, 5,  'version number',
+	 'Version of the table, incremented (modulo 32) every time the table changes. The two bits ahead of it\n'
+	 '(bits 0 and 1 of the byte) are reserved.'),
+	('current_next_indicator',   5, 7, 1,  'current/next indicator',
+	 'If True, then this is the currently applicable table. If False then it will become applicable some\n'
+	 'time in the future.'),
+	('section_number',           6, 0, 8,  'section number',
+	 'SI tables come in sections. Each section is numbered, the first section of a table being 0.'),
+	('last_section_number',      7, 0, 8,  'last section number',
+	 'SI tables come in sections. This number allows the client to know how many sections are in the\n'
+	 'current table, it is the number of the last one.'),
+]
+
+def _byte_masks(byte_offset, first_bit, bit_width):
+	"""Splits a field into (byte index, field bit shift, byte mask, byte bit shift) tuples, one per byte
+
+	The field value is made up of the masked byte bits shifted down by the byte bit shift then up by the
+	field bit shift.
+	"""
+	last_bit = first_bit + bit_width       # one past the field's last bit, counted from the MSB of the first byte
+	byte_count = (last_bit + 7) // 8
+	parts = []
+	for i in range(byte_count):
+		lo = max(first_bit, i * 8)         # field bits held in this byte, counted from the first byte's MSB
+		hi = min(last_bit, (i + 1) * 8)
+		byte_shift  = (i + 1) * 8 - hi     # shift from the byte's LSB to the field bits
+		byte_mask   = ((1 << (hi - lo)) - 1) << byte_shift
+		field_shift = last_bit - hi        # position of these bits within the field value
+		parts.append((byte_offset + i, field_shift, byte_mask, byte_shift))
+	return parts
+
+def _index(byte_index, relative):
+	if relative: return 'data[offset+%d]'%(byte_index)
+	return 'data[%d]'%(byte_index)
+
+def _getter_source(name, byte_offset, first_bit, bit_width, relative):
+	terms = []
+	for byte_index, field_shift, byte_mask, byte_shift in _byte_masks(byte_offset, first_bit, bit_width):
+		term = _index(byte_index, relative)
+		if byte_mask != 0xff: term = '(%s & 0x%02x)'%(term, byte_mask)
+		shift = field_shift - byte_shift
+		if shift > 0:   term = '(%s << %d)'%(term, shift)
+		elif shift < 0: term = '(%s >> %d)'%(term, -shift)
+		terms.append(term)
+	expression = ' | '.join(terms)
+	if bit_width == 1: expression = '(%s) != 0'%(expression)
+	args = relative and 'data, offset=0' or 'data'
+	return 'def get_%s(%s):\n\treturn %s\n'%(name, args, expression)
+
+def _setter_source(name, byte_offset, first_bit, bit_width, relative):
+	lines = []
+	if bit_width == 1: lines.append('\tvalue = value and 1 or 0')
+	for byte_index, field_shift, byte_mask, byte_shift in _byte_masks(byte_offset, first_bit, bit_width):
+		target = _index(byte_index, relative)
+		shift = byte_shift - field_shift
+		if shift > 0:   term = '(value << %d)'%(shift)
+		elif shift < 0: term = '(value >> %d)'%(-shift)
+		else:           term = 'value'
+		if byte_mask == 0xff:
+			lines.append('\t%s = %s & 0xff'%(target, term))
+		else:
+			lines.append('\t%s = (%s & 0x%02x) | (%s & 0x%02x)'%(target, target, ~byte_mask & 0xff, term, byte_mask))
+	lines.append('\treturn value')
+	args = relative and 'data, value, offset=0' or 'data, value'
+	return 'def set_%s(%s):\n%s\n'%(name, args, '\n'.join(lines))
+
+def _layout_doc(byte_offset, first_bit, bit_width, relative):
+	"""Describes the bit layout of a field for its docstrings"""
+	text = '%d bit field starting at bit %d (0 being the MSB) of byte %d'%(bit_width, first_bit, byte_offset)
+	if relative: text += ' from the offset'
+	return text + '.'
+
+def _field_docs(name, byte_offset, first_bit, bit_width, description, notes, relative):
+	"""Generates the (getter, setter) docstrings of a field"""
+	details = []
+	if notes: details.append(notes.replace('\n', '\n\t'))
+	details.append(_layout_doc(byte_offset, first_bit, bit_width, relative))
+	data_arg = ['Arguments:', '\tdata -- List of bytes. Data to read']
+	offset_arg = relative and ['\toffset -- the byte at which the entry holding the field starts (default 0)'] or []
+	kind = bit_width == 1 and 'Boolean value' or 'value'
+	getter = (['Gets the %s from the given data'%(description), ''] + details + data_arg + offset_arg +
+	          ['Returns:', '\tthe %s%s'%(description, bit_width == 1 and ' as a boolean' or '')])
+	setter = (['Sets the %s in the given data'%(description), ''] + details +
+	          ['Given a block of data, sets the %s. The other bits of the bytes it shares are left as they are.'%(description),
+	           'Arguments:', '\tdata -- List of bytes. Data to manipulate', '\tvalue -- %s to set'%(kind)] + offset_arg +
+	          ['Returns:', '\tthe value that was set'])
+	return '\n\t'.join(getter) + '\n\t', '\n\t'.join(setter) + '\n\t'
+
+def compile_fields(fields, relative=False):
+	"""Generates the getter and setter functions for a field spec
+
+	For every field a get_<name>(data) function returning the field value and a set_<name>(data, value) function
+	setting it (and returning the value set) are generated. One bit fields are returned as booleans.
+	Arguments:
+		fields -- list of (name, byte offset, first bit, bit width, description[, notes]) tuples
+		relative -- if True the functions take an extra offset argument that is added to every byte offset,
+		used for the entries of table loops (default False)
+	Returns:
+		A dictionary mapping function names to the generated functions
+	"""
+	functions = {}
+	for field in fields:
+		name, byte_offset, first_bit, bit_width, description = field[0:5]
+		notes = len(field) > 5 and field[5] or None
+		source = (_getter_source(name, byte_offset, first_bit, bit_width, relative) +
+		          _setter_source(name, byte_offset, first_bit, bit_width, relative))
+		namespace = {}
+		exec compile(source, '<field %s>'%(name), 'exec') in namespace
+		getter = namespace['get_' + name]
+		setter = namespace['set_' + name]
+		getter.__doc__, setter.__doc__ = _field_docs(name, byte_offset, first_bit, bit_width, description, notes,
+		                                             relative)
+		functions[getter.__name__] = getter
+		functions[setter.__name__] = setter
+	return functions
+
+'''UNIT TESTS -------------------------------------------------------------------------------------------------------------
+---------------------------------------------------------------------------------------------------------------------------
+'''
+if __name__ == '__main__':
+	import unittest
+	import random
+
+	def slow_get(data, byte_offset, first_bit, bit_width):
+		bits = ''.join([format(byte, '08b') for byte in data[byte_offset:byte_offset+4]])
+		return int(bits[first_bit:first_bit+bit_width], 2)
+
+	class Fields(unittest.TestCase):
+		def testHeader(self):
+			functions = compile_fields(SECTION_HEADER_FIELDS)
+			data = [0x40, 0xF3, 0xF6, 0x18, 0x00, 0xC3, 0x00, 0x01]
+			self.assertEqual(0x40, functions['get_table_id'](data))
+			self.assertEqual(True, functions['get_section_syntax_indicator'](data))
+			self.assertEqual(True, functions['get_private_indicator'](data))
+			self.assertEqual(1014, functions['get_section_length'](data))
+			self.assertEqual(6144, functions['get_table_id_extension'](data))
+			self.assertEqual(1, functions['get_version_number'](data))
+			self.assertEqual(True, functions['get_current_next_indicator'](data))
+			self.assertEqual(1, functions['get_last_section_number'](data))
+
+		def testDocs(self):
+			functions = compile_fields(SECTION_HEADER_FIELDS)
+			doc = functions['get_current_next_indicator'].__doc__
+			self.assertTrue(doc.startswith('Gets the current/next indicator from the given data\n'))
+			self.assertTrue('\n\tIf True, then this is the currently applicable table.' in doc)
+			self.assertTrue('1 bit field starting at bit 7 (0 being the MSB) of byte 5.' in doc)
+			doc = compile_fields([('f', 2, 3, 13, 'thing')], relative=True)['set_f'].__doc__
+			self.assertTrue('of byte 2 from the offset.' in doc)
+			self.assertTrue('\n\t\toffset -- ' in doc)
+
+		def testRandom(self):
+			rand = random.Random(1)
+			for i in range(200):
+				first_bit = rand.randint(0, 7)
+				bit_width = rand.randint(1, 24)
+				spec = [('f', 1, first_bit, bit_width, 'f')]
+				functions = compile_fields(spec)
+				relative = compile_fields(spec, relative=True)
+				data = [rand.randint(0, 255) for j in range(6)]
+				self.assertEqual(slow_get(data, 1, first_bit, bit_width), int(functions['get_f'](data)))
+				value = rand.randint(0, (1 << bit_width) - 1)
+				expected = list(data)
+				functions['set_f'](expected, value)
+				self.assertEqual(value, int(functions['get_f'](expected)))
+				for j in range(6):
+					untouched = (j * 8 + 8 <= 8 + first_bit) or (j * 8 >= 8 + first_bit + bit_width)
+					if untouched: self.assertEqual(data[j], expected[j])
+				shifted = [0] + data
+				relative['set_f'](shifted, value, 1)
+				self.assertEqual(expected, shifted[1:])
+				self.assertEqual(value, int(relative['get_f'](shifted, 1)))
+
+	unittest.main()
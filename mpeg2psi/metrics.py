@@ -0,0 +1,299 @@
+"""metrics module
+
+	Provides MuxCounters, MetricsPublisher and MetricsServer classes to serve section and table counters over
+	HTTP in the Prometheus text format. The ingest thread counts into plain dictionaries and renders the full
+	metrics text from time to time, swapping it in with a single reference assignment. The HTTP server thread
+	only ever hands out the last rendered text, so a scrape never takes a lock or touches the counters.
+"""
+
+import time
+import threading
+import BaseHTTPServer
+import SocketServer
+
+import section_builder as sbuild
+
+CONTENT_TYPE = 'text/plain; version=0.0.4'
+METRICS_PATH = '/metrics'
+
+# (name, type, help) of every metric, in output order
+METRICS = [
+	('mpeg2psi_sections_total',                    'counter', 'Complete sections received'),
+	('mpeg2psi_crc_errors_total',                  'counter', 'Sections received with a bad CRC'),
+	('mpeg2psi_version_changes_total',             'counter', 'Table version changes'),
+	('mpeg2psi_repetition_interval_seconds',       'gauge',   'Last time between repetitions of a section'),
+	('mpeg2psi_repetition_interval_max_seconds',   'gauge',   'Longest time between repetitions of a section'),
+	('mpeg2psi_continuity_errors_total',           'counter', 'Continuity counter errors'),
+	('mpeg2psi_sync_errors_total',                 'counter', 'Packets without a sync byte'),
+]
+
+def _escape(value):
+	return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class MuxCounters(object):
+	"""Section and table counters of one multiplex
+
+	Only the ingest thread uses a MuxCounters object, nothing in it is locked.
+	"""
+	def __init__(self, mux, check_crc=True, clock=time.time):
+		"""Constructor
+
+		Arguments:
+			mux -- name of the multiplex, used as the mux label
+			check_crc -- if True the CRC of each section with an extended header is checked (default True)
+			clock -- function returning the current time in seconds (default time.time)
+		"""
+		self.mux          = mux
+		self.check_crc    = check_crc
+		self.clock        = clock
+		self.sections     = {} # (pid, table id) -> count
+		self.crc_errors   = {} # (pid, table id) -> count
+		self.changes      = {} # table id -> count
+		self.intervals    = {} # (pid, table id) -> [last interval, longest interval]
+		self.demux        = None
+		self._labels      = {} # (pid, table id) -> rendered labels
+		self._last_seen   = {} # (table id, table id extension, pid, section number) -> time
+		self._versions    = {} # (table id, table id extension) -> version
+
+	def _get_labels(self, key):
+		labels = self._labels.get(key)
+		if labels is None:
+			labels = 'mux="%s",pid="%d",table_id="%d"'%(_escape(self.mux), key[0], key[1])
+			self._labels[key] = labels
+		return labels
+
+	def add_section(self, pid, section, now=None):
+		"""Counts a complete section
+
+		Arguments:
+			pid -- PID the section was carried on
+			section -- complete Section (or subclass) object
+			now -- time the section was received in seconds (default None, the clock time)
+		"""
+		if now is None: now = self.clock()
+		key = (pid, section.table_id)
+		self.sections[key] = self.sections.get(key, 0) + 1
+		if not section.extended_header: return
+		if self.check_crc and not sbuild.check_crc(section.data_cache[0:section.length]):
+			self.crc_errors[key] = self.crc_errors.get(key, 0) + 1
+			return
+
+		table = (section.table_id, section.table_id_extension)
+		version = self._versions.get(table)
+		if version is not None and version != section.version:
+			self.changes[section.table_id] = self.changes.get(section.table_id, 0) + 1
+		self._versions[table] = section.version
+
+		repetition = table + (pid, section.section_number)
+		last = self._last_seen.get(repetition)
+		self._last_seen[repetition] = now
+		if last is None: return
+		interval = now - last
+		found = self.intervals.get(key)
+		if found is None: self.intervals[key] = [interval, interval]
+		else:
+			found[0] = interval
+			if interval > found[1]: found[1] = interval
+
+	def set_demux(self, demux):
+		"""Sets the Demux whose continuity and sync error counts are reported for the multiplex"""
+		self.demux = demux
+
+	def render(self, series):
+		"""Adds the metric lines of the multiplex to a dictionary of metric name -> list of lines"""
+		mux = _escape(self.mux)
+		for key, count in self.sections.iteritems():
+			series['mpeg2psi_sections_total'].append('{%s} %d'%(self._get_labels(key), count))
+		for key, count in self.crc_errors.iteritems():
+			series['mpeg2psi_crc_errors_total'].append('{%s} %d'%(self._get_labels(key), count))
+		for table_id, count in self.changes.iteritems():
+			series['mpeg2psi_version_changes_total'].append('{mux="%s",table_id="%d"} %d'%(mux, table_id, count))
+		for key, (last, longest) in self.intervals.iteritems():
+			labels = self._get_labels(key)
+			series['mpeg2psi_repetition_interval_seconds'].append('{%s} %.6f'%(labels, last))
+			series['mpeg2psi_repetition_interval_max_seconds'].append('{%s} %.6f'%(labels, longest))
+		if self.demux is not None:
+			for pid, count in self.demux.cc_errors.items():
+				series['mpeg2psi_continuity_errors_total'].append('{mux="%s",pid="%d"} %d'%(mux, pid, count))
+			series['mpeg2psi_sync_errors_total'].append('{mux="%s"} %d'%(mux, self.demux.sync_errors))
+
+class MetricsPublisher(object):
+	"""Renders the counters of every multiplex into the text served to scrapes
+
+	The ingest thread calls MetricsPublisher.maybe_publish() (or MetricsPublisher.publish()) and readers take
+	MetricsPublisher.text, the last rendered text.
+	"""
+	def __init__(self, min_interval=1.0, clock=time.time):
+		"""Constructor
+
+		Arguments:
+			min_interval -- minimum number of seconds between renderings in maybe_publish() (default 1.0)
+			clock -- function returning the current time in seconds (default time.time)
+		"""
+		self.min_interval = min_interval
+		self.clock        = clock
+		self.muxes        = []
+		self.published    = None
+		self.text         = ''
+
+	def add_mux(self, counters):
+		"""Adds the MuxCounters of a multiplex"""
+		self.muxes.append(counters)
+
+	def publish(self):
+		"""Renders the counters of every multiplex and swaps the new text in"""
+		series = dict([(name, []) for name, kind, text in METRICS])
+		for counters in self.muxes: counters.render(series)
+		lines = []
+		for name, kind, text in METRICS:
+			if not series[name]: continue
+			lines.append('# HELP %s %s\n# TYPE %s %s\n'%(name, text, name, kind))
+			lines.append(''.join(['%s%s\n'%(name, line) for line in series[name]]))
+		self.text = ''.join(lines)
+		self.published = self.clock()
+
+	def maybe_publish(self):
+		"""Publishes if min_interval has gone by since the last publish
+
+		Returns:
+			True if the text was rendered
+		"""
+		if self.published is not None and self.clock() - self.published < self.min_interval: return False
+		self.publish()
+		return True
+
+class _MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+	def do_GET(self):
+		if self.path.split('?')[0] != METRICS_PATH:
+			self.send_error(404)
+			return
+		text = self.server.publisher.text
+		self.send_response(200)
+		self.send_header('Content-Type', CONTENT_TYPE)
+		self.send_header('Content-Length', str(len(text)))
+		self.end_headers()
+		self.wfile.write(text)
+
+	def log_message(self, format, *args):
+		pass
+
+class _MetricsHttpServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+	daemon_threads      = True
+	allow_reuse_address = True
+
+class MetricsServer(object):
+	"""HTTP server for the metrics text of a MetricsPublisher, run in a daemon thread"""
+	def __init__(self, publisher, address=('127.0.0.1', 9107)):
+		"""Constructor
+
+		Arguments:
+			publisher -- MetricsPublisher to serve
+			address -- (host, port) to listen on, port 0 picks a free port (default ('127.0.0.1', 9107))
+		"""
+		self.server = _MetricsHttpServer(address, _MetricsHandler)
+		self.server.publisher = publisher
+		self.thread = None
+
+	@property
+	def port(self):
+		"""Port the server listens on"""
+		return self.server.server_address[1]
+
+	def start(self):
+		"""Starts serving in a daemon thread"""
+		self.thread = threading.Thread(target=self.server.serve_forever)
+		self.thread.daemon = True
+		self.thread.start()
+
+	def stop(self):
+		"""Stops serving and closes the socket"""
+		if self.thread is not None:
+			self.server.shutdown()
+			self.thread.join()
+			self.thread = None
+		self.server.server_close()
+
+'''UNIT TESTS -------------------------------------------------------------------------------------------------------------
+---------------------------------------------------------------------------------------------------------------------------
+'''
+if __name__ == '__main__':
+	import unittest
+	import urllib2
+	import _known_tables
+	from section import Section
+	from demux import Demux
+
+	nit_data_0 = _known_tables.get_sample_nit_data()[0]
+	cat_data   = _known_tables.get_sample_cat_data()[0]
+
+	class FakeClock(object):
+		def __init__(self): self.now = 0.0
+		def __call__(self): return self.now
+
+	class Counters(unittest.TestCase):
+		def setUp(self):
+			self.clock = FakeClock()
+			self.counters = MuxCounters('mux "a"', clock=self.clock)
+			self.publisher = MetricsPublisher(clock=self.clock)
+			self.publisher.add_mux(self.counters)
+
+		def testCounts(self):
+			for now in (0.0, 0.5, 1.5):
+				self.counters.add_section(0x10, Section(nit_data_0), now)
+			changed = list(cat_data)
+			sbuild.patch_version_number(changed, 3)
+			self.counters.add_section(0x01, Section(cat_data), 1.0)
+			self.counters.add_section(0x01, Section(changed), 2.0)
+			bad = list(cat_data)
+			bad[-1] ^= 0xff
+			self.counters.add_section(0x01, Section(bad), 3.0)
+			demux = Demux()
+			demux.sync_errors = 2
+			self.counters.set_demux(demux)
+			self.publisher.publish()
+			lines = self.publisher.text.splitlines()
+			labels = 'mux="mux \\"a\\"",pid="16",table_id="64"'
+			self.assertTrue('mpeg2psi_sections_total{%s} 3'%(labels) in lines)
+			self.assertTrue('mpeg2psi_repetition_interval_seconds{%s} 1.000000'%(labels) in lines)
+			self.assertTrue('mpeg2psi_repetition_interval_max_seconds{%s} 1.000000'%(labels) in lines)
+			self.assertTrue('mpeg2psi_crc_errors_total{mux="mux \\"a\\"",pid="1",table_id="1"} 1' in lines)
+			self.assertTrue('mpeg2psi_version_changes_total{mux="mux \\"a\\"",table_id="1"} 1' in lines)
+			self.assertTrue('mpeg2psi_sync_errors_total{mux="mux \\"a\\""} 2' in lines)
+			self.assertTrue('# TYPE mpeg2psi_sections_total counter' in lines)
+			self.assertFalse('mpeg2psi_continuity_errors_total' in self.publisher.text)
+
+		def testMaybePublish(self):
+			self.assertTrue(self.publisher.maybe_publish())
+			self.counters.add_section(0x01, Section(cat_data))
+			self.clock.now = 0.5
+			self.assertFalse(self.publisher.maybe_publish())
+			self.assertEqual('', self.publisher.text)
+			self.clock.now = 1.0
+			self.assertTrue(self.publisher.maybe_publish())
+			self.assertTrue('mpeg2psi_sections_total' in self.publisher.text)
+
+	class Server(unittest.TestCase):
+		def setUp(self):
+			self.publisher = MetricsPublisher()
+			counters = MuxCounters('mux1')
+			self.publisher.add_mux(counters)
+			counters.add_section(0x01, Section(cat_data))
+			self.publisher.publish()
+			self.server = MetricsServer(self.publisher, ('127.0.0.1', 0))
+			self.server.start()
+			self.url = 'http://127.0.0.1:%d'%(self.server.port)
+
+		def tearDown(self):
+			self.server.stop()
+
+		def testScrape(self):
+			response = urllib2.urlopen(self.url + METRICS_PATH)
+			self.assertEqual(CONTENT_TYPE, response.info()['Content-Type'])
+			self.assertEqual(self.publisher.text, response.read())
+			self.publisher.text = 'swapped\n'
+			self.assertEqual('swapped\n', urllib2.urlopen(self.url + METRICS_PATH).read())
+
+		def testNotFound(self):
+			self.assertRaises(urllib2.HTTPError, urllib2.urlopen, self.url + '/other')
+
+	unittest.main()
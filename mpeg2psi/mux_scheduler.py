@@ -0,0 +1,452 @@
+"""mux scheduler module
+
+	Provides a MuxScheduler class that runs the section reassembly of many multiplexes in one process and one
+	thread. Inputs (capture files and UDP sockets) are polled in a single select() loop and every ready input
+	gets one batch of packets per round, the round starting with a different multiplex each time so that no
+	input is starved. Each multiplex keeps its own Demux, while completed sections are shared through a
+	SectionCache of immutable SectionRecord objects (identical sections such as the NIT or EIT carried on several
+	multiplexes are stored once), along with the decoded descriptor loops of those records, and the CRC tables
+	are shared at module level. The CPU time spent on each multiplex is recorded so that host
+	capacity can be given in multiplexes per core.
+"""
+
+import errno
+import resource
+import select
+import socket
+import struct
+import time
+from collections import OrderedDict
+
+import section_parser as sparse
+import descriptor
+from demux import Demux
+from assembler_pool import AssemblerPool
+from section_record import SectionRecord
+from pcap_reader import get_ts_payload
+
+TS_PACKET_SIZE = 188
+MAX_DATAGRAM   = 65536
+
+def get_cpu_time():
+	"""Gets the user plus system CPU time used by the process in seconds"""
+	usage = resource.getrusage(resource.RUSAGE_SELF)
+	return usage.ru_utime + usage.ru_stime
+
+def _raw_section(data):
+	"""Assembler pool factory handing out the block of section data as it is"""
+	return data
+
+class SectionCache(object):
+	"""Least recently used cache of SectionRecord objects
+
+	Sections with an extended header are keyed by (pid, table id, table id extension, version, section number,
+	CRC), read from the header and the last 4 bytes without copying the data. A repeated section is handed
+	the record already built for it, records being immutable they are safely shared between every multiplex.
+	Sections without an extended header (TDT, TOT...) change on every repetition and are not cached. The
+	descriptor loops of the records are decoded once into tuples with SectionCache.get_descriptors(), shared in
+	the same way.
+	"""
+	def __init__(self, max_entries=4096):
+		"""Constructor
+
+		Arguments:
+			max_entries -- maximum number of records held, and of descriptor loops held (default 4096)
+		"""
+		self.max_entries       = max_entries
+		self.hits              = 0
+		self.misses            = 0
+		self.uncached          = 0
+		self.descriptor_hits   = 0
+		self.descriptor_misses = 0
+		self._records          = OrderedDict()
+		self._descriptors      = OrderedDict()
+
+	def __len__(self):
+		return len(self._records)
+
+	def get_record(self, pid, data):
+		"""Gets the record of a complete section, building it only if it is not cached
+
+		Arguments:
+			pid -- PID the section was carried on
+			data -- array of data bytes holding the entire section
+		Returns:
+			The SectionRecord
+		"""
+		if not sparse.get_section_syntax_indicator(data):
+			self.uncached += 1
+			return SectionRecord.from_data(data)
+		length = sparse.get_section_length(data) + 3
+		key = (pid, sparse.get_table_id(data), sparse.get_table_id_extension(data), sparse.get_version_number(data),
+		       sparse.get_section_number(data), struct.unpack_from('>I', data, length - 4)[0])
+		record = self._records.pop(key, None)
+		if record is None:
+			self.misses += 1
+			record = SectionRecord.from_data(data)
+			if len(self._records) >= self.max_entries: self._records.popitem(last=False)
+		else:
+			self.hits += 1
+		self._records[key] = record
+		return record
+
+	def get_descriptors(self, record, offset, end):
+		"""Gets the decoded descriptors of a descriptor loop of a record, decoding the loop only once
+
+		Arguments:
+			record -- SectionRecord handed out by SectionCache.get_record()
+			offset -- offset of the first descriptor in the section data
+			end -- offset after the last byte of the loop
+		Returns:
+			A tuple of (tag, payload string) tuples
+		"""
+		key = (record, offset, end)
+		descriptors = self._descriptors.pop(key, None)
+		if descriptors is None:
+			self.descriptor_misses += 1
+			payload = record.payload
+			descriptors = tuple([(tag, payload[start:start+length])
+			                     for tag, start, length in descriptor.iter_descriptors(bytearray(payload), offset, end)])
+			if len(self._descriptors) >= self.max_entries: self._descriptors.popitem(last=False)
+		else:
+			self.descriptor_hits += 1
+		self._descriptors[key] = descriptors
+		return descriptors
+
+class FileInput(object):
+	"""Capture file input, always ready until the end of the file"""
+	always_ready = True
+
+	def __init__(self, filename):
+		self.file = open(filename, 'rb')
+
+	def fileno(self):
+		return self.file.fileno()
+
+	def read(self, max_packets):
+		"""Reads up to max_packets packets, returns a bytearray or None at the end of the file"""
+		data = self.file.read(max_packets * TS_PACKET_SIZE)
+		if len(data) < TS_PACKET_SIZE: return None
+		return bytearray(data[0:len(data) - len(data) % TS_PACKET_SIZE])
+
+	def close(self):
+		self.file.close()
+
+class UdpInput(object):
+	"""UDP (or RTP over UDP) input, joining a multicast group if given one"""
+	always_ready = False
+
+	def __init__(self, port, group=None, interface='0.0.0.0', sock=None):
+		"""Constructor
+
+		Arguments:
+			port -- UDP port to listen on
+			group -- multicast group to join (default None, unicast)
+			interface -- address of the interface to listen and join on (default '0.0.0.0', any)
+			sock -- bound UDP socket to read from instead of creating one (default None)
+		"""
+		if sock is None:
+			sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+			sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+			sock.bind((group or interface, port))
+			if group:
+				membership = struct.pack('4s4s', socket.inet_aton(group), socket.inet_aton(interface))
+				sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+		sock.setblocking(False)
+		self.sock     = sock
+		self._buffer  = bytearray(MAX_DATAGRAM)
+		self._view    = memoryview(self._buffer)
+
+	def fileno(self):
+		return self.sock.fileno()
+
+	def read(self, max_packets):
+		"""Reads the datagrams waiting on the socket, up to about max_packets packets
+
+		Returns:
+			A bytearray of the packets read (possibly empty)
+		"""
+		packets = bytearray()
+		while len(packets) < max_packets * TS_PACKET_SIZE:
+			try:
+				size = self.sock.recv_into(self._view)
+			except socket.error, e:
+				if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK): break
+				raise
+			offset, length = get_ts_payload(self._buffer, 0, size)
+			if offset is not None: packets += self._view[offset:offset+length]
+		return packets
+
+	def close(self):
+		self.sock.close()
+
+class Mux(object):
+	"""One multiplex of the scheduler: its input, Demux and counters"""
+	def __init__(self, name, source, demux):
+		self.name     = name
+		self.source   = source
+		self.demux    = demux
+		self.done     = False
+		self.packets  = 0
+		self.sections = 0
+		self.batches  = 0
+		self.cpu_time = 0.0
+
+	def fileno(self):
+		return self.source.fileno()
+
+class MuxScheduler(object):
+	"""Single threaded scheduler of many multiplexes
+
+	Multiplexes are added with MuxScheduler.add_mux() and run with MuxScheduler.run() (or one round at a time
+	with MuxScheduler.run_once()). Completed sections are passed to callback(mux, pid, record) as SectionRecord
+	objects from the shared SectionCache, SectionRecord.to_section() parses one into a typed section.
+	"""
+	def __init__(self, callback=None, batch_packets=256, cache=None, cpu_clock=get_cpu_time, clock=time.time):
+		"""Constructor
+
+		Arguments:
+			callback -- function(mux, pid, record) called for every completed section (default None)
+			batch_packets -- maximum number of packets handled per multiplex per round (default 256)
+			cache -- SectionCache shared by every multiplex (default None, a new one)
+			cpu_clock -- function returning the CPU time used in seconds (default get_cpu_time)
+			clock -- function returning the current time in seconds (default time.time)
+		"""
+		self.callback      = callback
+		self.batch_packets = batch_packets
+		self.cache         = cache if cache is not None else SectionCache()
+		self.cpu_clock     = cpu_clock
+		self.clock         = clock
+		self.muxes         = []
+		self.rounds        = 0
+		self.start_time    = None
+		self._first        = 0
+
+	def add_mux(self, name, source, pids=None):
+		"""Adds a multiplex
+
+		Arguments:
+			name -- name of the multiplex
+			source -- FileInput, UdpInput or any object with always_ready, fileno(), read(max_packets) and close()
+			pids -- set of PIDs to reassemble sections for (default None, every PID)
+		Returns:
+			The Mux object
+		"""
+		demux = Demux(pids, AssemblerPool(factory=_raw_section))
+		mux = Mux(name, source, demux)
+		self.muxes.append(mux)
+		return mux
+
+	def _run_batch(self, mux):
+		"""Runs one batch of packets of a multiplex, charging the CPU time it takes to the multiplex"""
+		start = self.cpu_clock()
+		data = mux.source.read(self.batch_packets)
+		if data is None:
+			mux.done = True
+		elif data:
+			mux.batches += 1
+			mux.packets += len(data) // TS_PACKET_SIZE
+			sections = mux.demux.feed_packets(data)
+			mux.sections += len(sections)
+			if self.callback:
+				get_record = self.cache.get_record
+				for pid, data in sections: self.callback(mux, pid, get_record(pid, data))
+		mux.cpu_time += self.cpu_clock() - start
+
+	def run_once(self, timeout=0.1):
+		"""Runs one scheduling round
+
+		Arguments:
+			timeout -- number of seconds to wait for a socket when no file input is left (default 0.1)
+		Returns:
+			The number of multiplexes that were given a batch
+		"""
+		if self.start_time is None: self.start_time = self.clock()
+		active = [mux for mux in self.muxes if not mux.done]
+		if not active: return 0
+		first = self._first % len(active)
+		active = active[first:] + active[:first]
+		self._first += 1
+		ready = [mux for mux in active if mux.source.always_ready]
+		waiting = [mux for mux in active if not mux.source.always_ready]
+		if waiting:
+			readable = set(select.select(waiting, [], [], ready and 0 or timeout)[0])
+			ready = [mux for mux in active if mux.source.always_ready or mux in readable]
+		for mux in ready: self._run_batch(mux)
+		self.rounds += 1
+		return len(ready)
+
+	def run(self, duration=None, timeout=0.1):
+		"""Runs rounds until every input is done or for a number of seconds
+
+		Arguments:
+			duration -- number of seconds to run for (default None, until every input is done, which never happens
+			with a UDP input)
+			timeout -- see run_once()
+		"""
+		end = duration is not None and self.clock() + duration or None
+		while any([not mux.done for mux in self.muxes]):
+			if end is not None and self.clock() >= end: break
+			self.run_once(timeout)
+
+	def get_cpu_load(self):
+		"""Gets the fraction of one core used by each multiplex since the scheduler started
+
+		Returns:
+			A dictionary mapping multiplex names to their CPU load
+		"""
+		elapsed = self.start_time is not None and self.clock() - self.start_time or 0.0
+		if elapsed <= 0: return dict([(mux.name, 0.0) for mux in self.muxes])
+		return dict([(mux.name, mux.cpu_time / elapsed) for mux in self.muxes])
+
+	def get_muxes_per_core(self):
+		"""Gets the number of multiplexes like the current ones that one core could handle
+
+		Returns:
+			The capacity or None if no CPU time has been recorded yet
+		"""
+		cpu_time = sum([mux.cpu_time for mux in self.muxes])
+		packets  = sum([mux.packets for mux in self.muxes])
+		elapsed  = self.start_time is not None and self.clock() - self.start_time or 0.0
+		if cpu_time <= 0 or elapsed <= 0 or not packets: return None
+		return len(self.muxes) * elapsed / cpu_time
+
+	def close(self):
+		"""Closes every input"""
+		for mux in self.muxes: mux.source.close()
+
+'''UNIT TESTS -------------------------------------------------------------------------------------------------------------
+---------------------------------------------------------------------------------------------------------------------------
+'''
+if __name__ == '__main__':
+	import unittest
+	import os
+	import tempfile
+	from stream_generator import StreamGenerator
+
+	class FakeClock(object):
+		def __init__(self, step): self.now, self.step = 0.0, step
+		def __call__(self):
+			self.now += self.step
+			return self.now
+
+	class ListInput(object):
+		always_ready = True
+		def __init__(self, packets): self.data = bytearray().join(packets)
+		def fileno(self): return -1
+		def read(self, max_packets):
+			if not self.data: return None
+			data = self.data[0:max_packets * TS_PACKET_SIZE]
+			del self.data[0:max_packets * TS_PACKET_SIZE]
+			return data
+		def close(self): pass
+
+	def generate(seed, count=3000):
+		return list(StreamGenerator(seed=seed, programs=3, psi_interval=200, transport_streams=4).packets(count))
+
+	def reference(packets):
+		return [(pid, section.table_id, section.crc) for pid, section in Demux().feed_packets(bytearray().join(packets))]
+
+	class Scheduler(unittest.TestCase):
+		def setUp(self):
+			self.found = {}
+			self.scheduler = MuxScheduler(self.collect, batch_packets=64, cpu_clock=FakeClock(0.001),
+			                              clock=FakeClock(0.0))
+
+		def collect(self, mux, pid, section):
+			self.found.setdefault(mux.name, []).append((pid, section.table_id, section.crc))
+
+		def testSections(self):
+			streams = {'a': generate(1), 'b': generate(2)}
+			for name in sorted(streams): self.scheduler.add_mux(name, ListInput(streams[name]))
+			self.scheduler.run()
+			for name in streams: self.assertEqual(reference(streams[name]), self.found[name])
+
+		def testSharedCache(self):
+			packets = generate(1)
+			for name in ('a', 'b', 'c'): self.scheduler.add_mux(name, ListInput(packets))
+			self.scheduler.run()
+			cache = self.scheduler.cache
+			self.assertEqual(len(reference(packets)) * 3, cache.hits + cache.misses)
+			self.assertTrue(cache.hits >= 2 * cache.misses)
+			self.assertEqual(self.found['a'], self.found['c'])
+
+		def testRecords(self):
+			records = []
+			packets = generate(1)
+			scheduler = MuxScheduler(lambda mux, pid, record: records.append((mux.name, pid, record)))
+			for name in ('a', 'b'): scheduler.add_mux(name, ListInput(packets))
+			scheduler.run()
+			first = dict([((pid, record.payload), record) for name, pid, record in records if name == 'a'])
+			for name, pid, record in records:
+				self.assertTrue(isinstance(record, SectionRecord))
+				self.assertTrue(first[(pid, record.payload)] is record)
+			# the same section on another PID is a different entry
+			data = bytearray(records[0][2].payload)
+			self.assertFalse(scheduler.cache.get_record(records[0][1] + 1, data) is records[0][2])
+
+		def testDescriptors(self):
+			cache = SectionCache()
+			nits = []
+			scheduler = MuxScheduler(lambda mux, pid, record: record.table_id == 0x40 and nits.append(record),
+			                         cache=cache)
+			self.assertTrue(scheduler.cache is cache)
+			for name in ('a', 'b'): scheduler.add_mux(name, ListInput(generate(1, 600)))
+			scheduler.run()
+			record = nits[0]
+			end = 10 + (((ord(record.payload[8]) & 0x0f) << 8) | ord(record.payload[9])) # network descriptors
+			descriptors = cache.get_descriptors(record, 10, end)
+			self.assertTrue(descriptors)
+			self.assertEqual(descriptor.NETWORK_NAME_TAG, descriptors[0][0])
+			same = [other for other in nits if other is record] # the same section from every multiplex
+			self.assertTrue(len(same) >= 2)
+			for other in same: self.assertTrue(cache.get_descriptors(other, 10, end) is descriptors)
+			self.assertEqual((1, len(same)), (cache.descriptor_misses, cache.descriptor_hits))
+
+		def testFairness(self):
+			short = self.scheduler.add_mux('short', ListInput(generate(1, 640)))
+			long = self.scheduler.add_mux('long', ListInput(generate(2, 6400)))
+			for i in range(10):
+				self.assertEqual(2, self.scheduler.run_once())
+			self.assertEqual(10, short.batches)
+			self.assertEqual(10, long.batches)
+			self.scheduler.run()
+			self.assertEqual(100, long.batches)
+			self.assertTrue(short.done and long.done)
+
+		def testCpuAccounting(self):
+			mux = self.scheduler.add_mux('a', ListInput(generate(1, 640)))
+			self.scheduler.run()
+			self.assertAlmostEqual(0.011, mux.cpu_time) # one fake tick per batch, 10 batches and the end
+			self.scheduler.clock.now = 1.0
+			load = self.scheduler.get_cpu_load()
+			self.assertAlmostEqual(0.011, load['a'])
+			self.assertAlmostEqual(1.0 / load['a'], self.scheduler.get_muxes_per_core())
+
+		def testInputs(self):
+			packets = generate(3, 700)
+			fd, filename = tempfile.mkstemp()
+			os.write(fd, ''.join([str(packet) for packet in packets]))
+			os.close(fd)
+			receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+			receiver.bind(('127.0.0.1', 0))
+			receiver.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+			sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+			try:
+				scheduler = MuxScheduler(self.collect, batch_packets=64)
+				scheduler.add_mux('file', FileInput(filename))
+				udp = scheduler.add_mux('udp', UdpInput(0, sock=receiver))
+				for i in range(0, len(packets), 7):
+					payload = ''.join([str(packet) for packet in packets[i:i+7]])
+					if i % 14: payload = struct.pack('>BBHII', 0x80, 33, i, 0, 0) + payload # some as RTP
+					sender.sendto(payload, receiver.getsockname())
+				scheduler.run(duration=0.5, timeout=0.01)
+				self.assertEqual(reference(packets), self.found['file'])
+				self.assertEqual(reference(packets), self.found['udp'])
+				self.assertEqual(len(packets), udp.packets)
+				scheduler.close()
+			finally:
+				sender.close()
+				os.remove(filename)
+
+	unittest.main()
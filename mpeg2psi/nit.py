@@ -0,0 +1,195 @@
+"""Network Information Table module
+
+	Provides a NIT Section class to encapsulate information about a DVB Network Information Table section.
+	The network descriptor loop and the transport stream loop are walked from the section data when asked for,
+	nothing is decoded when parsing. Finding one transport stream only reads the entries ahead of it.
+"""
+
+import field_spec
+import descriptor
+from section import Section, TrustedSection
+
+# Offsets of the loop length fields from the start of the section
+NIT_FIELDS = [
+	('network_descriptors_length', 8, 4, 12, 'length of the network descriptor loop'),
+]
+_FIELDS = field_spec.compile_fields(NIT_FIELDS)
+_get_network_descriptors_length = _FIELDS['get_network_descriptors_length']
+
+# Loop length ahead of the transport stream loop (relative to the end of the network descriptors)
+NIT_LOOP_FIELDS = [
+	('transport_stream_loop_length', 0, 4, 12, 'length of the transport stream loop'),
+]
+_LOOP_FIELDS = field_spec.compile_fields(NIT_LOOP_FIELDS, relative=True)
+_get_transport_stream_loop_length = _LOOP_FIELDS['get_transport_stream_loop_length']
+
+# One entry of the transport stream loop
+NIT_ENTRY_FIELDS = [
+	('transport_stream_id',          0, 0, 16, 'transport stream ID'),
+	('original_network_id',          2, 0, 16, 'original network ID'),
+	('transport_descriptors_length', 4, 4, 12, 'length of the transport descriptor loop'),
+]
+_ENTRY_FIELDS = field_spec.compile_fields(NIT_ENTRY_FIELDS, relative=True)
+_get_transport_stream_id          = _ENTRY_FIELDS['get_transport_stream_id']
+_get_original_network_id          = _ENTRY_FIELDS['get_original_network_id']
+_get_transport_descriptors_length = _ENTRY_FIELDS['get_transport_descriptors_length']
+
+class Nit(Section):
+	"""Network Information Table class
+
+	Inherits from Section and gives access to the loops of a Network Information Table section (actual or
+	other network) described as a part of DVB SI. Transport stream entries are (transport stream ID, original
+	network ID, descriptor offset, descriptor end) tuples, the offsets pointing into Nit.data_cache so that
+	the descriptors of an entry can be walked with Nit.iter_descriptors() only when needed.
+	"""
+	TABLE_ID       = 0x40
+	OTHER_TABLE_ID = 0x41
+
+	@property
+	def network_id(self):
+		"""The network ID (the table ID extension)"""
+		return self.table_id_extension
+
+	def _get_loop_end(self):
+		"""Gets the offset after the last loop byte, stopping short of the CRC"""
+		return self.length - 4
+
+	def iter_descriptors(self, offset=None, end=None):
+		"""Walks a descriptor loop of the section
+
+		Arguments:
+			offset -- offset of the loop in Nit.data_cache, as given by a transport stream entry (default None,
+			the network descriptor loop)
+			end -- offset after the loop (default None, the end of the network descriptor loop)
+		Yields:
+			(tag, payload) for each descriptor, payload being a copy of the descriptor payload bytes
+		"""
+		if not self.complete: return
+		data = self.data_cache
+		if offset is None:
+			offset = 10
+			end = min(offset + _get_network_descriptors_length(data), self._get_loop_end())
+		for tag, start, length in descriptor.iter_descriptors(data, offset, end):
+			yield tag, data[start:start+length]
+
+	def get_network_name(self):
+		"""Gets the network name from the network name descriptor, None if the section does not have one"""
+		found = None
+		for tag, payload in self.iter_descriptors():
+			if tag == descriptor.NETWORK_NAME_TAG:
+				found = str(bytearray(payload))
+				break
+		return found
+
+	def iter_transport_streams(self):
+		"""Walks the transport stream loop of the section
+
+		An entry running past the end of the loop ends the walk.
+		Yields:
+			(transport stream ID, original network ID, descriptor offset, descriptor end) for each entry
+		"""
+		if not self.complete: return
+		data = self.data_cache
+		loop_end = self._get_loop_end()
+		offset = 10 + _get_network_descriptors_length(data)
+		if offset + 2 > loop_end: return
+		end = min(offset + 2 + _get_transport_stream_loop_length(data, offset), loop_end)
+		offset += 2
+		while offset + 6 <= end:
+			start = offset + 6
+			stop  = start + _get_transport_descriptors_length(data, offset)
+			if stop > end: return
+			yield _get_transport_stream_id(data, offset), _get_original_network_id(data, offset), start, stop
+			offset = stop
+
+	def find_transport_stream(self, transport_stream_id, original_network_id=None):
+		"""Finds the entry of a transport stream
+
+		Arguments:
+			transport_stream_id -- transport stream ID to look for
+			original_network_id -- original network ID to look for (default None, any)
+		Returns:
+			The (transport stream ID, original network ID, descriptor offset, descriptor end) entry or None
+		"""
+		for entry in self.iter_transport_streams():
+			if entry[0] == transport_stream_id and original_network_id in (None, entry[1]):
+				return entry
+		return None
+
+	def get_delivery_descriptor(self, transport_stream_id, original_network_id=None):
+		"""Gets the delivery system descriptor (satellite, cable or terrestrial) of a transport stream
+
+		Arguments:
+			transport_stream_id -- transport stream ID to look for
+			original_network_id -- original network ID to look for (default None, any)
+		Returns:
+			(tag, payload) of the descriptor or None if the transport stream or its descriptor is not found
+		"""
+		entry = self.find_transport_stream(transport_stream_id, original_network_id)
+		if entry is None: return None
+		return descriptor.find_descriptor(self.data_cache, entry[2], entry[3], descriptor.DELIVERY_SYSTEM_TAGS)
+
+	def __str__(self):
+		res = super(Nit, self).__str__()
+		resar = res.split('\n')
+		resar[0] = 'NIT:'
+		res = '\n'.join(resar)
+		res += ' Transport streams:\n'
+		for ts_id, on_id, start, end in self.iter_transport_streams():
+			res += '\tts[%x] - onid[%x]\n'%(ts_id, on_id)
+		return res
+
+class TrustedNit(TrustedSection, Nit):
+	"""Network Information Table built from trusted data
+
+	Inherits from TrustedSection and Nit. Nothing is checked when the object is built, the loops are walked
+	from the section data as for Nit.
+	"""
+
+'''UNIT TESTS -------------------------------------------------------------------------------------------------------------
+---------------------------------------------------------------------------------------------------------------------------
+'''
+if __name__ == '__main__':
+	import unittest
+	import _known_tables
+	nit_data_0 = _known_tables.get_sample_nit_data()[0]
+	nit_data_1 = _known_tables.get_sample_nit_data()[1]
+
+	class KnownSections(unittest.TestCase):
+		def testNit0(self):
+			nit = Nit(nit_data_0)
+			self.assertEqual(6144, nit.network_id)
+			self.assertEqual('DSTv Network', nit.get_network_name())
+			entries = list(nit.iter_transport_streams())
+			self.assertEqual(10, len(entries))
+			self.assertEqual([0x14, 0x02, 0x03], [entry[0] for entry in entries[0:3]])
+			self.assertEqual(set([0x1800]), set([entry[1] for entry in entries]))
+			self.assertEqual(nit.length - 4, entries[-1][3])
+
+		def testNit1(self):
+			nit = Nit(nit_data_1)
+			self.assertEqual(None, nit.get_network_name())
+			self.assertEqual([0x0B, 0x0C, 0x0D], [entry[0] for entry in nit.iter_transport_streams()])
+
+		def testDelivery(self):
+			nit = Nit(nit_data_1)
+			tag, payload = nit.get_delivery_descriptor(0x0C)
+			self.assertEqual(descriptor.SATELLITE_DELIVERY_TAG, tag)
+			self.assertEqual([0x01, 0x15, 0x54, 0x00], payload[0:4])
+			self.assertEqual(None, nit.get_delivery_descriptor(0x0C, 0x1801))
+			self.assertEqual(None, nit.get_delivery_descriptor(0x99))
+
+		def testTransportDescriptors(self):
+			nit = Nit(nit_data_1)
+			entry = nit.find_transport_stream(0x0D)
+			tags = [tag for tag, payload in nit.iter_descriptors(entry[2], entry[3])]
+			self.assertEqual([descriptor.SATELLITE_DELIVERY_TAG, descriptor.SERVICE_LIST_TAG], tags)
+
+		def testTruncatedLoop(self):
+			# a transport stream loop length running into the CRC stops at the CRC
+			data = list(nit_data_1)
+			data[10] |= 0x0F
+			nit = Nit(data)
+			self.assertEqual(3, len(list(nit.iter_transport_streams())))
+
+	unittest.main()
@@ -4,7 +4,19 @@
 	MPEG2-TS Program Association Table section
 """
 
-from section import Section
+import field_spec
+from section import Section, TrustedSection
+
+# One entry of the PAT program loop
+PAT_ENTRY_FIELDS = [
+	('program_number',  0, 0, 16, 'program number'),
+	('program_map_pid', 2, 3, 13, 'program map PID'),
+]
+_ENTRY_FIELDS = field_spec.compile_fields(PAT_ENTRY_FIELDS, relative=True)
+_get_program_number  = _ENTRY_FIELDS['get_program_number']
+_get_program_map_pid = _ENTRY_FIELDS['get_program_map_pid']
+_set_program_number  = _ENTRY_FIELDS['set_program_number']
+_set_program_map_pid = _ENTRY_FIELDS['set_program_map_pid']
 
 def get_program_map(data=None):
 	"""Returns the program map contained in the PAT section data
@@ -21,15 +33,31 @@ def get_program_map(data=None):
 	table_size = len(data) - 4 # remove crc32
 	table_entries = table_size / 4
 	while table_entries > 0:
-		entry = data[offset:offset+4]
-		prog = (entry[0] << 8) + entry[1]
-		pid  = ((entry[2] & int('00011111',2)) << 8) + entry[3]
+		prog = _get_program_number(data, offset)
+		pid  = _get_program_map_pid(data, offset)
 		if prog != 0:
 			programs[prog] = pid
 		offset = offset + 4
 		table_entries -= 1
 	return programs
 
+def build_program_map(programs):
+	"""Builds the PAT program loop for a program map
+	
+	The reverse of get_program_map(), the entries are sorted by program number.
+	Arguments:
+		programs -- dictionary mapping program numbers to PMT PIDs
+	Returns:
+		An array of data bytes holding the program loop (without the CRC)
+	"""
+	data = [0xff] * (4 * len(programs))
+	offset = 0
+	for prog in sorted(programs):
+		_set_program_number(data, prog, offset)
+		_set_program_map_pid(data, programs[prog], offset)
+		offset += 4
+	return data
+
 class Pat(Section):
 	"""Program Association Table class
     
@@ -76,6 +104,30 @@ class Pat(Section):
 			res += '\tprog[%x] - pid[%x]\n'%(prog, self.table[prog]) 
 		return res
 
+class TrustedPat(TrustedSection, Pat):
+	"""Program Association Table built from trusted data
+	
+	Inherits from TrustedSection and Pat. Nothing is checked when the object is built, the program map is
+	decoded from the section data the first time Pat.table is read.
+	"""
+	_table = None
+	
+	@property
+	def transport_stream_id(self):
+		"""The transport stream ID (the table ID extension)"""
+		return self.table_id_extension
+	
+	@property
+	def table(self):
+		"""Dictionary mapping program numbers to PMT PIDs"""
+		if self._table is None: self._table = get_program_map(self.data_cache[8:self.length])
+		return self._table
+	
+	def parse(self, data=None):
+		"""Replaces the section data, nothing is parsed"""
+		super(TrustedPat, self).parse(data)
+		self._table = None
+
 '''UNIT TESTS -------------------------------------------------------------------------------------------------------------
 ---------------------------------------------------------------------------------------------------------------------------
 '''
@@ -113,4 +165,17 @@ if __name__ == '__main__':
 				function(self, pat)
 				print pat
 
+	class ProgramMap(unittest.TestCase):
+		def testBuild(self):
+			table = Pat(pat_data).table
+			self.assertEqual(table, get_program_map(build_program_map(table) + [0, 0, 0, 0]))
+
+	class Trusted(unittest.TestCase):
+		def test(self):
+			section = TrustedPat(pat_data)
+			testPatSection(self, section)
+			self.assertTrue(isinstance(section, Pat))
+			self.assertEqual(Pat(pat_data).table, section.table)
+			self.assertEqual(Pat(pat_data).transport_stream_id, section.transport_stream_id)
+
 	unittest.main()	
\ No newline at end of file
@@ -0,0 +1,388 @@
+"""pcap reader module
+
+	Provides a PcapReader class that reads UDP (and RTP over UDP) carried transport streams straight from pcap
+	and pcapng capture files. The capture is memory mapped and walked one record header at a time, the link
+	(Ethernet, VLAN, Linux cooked or raw IP), IP and UDP headers are read in place with struct and datagrams not
+	sent to the wanted multicast groups and ports are skipped without being copied. Each destination (address,
+	port) is a separate transport stream with its own Demux.
+"""
+
+import mmap
+import os
+import socket
+import struct
+
+from demux import Demux
+
+TS_PACKET_SIZE = 188
+SYNC_BYTE      = 0x47
+
+PCAP_MAGIC      = 0xa1b2c3d4
+PCAP_NSEC_MAGIC = 0xa1b23c4d
+PCAPNG_SHB      = 0x0A0D0D0A
+PCAPNG_BYTE_ORDER_MAGIC = 0x1A2B3C4D
+
+PCAPNG_IDB = 0x00000001 # interface description block
+PCAPNG_SPB = 0x00000003 # simple packet block
+PCAPNG_EPB = 0x00000006 # enhanced packet block
+PCAPNG_IF_TSRESOL = 9
+
+LINKTYPE_ETHERNET  = 1
+LINKTYPE_RAW       = 101
+LINKTYPE_LINUX_SLL = 113
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86DD
+ETHERTYPE_VLAN = (0x8100, 0x88A8, 0x9100)
+IPPROTO_UDP    = 17
+
+RTP_VERSION = 2
+
+def _get_ethertype(data, offset, end, linktype):
+	"""Gets the ethertype and IP header offset of a link layer frame, (None, None) if it is not one we read"""
+	if linktype == LINKTYPE_ETHERNET:
+		offset += 12
+		if offset + 2 > end: return None, None
+		ethertype = struct.unpack_from('>H', data, offset)[0]
+		while ethertype in ETHERTYPE_VLAN and offset + 6 <= end:
+			offset += 4
+			ethertype = struct.unpack_from('>H', data, offset)[0]
+		return ethertype, offset + 2
+	if linktype == LINKTYPE_LINUX_SLL:
+		if offset + 16 > end: return None, None
+		return struct.unpack_from('>H', data, offset + 14)[0], offset + 16
+	if linktype == LINKTYPE_RAW:
+		if offset >= end: return None, None
+		version = ord(data[offset]) >> 4
+		return {4: ETHERTYPE_IPV4, 6: ETHERTYPE_IPV6}.get(version), offset
+	return None, None
+
+def _get_udp_offset(data, offset, end, ethertype):
+	"""Gets the (UDP header offset, destination address) of an IP packet, (None, None) if it is not UDP
+
+	Fragments are not reassembled and are skipped.
+	"""
+	if ethertype == ETHERTYPE_IPV4:
+		if offset + 20 > end: return None, None
+		version_ihl, protocol = struct.unpack_from('>B8xB', data, offset)
+		if protocol != IPPROTO_UDP: return None, None
+		if struct.unpack_from('>H', data, offset + 6)[0] & 0x3fff: return None, None # fragment
+		return offset + (version_ihl & 0x0f) * 4, data[offset+16:offset+20]
+	if ethertype == ETHERTYPE_IPV6:
+		if offset + 40 > end: return None, None
+		if ord(data[offset+6]) != IPPROTO_UDP: return None, None # extension headers are not followed
+		return offset + 40, data[offset+24:offset+40]
+	return None, None
+
+def get_ts_payload(data, offset, end):
+	"""Gets the (offset, length) of the TS packets in a UDP payload, skipping an RTP header if there is one
+
+	Arguments:
+		data -- the UDP payload bytes, a string, buffer, memory map or bytearray
+		offset -- offset of the UDP payload in data
+		end -- offset after the UDP payload
+	Returns:
+		The offset and length of the whole TS packets in data or (None, None) if there are none
+	"""
+	if offset >= end: return None, None
+	first = ord(data[offset:offset+1])
+	if first != SYNC_BYTE:
+		if first >> 6 != RTP_VERSION or offset + 12 > end: return None, None
+		if first & 0x20: # padding, the last byte holds the padding length
+			end -= ord(data[end-1:end])
+		header = offset + 12 + (first & 0x0f) * 4
+		if first & 0x10 and header + 4 <= end: # header extension
+			header += 4 + struct.unpack_from('>H', data, header + 2)[0] * 4
+		offset = header
+	length = end - offset
+	length -= length % TS_PACKET_SIZE
+	if length <= 0 or ord(data[offset:offset+1]) != SYNC_BYTE: return None, None
+	return offset, length
+
+class PcapReader(object):
+	"""Reads the transport stream datagrams of a pcap or pcapng capture
+
+	PcapReader.iter_datagrams() yields the location of the TS packets of each datagram within PcapReader.map,
+	PcapReader.get_view() gives a read only view on them and PcapReader.iter_sections() reassembles sections.
+	Datagrams are tagged with their stream, the (destination address, destination port) they were sent to,
+	the address being a string.
+	"""
+	def __init__(self, filename, groups=None, ports=None):
+		"""Constructor
+
+		Arguments:
+			filename -- name of the pcap or pcapng file
+			groups -- iterable of destination addresses to keep, as strings (default None, any)
+			ports -- iterable of destination UDP ports to keep (default None, any)
+		"""
+		self.file = open(filename, 'rb')
+		self.size = os.fstat(self.file.fileno()).st_size
+		if self.size < 24: raise ValueError('not a pcap file')
+		self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+		self.groups = None
+		if groups is not None:
+			self.groups = set([':' in group and socket.inet_pton(socket.AF_INET6, group) or socket.inet_aton(group)
+			                   for group in groups])
+		self.ports = ports is not None and set(ports) or None
+		self.records   = 0
+		self.datagrams = 0
+		self.skipped   = 0
+		self.demuxes   = {} # stream -> Demux, filled by iter_sections()
+		self._streams  = {} # (packed address, port) -> stream
+		magics = struct.unpack_from('<I', self.map, 0) + struct.unpack_from('>I', self.map, 0)
+		if PCAPNG_SHB in magics: self._records = self._iter_pcapng_records
+		elif PCAP_MAGIC in magics or PCAP_NSEC_MAGIC in magics: self._records = self._iter_pcap_records
+		else: raise ValueError('not a pcap file')
+
+	def _iter_pcap_records(self):
+		"""Walks the records of a pcap file, yields (time, linktype, offset, end)"""
+		data = self.map
+		order = struct.unpack_from('<I', data, 0)[0] in (PCAP_MAGIC, PCAP_NSEC_MAGIC) and '<' or '>'
+		magic = struct.unpack_from(order + 'I', data, 0)[0]
+		scale = magic == PCAP_NSEC_MAGIC and 1e-9 or 1e-6
+		linktype = struct.unpack_from(order + 'I', data, 20)[0] & 0xffff
+		record = struct.Struct(order + 'IIII')
+		offset = 24
+		while offset + record.size <= self.size:
+			seconds, fraction, length, original = record.unpack_from(data, offset)
+			offset += record.size
+			if offset + length > self.size: return # cut short
+			yield seconds + fraction * scale, linktype, offset, offset + length
+			offset += length
+
+	def _iter_pcapng_records(self):
+		"""Walks the blocks of a pcapng file, yields (time, linktype, offset, end) for each packet"""
+		data = self.map
+		order = '<'
+		interfaces = [] # (linktype, time scale) per interface of the current section
+		offset = 0
+		while offset + 12 <= self.size:
+			block_type = struct.unpack_from(order + 'I', data, offset)[0]
+			if block_type == PCAPNG_SHB:
+				order = struct.unpack_from('<I', data, offset + 8)[0] == PCAPNG_BYTE_ORDER_MAGIC and '<' or '>'
+				interfaces = []
+			block_length = struct.unpack_from(order + 'I', data, offset + 4)[0]
+			if block_length < 12 or offset + block_length > self.size: return # corrupt or cut short
+			body, end = offset + 8, offset + block_length - 4
+			if block_type == PCAPNG_IDB:
+				linktype = struct.unpack_from(order + 'H', data, body)[0]
+				interfaces.append((linktype, self._get_time_scale(order, body + 8, end)))
+			elif block_type == PCAPNG_EPB and body + 20 <= end:
+				interface, high, low, length = struct.unpack_from(order + 'IIII', data, body)
+				if interface < len(interfaces) and body + 20 + length <= end:
+					linktype, scale = interfaces[interface]
+					yield ((high << 32) | low) * scale, linktype, body + 20, body + 20 + length
+			elif block_type == PCAPNG_SPB and interfaces and body + 4 <= end:
+				length = min(struct.unpack_from(order + 'I', data, body)[0], end - body - 4)
+				yield None, interfaces[0][0], body + 4, body + 4 + length
+			offset += block_length
+
+	def _get_time_scale(self, order, offset, end):
+		"""Reads the if_tsresol option of an interface description block, the time scale defaults to 1e-6"""
+		while offset + 4 <= end:
+			code, length = struct.unpack_from(order + 'HH', self.map, offset)
+			if code == 0: break
+			if code == PCAPNG_IF_TSRESOL and length >= 1:
+				resolution = ord(self.map[offset+4])
+				if resolution & 0x80: return 2.0 ** -(resolution & 0x7f)
+				return 10.0 ** -resolution
+			offset += 4 + ((length + 3) & ~3)
+		return 1e-6
+
+	def iter_datagrams(self):
+		"""Walks the wanted transport stream datagrams of the capture
+
+		Yields:
+			(time, stream, offset, length) of the TS packets of each datagram within PcapReader.map. time is in
+			seconds and is None for pcapng simple packet blocks, which carry no time stamp. stream is the
+			(destination address, destination port) of the datagram.
+		"""
+		data = self.map
+		groups, ports, streams = self.groups, self.ports, self._streams
+		for time, linktype, offset, end in self._records():
+			self.records += 1
+			ethertype, offset = _get_ethertype(data, offset, end, linktype)
+			udp, address = _get_udp_offset(data, offset, end, ethertype)
+			if udp is None or udp + 8 > end or (groups is not None and address not in groups):
+				self.skipped += 1
+				continue
+			port, length = struct.unpack_from('>2xHH', data, udp)
+			if ports is not None and port not in ports:
+				self.skipped += 1
+				continue
+			offset, length = get_ts_payload(data, udp + 8, min(end, udp + length))
+			if offset is None:
+				self.skipped += 1
+				continue
+			stream = streams.get((address, port))
+			if stream is None:
+				family = len(address) == 4 and socket.AF_INET or socket.AF_INET6
+				stream = (socket.inet_ntop(family, address), port)
+				streams[(address, port)] = stream
+			self.datagrams += 1
+			yield time, stream, offset, length
+
+	def get_view(self, offset, length):
+		"""Gets a read only view of part of the capture without copying it"""
+		return buffer(self.map, offset, length)
+
+	def iter_sections(self, pids=None):
+		"""Reassembles the sections carried in the wanted datagrams
+
+		Each stream is passed to its own Demux, kept in PcapReader.demuxes. The TS packets of each datagram are
+		copied once, straight from the memory map into a reused bytearray for the demux, as the memory map cannot
+		be read as integers in place.
+		Arguments:
+			pids -- set of PIDs to reassemble sections for in every stream (default None, every PID)
+		Yields:
+			(time, stream, pid, section) tuples
+		"""
+		data = self.map
+		demuxes = self.demuxes
+		packets = bytearray()
+		for time, stream, offset, length in self.iter_datagrams():
+			demux = demuxes.get(stream)
+			if demux is None:
+				demux = Demux(pids)
+				demuxes[stream] = demux
+			del packets[:]
+			packets.extend(buffer(data, offset, length))
+			for pid, section in demux.feed_packets(packets):
+				yield time, stream, pid, section
+
+	def close(self):
+		self.map.close()
+		self.file.close()
+
+'''UNIT TESTS -------------------------------------------------------------------------------------------------------------
+---------------------------------------------------------------------------------------------------------------------------
+'''
+if __name__ == '__main__':
+	import unittest
+	import tempfile
+	from stream_generator import StreamGenerator
+
+	def ipv4_udp(group, port, payload, flags=0):
+		udp = struct.pack('>HHHH', 5000, port, 8 + len(payload), 0) + payload
+		return struct.pack('>BBHHHBBH4s4s', 0x45, 0, 20 + len(udp), 0, flags, 16, IPPROTO_UDP, 0,
+		                   socket.inet_aton('10.0.0.1'), socket.inet_aton(group)) + udp
+
+	def ethernet(ip, vlan=False):
+		header = '\x01\x00\x5e\x00\x00\x01' + '\x00\x11\x22\x33\x44\x55'
+		if vlan: header += struct.pack('>HH', 0x8100, 100)
+		return header + struct.pack('>H', ETHERTYPE_IPV4) + ip
+
+	def rtp(payload, sequence):
+		return struct.pack('>BBHII', 0x80, 33, sequence, sequence * 3600, 0x1234) + payload
+
+	def pcap_file(frames, linktype=LINKTYPE_ETHERNET):
+		records = [struct.pack('<IHHiIII', PCAP_MAGIC, 2, 4, 0, 0, 65535, linktype)]
+		for i, frame in enumerate(frames):
+			records.append(struct.pack('<IIII', 1000 + i, 500000, len(frame), len(frame)) + frame)
+		return ''.join(records)
+
+	def pcapng_block(block_type, body):
+		body += '\x00' * (-len(body) % 4)
+		return struct.pack('>II', block_type, len(body) + 12) + body + struct.pack('>I', len(body) + 12)
+
+	def pcapng_file(frames):
+		blocks = [pcapng_block(PCAPNG_SHB, struct.pack('>IHHq', PCAPNG_BYTE_ORDER_MAGIC, 1, 0, -1)),
+		          pcapng_block(PCAPNG_IDB, struct.pack('>HHI', LINKTYPE_ETHERNET, 0, 65535) +
+		                                   struct.pack('>HHB3x', PCAPNG_IF_TSRESOL, 1, 9) + struct.pack('>HH', 0, 0))]
+		for i, frame in enumerate(frames):
+			stamp = (1000 + i) * 1000000000
+			blocks.append(pcapng_block(PCAPNG_EPB, struct.pack('>IIIII', 0, stamp >> 32, stamp & 0xffffffff,
+			                                                   len(frame), len(frame)) + frame))
+		blocks.append(pcapng_block(PCAPNG_SPB, struct.pack('>I', len(frames[0])) + frames[0]))
+		return ''.join(blocks)
+
+	class Reader(unittest.TestCase):
+		def setUp(self):
+			generator = StreamGenerator(seed=5, programs=3, psi_interval=50, transport_streams=2)
+			packets = [str(packet) for packet in generator.packets(140)]
+			self.payloads = [''.join(packets[i:i+7]) for i in range(0, len(packets), 7)]
+			fd, self.filename = tempfile.mkstemp()
+			os.close(fd)
+
+		def tearDown(self):
+			os.remove(self.filename)
+
+		def write(self, data):
+			f = open(self.filename, 'wb')
+			f.write(data)
+			f.close()
+
+		def frames(self, wrap=None):
+			frames = []
+			for i, payload in enumerate(self.payloads):
+				if wrap: payload = wrap(payload, i)
+				frames.append(ethernet(ipv4_udp('239.1.1.1', 1234, payload), vlan=(i % 2 == 1)))
+				frames.append(ethernet(ipv4_udp('239.1.1.2', 1234, payload)))
+				frames.append(ethernet(ipv4_udp('239.1.1.1', 5678, payload)))
+			frames.append(ethernet(ipv4_udp('239.1.1.1', 1234, self.payloads[0], flags=0x2000))) # fragment
+			return frames
+
+		def read(self, **filters):
+			reader = PcapReader(self.filename, **filters)
+			try:
+				datagrams = list(reader.iter_datagrams())
+				self.skipped = reader.skipped
+				views = [str(reader.get_view(offset, length)) for time, stream, offset, length in datagrams]
+				sections = [(pid, section.table_id) for time, stream, pid, section in reader.iter_sections()]
+				return datagrams, views, sections, reader
+			finally:
+				reader.close()
+
+		def testPcap(self):
+			self.write(pcap_file(self.frames()))
+			datagrams, views, sections, reader = self.read(groups=['239.1.1.1'], ports=[1234])
+			self.assertEqual(self.payloads, views)
+			self.assertEqual(1000.5, datagrams[0][0])
+			self.assertEqual(('239.1.1.1', 1234), datagrams[0][1])
+			self.assertEqual(len(self.payloads) * 2 + 1, self.skipped)
+			self.assertTrue((0, 0x00) in sections)
+			self.assertTrue((0x10, 0x40) in sections)
+
+		def testRtp(self):
+			self.write(pcap_file(self.frames(rtp)))
+			datagrams, views, sections, reader = self.read(groups=['239.1.1.2'])
+			self.assertEqual(self.payloads, views)
+
+		def testPcapng(self):
+			self.write(pcapng_file(self.frames()))
+			datagrams, views, sections, reader = self.read(groups=['239.1.1.1'], ports=[1234])
+			self.assertEqual(self.payloads + [self.payloads[0]], views)
+			self.assertAlmostEqual(1000.0, datagrams[0][0])
+			self.assertEqual(None, datagrams[-1][0])
+
+		def testTruncated(self):
+			data = pcap_file(self.frames())
+			self.write(data[0:len(data) - 100])
+			datagrams, views, sections, reader = self.read(ports=[1234])
+			self.assertEqual(len(self.payloads) * 2, len(views))
+
+		def testStreams(self):
+			self.write(pcap_file(self.frames()))
+			expected = self.read(groups=['239.1.1.1'], ports=[1234])[2]
+			reader = PcapReader(self.filename)
+			found = {}
+			for time, stream, pid, section in reader.iter_sections():
+				found.setdefault(stream, []).append((pid, section.table_id))
+			reader.close()
+			streams = [('239.1.1.1', 1234), ('239.1.1.2', 1234), ('239.1.1.1', 5678)]
+			self.assertEqual(sorted(streams), sorted(found))
+			for stream in streams:
+				self.assertEqual(expected, found[stream])
+				self.assertEqual({}, reader.demuxes[stream].cc_errors)
+
+		def testPayload(self):
+			payload = rtp(self.payloads[0], 1)
+			self.assertEqual((12, len(self.payloads[0])), get_ts_payload(payload, 0, len(payload)))
+			self.assertEqual((12, len(self.payloads[0])), get_ts_payload(bytearray(payload), 0, len(payload)))
+			self.assertEqual((None, None), get_ts_payload('\x00' * 200, 0, 200))
+
+		def testNotPcap(self):
+			self.write('\x00' * 100)
+			self.assertRaises(ValueError, PcapReader, self.filename)
+
+	unittest.main()
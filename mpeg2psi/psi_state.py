@@ -0,0 +1,232 @@
+"""PSI state module
+
+	Provides a PsiState class holding a read only snapshot of the current PSI of a transport stream (sections,
+	program map and program streams) and a PsiPublisher class that builds a new snapshot for each new table
+	version. Snapshots are never changed once published: the publisher copies the dictionaries it changes and
+	swaps the new snapshot in with a single reference assignment, so any number of reader threads can take
+	PsiPublisher.state and query it without locking while the ingest thread carries on.
+"""
+
+from pat import get_program_map
+from service_index import get_elementary_pids, PMT_TABLE_ID
+from section_record import SectionRecord
+
+PAT_TABLE_ID = 0x00
+
+class PsiState(object):
+	"""Read only snapshot of the current PSI
+
+	Dictionaries are shared between snapshots and must never be changed, lookups only hand out ints, tuples
+	and SectionRecord objects which are all read only.
+	"""
+	__slots__ = ('generation', 'transport_stream_id', '_sections', '_programs', '_streams')
+
+	def __init__(self, generation=0, transport_stream_id=None, sections=None, programs=None, streams=None):
+		"""Constructor
+
+		Arguments:
+			generation -- number of snapshots published before this one (default 0)
+			transport_stream_id -- transport stream ID from the PAT (default None)
+			sections -- dictionary (table id, table id extension, section number) -> SectionRecord (default empty)
+			programs -- dictionary program number -> PMT PID (default empty)
+			streams -- dictionary program number -> tuple of (elementary PID, stream type) (default empty)
+		"""
+		set_slot = object.__setattr__
+		set_slot(self, 'generation', generation)
+		set_slot(self, 'transport_stream_id', transport_stream_id)
+		set_slot(self, '_sections', sections or {})
+		set_slot(self, '_programs', programs or {})
+		set_slot(self, '_streams', streams or {})
+
+	def __setattr__(self, name, value):
+		raise AttributeError('PsiState is read only')
+
+	def programs(self):
+		"""Gets the sorted list of program numbers in the PAT"""
+		return sorted(self._programs)
+
+	def get_pmt_pid(self, program):
+		"""Gets the PMT PID of a program, None if the program is not in the PAT"""
+		return self._programs.get(program)
+
+	def get_streams(self, program):
+		"""Gets the (elementary PID, stream type) tuples of a program, empty if its PMT has not been seen"""
+		return self._streams.get(program, ())
+
+	def get_section(self, table_id, table_id_extension=0, section_number=0):
+		"""Gets the current SectionRecord of a table section, None if it has not been seen"""
+		return self._sections.get((table_id, table_id_extension, section_number))
+
+	def sections(self):
+		"""Gets the list of current SectionRecord objects sorted by table id, table id extension and section number"""
+		return [self._sections[key] for key in sorted(self._sections)]
+
+class PsiPublisher(object):
+	"""Builds and publishes PsiState snapshots
+
+	Completed sections are passed in from a single ingest thread with PsiPublisher.update(). Readers take
+	PsiPublisher.state (or call PsiPublisher.get_state()) once and query that snapshot for as long as they need
+	a consistent view.
+	"""
+	def __init__(self):
+		"""Constructor"""
+		self.state = PsiState()
+
+	def get_state(self):
+		"""Gets the latest published snapshot"""
+		return self.state
+
+	def update(self, section):
+		"""Publishes a new snapshot if the section changes the current PSI
+
+		Sections that are incomplete, not yet applicable (current/next indicator unset) or already held with the
+		same version and CRC are ignored.
+		Arguments:
+			section -- complete Section (or subclass) object with an extended header
+		Returns:
+			True if a new snapshot was published
+		"""
+		if not section.complete or not section.extended_header or not section.current_next_indicator:
+			return False
+		state = self.state
+		key = (section.table_id, section.table_id_extension, section.section_number)
+		old = state._sections.get(key)
+		if old is not None and old.version == section.version and old.crc == section.crc: return False
+
+		record = SectionRecord.from_section(section)
+		sections = dict(state._sections)
+		sections[key] = record
+		transport_stream_id = state.transport_stream_id
+		programs = state._programs
+		streams  = state._streams
+		if section.table_id == PAT_TABLE_ID:
+			transport_stream_id = section.table_id_extension
+			if transport_stream_id != state.transport_stream_id:
+				# another transport stream, nothing of the PAT of the previous one carries over
+				programs = {}
+				for other in [other for other in sections if other[0] == PAT_TABLE_ID and other != key]:
+					del sections[other]
+			else:
+				programs = dict(programs)
+				if old is not None:
+					for program in get_program_map(old.table_body[5:]): programs.pop(program, None)
+			programs.update(get_program_map(record.table_body[5:]))
+			# programs removed or moved to another PMT PID lose their streams until their new PMT arrives
+			moved = set([program for program in state._programs if programs.get(program) != state._programs[program]])
+			streams = dict([(program, streams[program]) for program in streams
+			                if program in programs and program not in moved])
+			for other in [other for other in sections if other[0] == PMT_TABLE_ID and other[1] in moved]:
+				del sections[other]
+		elif section.table_id == PMT_TABLE_ID:
+			streams = dict(streams)
+			streams[section.table_id_extension] = tuple(sorted(get_elementary_pids(record.table_body[5:]).items()))
+		self.state = PsiState(state.generation + 1, transport_stream_id, sections, programs, streams)
+		return True
+
+'''UNIT TESTS -------------------------------------------------------------------------------------------------------------
+---------------------------------------------------------------------------------------------------------------------------
+'''
+if __name__ == '__main__':
+	import unittest
+	import threading
+	import _known_tables
+	from section import Section
+	from pat import Pat, build_program_map
+	import stream_generator
+
+	pat_data = _known_tables.get_sample_pat_data()[0]
+	pmt_data = _known_tables.get_sample_pmt_data()[0]
+	cat_data = _known_tables.get_sample_cat_data()[0]
+
+	def make_pat(version, programs, transport_stream_id=16):
+		return Pat(stream_generator.build_section(PAT_TABLE_ID, transport_stream_id, version, 0, 0,
+		                                          build_program_map(programs)))
+
+	class Publisher(unittest.TestCase):
+		def setUp(self):
+			self.publisher = PsiPublisher()
+
+		def testPat(self):
+			self.assertTrue(self.publisher.update(Pat(pat_data)))
+			state = self.publisher.state
+			self.assertEqual(1, state.generation)
+			self.assertEqual(16, state.transport_stream_id)
+			self.assertEqual(22, len(state.programs()))
+			self.assertEqual(1984, state.get_pmt_pid(1605))
+			self.assertFalse(self.publisher.update(Pat(pat_data)))
+			self.assertTrue(state is self.publisher.state)
+
+		def testPmt(self):
+			self.publisher.update(Pat(pat_data))
+			before = self.publisher.state
+			self.assertTrue(self.publisher.update(Section(pmt_data)))
+			after = self.publisher.state
+			self.assertEqual(((2003, 0x1B), (2004, 0x04), (2005, 0x06), (2006, 0x04)), after.get_streams(1010))
+			self.assertEqual((), before.get_streams(1010))
+			self.assertTrue(before._programs is after._programs)
+
+		def testCopyOnWrite(self):
+			self.publisher.update(make_pat(1, {1: 0x100, 2: 0x200}))
+			self.publisher.update(Section(pmt_data))
+			old = self.publisher.state
+			self.publisher.update(make_pat(2, {2: 0x210, 3: 0x300}))
+			new = self.publisher.state
+			self.assertEqual([1, 2], old.programs())
+			self.assertEqual(0x200, old.get_pmt_pid(2))
+			self.assertEqual([2, 3], new.programs())
+			self.assertEqual(0x210, new.get_pmt_pid(2))
+			self.assertEqual((), new.get_streams(1010))
+			self.assertEqual(1, old.get_section(PAT_TABLE_ID, 16).version)
+			self.assertEqual(2, new.get_section(PAT_TABLE_ID, 16).version)
+
+		def testTransportStreamChange(self):
+			self.publisher.update(make_pat(1, {1: 0x100, 2: 0x200}))
+			self.assertTrue(self.publisher.update(make_pat(1, {3: 0x300}, 17)))
+			state = self.publisher.state
+			self.assertEqual(17, state.transport_stream_id)
+			self.assertEqual([3], state.programs())
+			self.assertEqual(None, state.get_section(PAT_TABLE_ID, 16))
+
+		def testPmtPidChange(self):
+			self.publisher.update(make_pat(1, {1010: 0x100, 2: 0x200}))
+			self.publisher.update(Section(pmt_data))
+			self.publisher.update(make_pat(2, {1010: 0x110, 2: 0x200}))
+			state = self.publisher.state
+			self.assertEqual((), state.get_streams(1010))
+			self.assertEqual(None, state.get_section(PMT_TABLE_ID, 1010))
+			self.assertTrue(self.publisher.update(Section(pmt_data))) # the same PMT now on its new PID
+			self.assertEqual(4, len(self.publisher.state.get_streams(1010)))
+
+		def testIgnored(self):
+			self.assertFalse(self.publisher.update(Section(pat_data[0:20])))
+			self.assertFalse(self.publisher.update(Section([0x72, 0x30, 0x02, 0xFF, 0xFF])))
+			next_data = list(cat_data)
+			next_data[5] &= 0xFE
+			self.assertFalse(self.publisher.update(Section(next_data)))
+			self.assertEqual(0, self.publisher.state.generation)
+
+		def testReadOnly(self):
+			state = self.publisher.state
+			self.assertRaises(AttributeError, setattr, state, 'generation', 5)
+
+		def testConcurrentReaders(self):
+			errors = []
+			done = threading.Event()
+			def reader():
+				while not done.is_set():
+					state = self.publisher.state
+					for program in state.programs():
+						if state.get_pmt_pid(program) != 0x100 + program + state.generation:
+							errors.append(state.generation)
+			threads = [threading.Thread(target=reader) for i in range(4)]
+			for thread in threads: thread.start()
+			for version in range(200):
+				generation = version + 1
+				programs = dict([(program, 0x100 + program + generation) for program in range(1, 20)])
+				self.publisher.update(make_pat(version & 0x1f, programs))
+			done.set()
+			for thread in threads: thread.join()
+			self.assertEqual([], errors)
+			self.assertEqual(200, self.publisher.state.generation)
+
+	unittest.main()
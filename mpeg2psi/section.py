@@ -230,6 +230,72 @@ class Section(object):
 		return res
 	
 
+def _trusted_field(getter, doc):
+	"""Makes a read only property that decodes a header field from the section data when it is read"""
+	return property(lambda self: getter(self.data_cache), doc=doc)
+
+class TrustedSection(Section):
+	"""A section parsed on the assumption that its data is well formed
+	
+	Meant for replaying data that has already been checked (such as archived captures). Nothing is parsed when
+	the object is built, no lengths are checked and the CRC is not verified. Each header field is decoded from
+	the section data only when it is read, and the section data is kept as given rather than copied. The header
+	fields are read only. The trusted variants of the typed sections (TrustedPat, TrustedCat, TrustedNit)
+	inherit from both TrustedSection and their typed class, see section_factory.create_section().
+	"""
+	complete        = True
+	header          = True
+	
+	def __init__(self, data):
+		"""Constructor
+		
+		Arguments:
+			data -- array of data bytes of the entire section, kept by reference
+		"""
+		self.data_cache = data
+	
+	table_id                 = _trusted_field(sparse.get_table_id, 'table ID')
+	section_syntax_indicator = _trusted_field(sparse.get_section_syntax_indicator, 'section syntax indicator')
+	extended_header          = section_syntax_indicator
+	private_indicator        = _trusted_field(sparse.get_private_indicator, 'private section indicator')
+	section_length           = _trusted_field(sparse.get_section_length, 'section length')
+	table_id_extension       = _trusted_field(sparse.get_table_id_extension, 'table id extension')
+	version                  = _trusted_field(sparse.get_version_number, 'version number')
+	current_next_indicator   = _trusted_field(sparse.get_current_next_indicator, 'current/next indicator')
+	section_number           = _trusted_field(sparse.get_section_number, 'section number')
+	last_section_number      = _trusted_field(sparse.get_last_section_number, 'last section number')
+	
+	@property
+	def length(self):
+		"""Length of the entire section"""
+		return sparse.get_section_length(self.data_cache) + 3
+	
+	@property
+	def body_offset(self):
+		"""Offset in the section data of the first byte after the header (and extended header)"""
+		if self.data_cache[1] & 0x80: return 8
+		return 3
+	
+	@property
+	def table_body(self):
+		"""The section data following the basic header, including the CRC (same as Section.table_body)"""
+		return self.data_cache[3:sparse.get_section_length(self.data_cache) + 3]
+	
+	@property
+	def crc(self):
+		"""The section CRC as read from the last 4 bytes, not verified"""
+		end = sparse.get_section_length(self.data_cache) + 3
+		data = self.data_cache
+		return (data[end-4] << 24) | (data[end-3] << 16) | (data[end-2] << 8) | data[end-1]
+	
+	def parse(self, data=None):
+		"""Replaces the section data, nothing is parsed"""
+		if data: self.data_cache = data
+	
+	def add_data(self, data):
+		"""A trusted section is always complete, no data is ever added"""
+		return 0
+	
 '''UNIT TESTS -------------------------------------------------------------------------------------------------------------
 ---------------------------------------------------------------------------------------------------------------------------
 '''
@@ -359,6 +425,38 @@ if __name__ == '__main__':
 			test_nit_0(self, self.section)
 		
 	
+	class TrustedParity(unittest.TestCase):
+		known_data = [nit_data_0, nit_data_1, cat_data, pat_data, pmt_data]
+		fields = ['table_id', 'section_syntax_indicator', 'private_indicator', 'section_length', 'length',
+		          'table_id_extension', 'version', 'current_next_indicator', 'section_number',
+		          'last_section_number', 'crc', 'table_body', 'complete', 'header', 'extended_header']
+		
+		def testKnownSections(self):
+			for function in KnownSections.known_sections:
+				function(self, TrustedSection(KnownSections.known_sections[function]))
+		
+		def testFields(self):
+			for data in self.known_data:
+				strict  = Section(data)
+				trusted = TrustedSection(data)
+				for field in self.fields:
+					self.assertEqual(getattr(strict, field), getattr(trusted, field), 'mismatch on %s'%(field))
+				self.assertEqual(strict.table_body[5:], trusted.data_cache[trusted.body_offset:trusted.length])
+				self.assertEqual(str(strict), str(trusted))
+		
+		def testBytearray(self):
+			for data in self.known_data:
+				strict  = Section(data)
+				trusted = TrustedSection(bytearray(data))
+				for field in self.fields:
+					if field == 'table_body': continue
+					self.assertEqual(getattr(strict, field), getattr(trusted, field), 'mismatch on %s'%(field))
+				self.assertEqual(strict.table_body, list(trusted.table_body))
+		
+		def testNoCopy(self):
+			data = list(cat_data)
+			self.assertTrue(TrustedSection(data).data_cache is data)
+	
 	class SectionBuilder(unittest.TestCase):
 		
 		def setUp(self):
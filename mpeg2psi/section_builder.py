@@ -3,6 +3,8 @@
 	Provides a set of functions to build a basic MPEG2-TS PSI section.
 """
 
+import field_spec
+
 CRC32 = [
 		0x00000000, 0x04c11db7, 0x09823b6e, 0x0d4326d9,	0x130476dc, 0x17c56b6b,
 		0x1a864db2, 0x1e475005,	0x2608edb8, 0x22c9f00f, 0x2f8ad6d6, 0x2b4bcb61,
@@ -61,116 +63,18 @@ def create_section_data_block(data_length):
 	data = [0xff] * data_length
 	return data
 	
-def set_table_id(data, table_id):
-	"""Set the Table ID in a Section
-	
-	Given a block of section data, sets the Table ID
-	Arguments:
-		data -- List of bytes. Data to manipulate
-		table_id -- the table id to set
-	Returns:
-		table id that was set
-	"""
-	data[0] = table_id
-	return table_id
-	
-def set_section_syntax_indicator(data, indicator):
-	"""Set the section syntax indicator in a Section
-	
-	Given a block of section data, sets the section syntax indicator
-	Arguments:
-		data -- List of bytes. Data to manipulate
-		indicator -- Boolean value to set the indicator to
-	"""
-	data[1] = data[1] & int ('01111111', 2)
-	if indicator: data[1] = data[1] | int ('10000000', 2)
-
-def set_private_indicator(data, indicator):
-	"""Sets the private section indicator in the given section data
-	
-	Given a block of section data, sets the private indicator
-	Arguments:
-		data -- List of bytes. Data to manipulate
-		indicator -- Boolean value to set the indicator to
-	"""
-	data[1] = data[1] & int ('10111111', 2)
-	if indicator: data[1] = data[1] | int ('01000000', 2)
-
-def set_section_length(data, section_length):
-	"""Sets the section length in the given section data
-	
-	Given a block of section data, sets the section length
-	Arguments:
-		data -- List of bytes. Data to manipulate
-		section_length -- value to set
-	"""
-	#clear the bit feilds first
-	data[1] = data[1] & int('11110000', 2)
-	data[2] = 0x00;
-	#now break up the input
-	part1 = section_length & 0x0f00
-	part1 = part1 >> 8
-	part2 = section_length & 0x00ff
-	data[1] |= part1
-	data[2]  = part2
-
-
-# Table body 2
-def set_table_id_extension(data, table_id_extension):
-	"""Sets the table id extension in the given section data
-	
-	Given a block of section data, sets the table id extension
-	Arguments:
-		data -- List of bytes. Data to manipulate
-		table_id_extension -- value to set
-	"""
-	data[3] = (table_id_extension & 0xff00) >> 8
-	data[4] = table_id_extension & 0x00ff
+# Section header fields, generated from field_spec.SECTION_HEADER_FIELDS
+_HEADER_FIELDS = field_spec.compile_fields(field_spec.SECTION_HEADER_FIELDS)
 
-def set_version_number(data, version):
-	"""Sets version number in the given section data
-	
-	Given a block of section data, sets the version number
-	Arguments:
-		data -- List of bytes. Data to manipulate
-		version -- value to set
-	"""
-	data[5] &= int('11000001', 2) #clear the bit feilds first
-	#version &= int('00011111', 2)
-	version <<= 1
-	version &= int('00111110', 2)
-	data[5] |= version
-	
-def set_current_next_indicator(data, indicator):
-	"""Sets the current/next indicator in the given section data
-	
-	Given a block of section data, sets the current/next indicator
-	Arguments:
-		data -- List of bytes. Data to manipulate
-		indicator -- Boolean value to set the indicator to
-	"""
-	data[5] &= int ('11111110', 2)
-	if indicator: data[5] |= int ('00000001', 2)
-
-def set_section_number(data, section_number):
-	"""Sets the section number in the given section data
-	
-	Given a block of section data, sets the section number
-	Arguments:
-		data -- List of bytes. Data to manipulate
-		section_number -- value to set
-	"""
-	data[6] = section_number & 0xff
-
-def set_last_section_number(data, last_section_number):
-	"""Sets the last section number in the given section data
-	
-	Given a block of section data, sets the last section number
-	Arguments:
-		data -- List of bytes. Data to manipulate
-		last_section_number -- value to set
-	"""
-	data[7] = last_section_number & 0xff
+set_table_id                 = _HEADER_FIELDS['set_table_id']
+set_section_syntax_indicator = _HEADER_FIELDS['set_section_syntax_indicator']
+set_private_indicator        = _HEADER_FIELDS['set_private_indicator']
+set_section_length           = _HEADER_FIELDS['set_section_length']
+set_table_id_extension       = _HEADER_FIELDS['set_table_id_extension']
+set_version_number           = _HEADER_FIELDS['set_version_number']
+set_current_next_indicator   = _HEADER_FIELDS['set_current_next_indicator']
+set_section_number           = _HEADER_FIELDS['set_section_number']
+set_last_section_number      = _HEADER_FIELDS['set_last_section_number']
 	
 def set_data(data, payload, offset):
 	"""Sets the data payload in the given section data
@@ -223,6 +127,93 @@ def append_crc(data):
 	crc_array = calculate_crc(data[0:-4])
 	data[-4:] = crc_array
 	
+_CRC_POLYNOMIAL = 0x104c11db7
+_CRC_SHIFTS     = {} # number of bytes -> x^(8*bytes) mod polynomial
+
+def _update_crc(crc32, data):
+	"""Runs the data through the CRC register using the CRC32 lookup table"""
+	for byte in data:
+		crc32 = ((crc32 << 8) & 0xffffffff) ^ CRC32[((crc32 >> 24) ^ byte) & 0xff]
+	return crc32
+
+def _multiply_crc(a, b):
+	"""Multiplies two CRC register values as polynomials modulo the CRC polynomial"""
+	res = 0
+	while b:
+		if b & 1: res ^= a
+		b >>= 1
+		a <<= 1
+		if a & 0x100000000: a ^= _CRC_POLYNOMIAL
+	return res
+
+def _shift_crc(crc32, byte_count):
+	"""Returns the CRC register value after running byte_count zero bytes through it
+	
+	Feeding a zero byte into the register multiplies it by x^8, so rather than running the bytes through
+	the register x^(8*byte_count) is worked out by squaring (and kept for the next call).
+	"""
+	shift = _CRC_SHIFTS.get(byte_count)
+	if shift is None:
+		shift = 1
+		square = 0x100 # x^8
+		count = byte_count
+		while count:
+			if count & 1: shift = _multiply_crc(shift, square)
+			square = _multiply_crc(square, square)
+			count >>= 1
+		_CRC_SHIFTS[byte_count] = shift
+	return _multiply_crc(crc32, shift)
+
+def patch_crc(data, offset, old_bytes):
+	"""Updates the CRC of a block of section data after some of its bytes were changed
+	
+	The CRC is linear, so the new CRC is the old CRC combined with the CRC of the changed bits alone. Only the
+	changed bytes are run through the CRC, the cost does not depend on the length of the section.
+	The CRC in the last 4 bytes of the data block must be valid for the data before the change.
+	Arguments:
+		data -- List of bytes. Data to manipulate, already holding the new bytes
+		offset -- the byte at which the changed bytes start
+		old_bytes -- the bytes that were at the offset before the change
+	"""
+	delta = [old ^ new for old, new in zip(old_bytes, data[offset:offset+len(old_bytes)])]
+	crc32 = _update_crc(0, delta)
+	crc32 = _shift_crc(crc32, len(data) - 4 - offset - len(delta))
+	crc32 ^= (data[-4] << 24) | (data[-3] << 16) | (data[-2] << 8) | data[-1]
+	data[-4:] = [crc32 >> 24 & 0xff, crc32 >> 16 & 0xff, crc32 >> 8 & 0xff, crc32 & 0xff]
+
+def check_crc(data):
+	"""Checks the CRC of a block of section data
+	
+	Running an entire section, CRC included, through the CRC register leaves it at 0 if the CRC is valid.
+	Arguments:
+		data -- List of bytes. The entire section (section length + 3 bytes)
+	Return:
+		True if the CRC is valid
+	"""
+	return _update_crc(0xffffffff, data) == 0
+
+def patch_version_number(data, version):
+	"""Sets the version number of a block of section data and patches its CRC
+	
+	Arguments:
+		data -- List of bytes. Data to manipulate, with a valid CRC in the last 4 bytes
+		version -- value to set
+	"""
+	old_bytes = data[5:6]
+	set_version_number(data, version)
+	patch_crc(data, 5, old_bytes)
+
+def patch_table_id_extension(data, table_id_extension):
+	"""Sets the table id extension of a block of section data and patches its CRC
+	
+	Arguments:
+		data -- List of bytes. Data to manipulate, with a valid CRC in the last 4 bytes
+		table_id_extension -- value to set
+	"""
+	old_bytes = data[3:5]
+	set_table_id_extension(data, table_id_extension)
+	patch_crc(data, 3, old_bytes)
+	
 '''UNIT TESTS -------------------------------------------------------------------------------------------------------------
 ---------------------------------------------------------------------------------------------------------------------------
 '''
@@ -354,4 +345,44 @@ if __name__ == '__main__':
 		def tearDown(self):
 			del(self.data)
 			
+	class PatchCrc(unittest.TestCase):
+		def setUp(self):
+			import _known_tables
+			self.data = list(_known_tables.get_sample_nit_data()[0])
+
+		def test_version(self):
+			patch_version_number(self.data, 7)
+			self.assertEqual(sparser.get_version_number(self.data), 7)
+			self.assertEqual(calculate_crc(self.data[0:-4]), self.data[-4:])
+
+		def test_table_id_extension(self):
+			patch_table_id_extension(self.data, 0x1234)
+			self.assertEqual(sparser.get_table_id_extension(self.data), 0x1234)
+			self.assertEqual(calculate_crc(self.data[0:-4]), self.data[-4:])
+
+		def test_body(self):
+			cat = list(SAMPLE_CAT)
+			cat[10:12] = [0x12, 0x34]
+			patch_crc(cat, 10, SAMPLE_CAT[10:12])
+			self.assertEqual(calculate_crc(cat[0:-4]), cat[-4:])
+			cat[10:12] = SAMPLE_CAT[10:12]
+			patch_crc(cat, 10, [0x12, 0x34])
+			self.assertEqual(SAMPLE_CAT, cat)
+
+	class CheckCrc(unittest.TestCase):
+		def setUp(self):
+			import _known_tables
+			self.data = list(_known_tables.get_sample_nit_data()[0])
+
+		def test_valid(self):
+			self.assertTrue(check_crc(self.data))
+			self.assertTrue(check_crc(SAMPLE_CAT))
+
+		def test_corrupt(self):
+			self.data[20] ^= 0x01
+			self.assertFalse(check_crc(self.data))
+			self.data[20] ^= 0x01
+			self.data[-1] ^= 0x80
+			self.assertFalse(check_crc(self.data))
+
 	unittest.main()
\ No newline at end of file
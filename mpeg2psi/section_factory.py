@@ -0,0 +1,132 @@
+"""section factory module
+
+	Provides a function to build the right Section subclass for a block of section data. The table ID (byte 0)
+	is read once and looked up in a precomputed 256 entry table ID to class table. Modules holding the
+	Section subclasses are only imported the first time one of their table IDs is seen. Trusted sections are
+	dispatched the same way, to the trusted variant (TrustedSection subclass) of each class.
+"""
+
+from section import Section, TrustedSection
+
+# table id -> (module name, class name, trusted class name) for every typed section. Unlisted table ids build a
+# plain Section (or TrustedSection)
+_KNOWN_CLASSES = {
+	0x00: ('pat', 'Pat', 'TrustedPat'),
+	0x01: ('cat', 'Cat', 'TrustedCat'),
+	0x40: ('nit', 'Nit', 'TrustedNit'),
+	0x41: ('nit', 'Nit', 'TrustedNit'),
+}
+
+_CLASS_NAMES     = [None] * 256
+_CLASSES         = [None] * 256
+_TRUSTED_CLASSES = [None] * 256
+
+def register_table_class(table_ids, module_name, class_name, trusted_class_name=None):
+	"""Registers the Section subclass to build for a set of table IDs
+
+	The module is not imported until a section with one of the table IDs is built.
+	Arguments:
+		table_ids -- iterable of table IDs (0 to 255)
+		module_name -- name of the module that holds the class (None to build plain Section objects)
+		class_name -- name of the Section subclass
+		trusted_class_name -- name of the trusted variant of the class, built for trusted data (default None,
+		trusted data is fully parsed into the Section subclass)
+	"""
+	for table_id in table_ids:
+		_CLASS_NAMES[table_id]     = module_name and (module_name, class_name, trusted_class_name)
+		_CLASSES[table_id]         = None
+		_TRUSTED_CLASSES[table_id] = None
+
+def _load_classes(table_id):
+	name = _CLASS_NAMES[table_id]
+	if name:
+		module = __import__(name[0], globals(), locals(), [name[1]])
+		cls = getattr(module, name[1])
+		trusted_cls = name[2] and getattr(module, name[2]) or cls
+	else:
+		cls, trusted_cls = Section, TrustedSection
+	_CLASSES[table_id]         = cls
+	_TRUSTED_CLASSES[table_id] = trusted_cls
+
+def get_section_class(table_id, trusted=False):
+	"""Gets the Section class for the given table ID
+
+	Arguments:
+		table_id -- table ID (0 to 255)
+		trusted -- if True the class built for trusted data is returned (default False)
+	Returns:
+		The Section subclass registered for the table ID or Section if there is none (its trusted variant or
+		TrustedSection for trusted data)
+	"""
+	if _CLASSES[table_id] is None: _load_classes(table_id)
+	if trusted: return _TRUSTED_CLASSES[table_id]
+	return _CLASSES[table_id]
+
+def create_section(data, trusted=False):
+	"""Builds a typed section object from a block of section data
+
+	The section data is parsed once, straight into the Section subclass for its table ID.
+	Arguments:
+		data -- array of data bytes that describe an entire section
+		trusted -- if True the data is assumed to be well formed and the trusted variant of the class is built,
+		no lengths or CRC are checked and fields are only decoded when read (default False)
+	Returns:
+		The parsed section object (Pat, ...) or a Section if the table ID has no typed class
+	"""
+	if trusted: return (_TRUSTED_CLASSES[data[0]] or get_section_class(data[0], True))(data)
+	cls = _CLASSES[data[0]] or get_section_class(data[0])
+	return cls(data)
+
+for _table_id, _name in _KNOWN_CLASSES.items():
+	register_table_class([_table_id], *_name)
+
+'''UNIT TESTS -------------------------------------------------------------------------------------------------------------
+---------------------------------------------------------------------------------------------------------------------------
+'''
+if __name__ == '__main__':
+	import unittest
+	import _known_tables
+
+	cat_data = _known_tables.get_sample_cat_data()[0]
+	pat_data = _known_tables.get_sample_pat_data()[0]
+	pmt_data = _known_tables.get_sample_pmt_data()[0]
+
+	class Factory(unittest.TestCase):
+		def testPat(self):
+			section = create_section(pat_data)
+			self.assertEqual('Pat', type(section).__name__)
+			self.assertTrue(section.complete)
+			self.assertEqual(22, len(section.table), 'incorrect table length')
+
+		def testCat(self):
+			section = create_section(cat_data)
+			self.assertEqual('Cat', type(section).__name__)
+			self.assertEqual([(0x0606, 0x0500)], list(section.iter_ca_systems()))
+
+		def testUnknown(self):
+			section = create_section(pmt_data)
+			self.assertTrue(type(section) is Section)
+			self.assertEqual(pmt_data[0], section.table_id)
+
+		def testTrusted(self):
+			section = create_section(pat_data, trusted=True)
+			self.assertTrue(isinstance(section, TrustedSection))
+			self.assertEqual('Pat', get_section_class(0x00).__name__)
+			self.assertTrue(isinstance(section, get_section_class(0x00)))
+			self.assertEqual(16, section.version)
+			self.assertEqual(create_section(pat_data).table, section.table)
+			section = create_section(cat_data, trusted=True)
+			self.assertTrue(isinstance(section, get_section_class(0x01)))
+			self.assertEqual([(0x0606, 0x0500)], list(section.iter_ca_systems()))
+			self.assertTrue(type(create_section(pmt_data, trusted=True)) is TrustedSection)
+
+		def testRegister(self):
+			register_table_class([0xFE], 'pat', 'Pat')
+			try:
+				self.assertEqual('Pat', get_section_class(0xFE).__name__)
+				self.assertEqual('Pat', get_section_class(0xFE, trusted=True).__name__)
+			finally:
+				register_table_class([0xFE], None, None)
+			self.assertTrue(get_section_class(0xFE) is Section)
+
+	unittest.main()
@@ -4,6 +4,8 @@
 	MPEG2-TS PSI section.
 """
 
+import field_spec
+
 def get_pointer_field(data):
 	"""Get the pointer field from the packet payload
 	
@@ -12,83 +14,19 @@ def get_pointer_field(data):
 	"""
 	return data[0]
 
-def get_table_id(data):
-	"""Get the table ID from the given section data
-	
-	Parses the given array of section data bytes to find the Section table ID.
-	"""
-	return data[0]
-
-def get_section_syntax_indicator(data):
-	"""Get the section syntax indicator from the given section data
-	
-	Parses the given array of section data bytes and returns the section syntax indicator. If True, then this
-	is an extended table. If False then it is a simple section.
-	"""
-	if data[1] & int('10000000', 2): return True
-	return False
-
-def get_private_indicator(data):
-	"""Gets the private section indicator from the given section data
-	
-	Parses the given array of section data bytes and returns the private section indicator. If True, then this
-	is a private table. If False then it is a normal mpeg ts table (PAT, PMT, CAT).
-	"""
-	if data[1] & int('01000000', 2): return True
-	return False
+# Section header fields, generated from field_spec.SECTION_HEADER_FIELDS
+_HEADER_FIELDS = field_spec.compile_fields(field_spec.SECTION_HEADER_FIELDS)
 
-def get_section_length(data):
-	"""Gets the section length from the given section data
-	
-	Parses the given array of section data bytes and returns the section length.
-	"""
-	sl = (data[1] & int('00001111', 2)) << 8
-	sl = sl + data[2]
-	return sl
+get_table_id                 = _HEADER_FIELDS['get_table_id']
+get_section_syntax_indicator = _HEADER_FIELDS['get_section_syntax_indicator']
+get_private_indicator        = _HEADER_FIELDS['get_private_indicator']
+get_section_length           = _HEADER_FIELDS['get_section_length']
+get_table_id_extension       = _HEADER_FIELDS['get_table_id_extension']
+get_version_number           = _HEADER_FIELDS['get_version_number']
+get_current_next_indicator   = _HEADER_FIELDS['get_current_next_indicator']
+get_section_number           = _HEADER_FIELDS['get_section_number']
+get_last_section_number      = _HEADER_FIELDS['get_last_section_number']
 
-# Table body 2
-def get_table_id_extension(data):
-	"""Gets the table id extension from the given section data
-	
-	Parses the given array of section data bytes and returns the table ID extension value.
-	"""
-	tide = (data[3] << 8) + data[4]
-	return tide
-
-def get_version_number(data):
-	"""Gets the table version from the given section data
-	
-	Parses the given array of section data bytes and returns the version number of the section.
-	"""
-	vn = data[5] & int('00111110', 2)
-	vn = vn >> 1
-	return vn
-
-def get_current_next_indicator(data):
-	"""Gets the current/next indicator from the given section data
-	
-	Parses the given array of section data bytes and returns the current/next indicator. If True, then this
-	is the currently applicable table. If False then it will become applicable some time in the future.
-	"""
-	if data[5] & int('00000001', 2): return True
-	return False
-
-def get_section_number(data):
-	"""Gets the section number from the given section data
-	
-	Parses the given array of section data bytes and returns the section number. SI tables come in sections.
-	Each section is numbered and this function will return the number of the given section.
-	"""
-	return data[6]
-
-def get_last_section_number(data):
-	"""Gets the last section number from the given section data
-	
-	Parses the given array of section data bytes and returns the last section number. SI tables come in sections.
-	This number allows the client to know how many sections in the current table.
-	"""
-	return data[7]
-	
 def get_data(data):
 	"""Gets the section data payload from the given section data
 	
@@ -0,0 +1,199 @@
+"""section record module
+
+	Provides a SectionRecord class, a compact read only stand in for a complete Section. A record holds only
+	two slots: the header fields packed into a single integer and the section data as an immutable string.
+	It answers the same attribute reads as a complete Section so it can be kept in large in memory inventories
+	(a day of EIT sections) in place of Section objects.
+"""
+
+import struct
+
+import section_parser as sparse
+import section_factory
+from section import Section
+
+# bit layout of the packed header: (shift, mask) per field
+_TABLE_ID            = (52, 0xff)
+_SYNTAX_INDICATOR    = (51, 0x1)
+_PRIVATE_INDICATOR   = (50, 0x1)
+_SECTION_LENGTH      = (38, 0xfff)
+_TABLE_ID_EXTENSION  = (22, 0xffff)
+_VERSION             = (17, 0x1f)
+_CURRENT_NEXT        = (16, 0x1)
+_SECTION_NUMBER      = (8,  0xff)
+_LAST_SECTION_NUMBER = (0,  0xff)
+
+def _packed_field(field, doc, flag=False):
+	"""Makes a read only property that unpacks a field from the packed header"""
+	shift, mask = field
+	if flag: return property(lambda self: (self.header_fields >> shift) & mask != 0, doc=doc)
+	return property(lambda self: (self.header_fields >> shift) & mask, doc=doc)
+
+def pack_header(data):
+	"""Packs the header fields of a block of section data into one integer
+
+	Arguments:
+		data -- array of data bytes of the section, at least the full header long
+	Returns:
+		The packed header
+	"""
+	header = ((sparse.get_table_id(data) << _TABLE_ID[0]) |
+	          (sparse.get_section_syntax_indicator(data) << _SYNTAX_INDICATOR[0]) |
+	          (sparse.get_private_indicator(data) << _PRIVATE_INDICATOR[0]) |
+	          (sparse.get_section_length(data) << _SECTION_LENGTH[0]))
+	if sparse.get_section_syntax_indicator(data):
+		header |= ((sparse.get_table_id_extension(data) << _TABLE_ID_EXTENSION[0]) |
+		           (sparse.get_version_number(data) << _VERSION[0]) |
+		           (sparse.get_current_next_indicator(data) << _CURRENT_NEXT[0]) |
+		           (sparse.get_section_number(data) << _SECTION_NUMBER[0]) |
+		           (sparse.get_last_section_number(data) << _LAST_SECTION_NUMBER[0]))
+	return header
+
+class SectionRecord(object):
+	"""Compact read only section
+
+	Built from a complete section with SectionRecord.from_data() or SectionRecord.from_section(). Reading the
+	Section attributes (table_id, version, table_body, crc...) works as for a complete Section. The data_cache
+	and table_body attributes build a new list of bytes on each read, use SectionRecord.payload to read the
+	section data without a copy.
+	"""
+	__slots__ = ('header_fields', 'payload')
+
+	complete = True
+	header   = True
+
+	def __init__(self, header_fields, payload):
+		"""Constructor
+
+		Arguments:
+			header_fields -- packed header as returned by pack_header()
+			payload -- string holding the data of the entire section
+		"""
+		self.header_fields = header_fields
+		self.payload       = payload
+
+	@classmethod
+	def from_data(cls, data):
+		"""Builds a record from a block of data holding an entire section"""
+		length = sparse.get_section_length(data) + 3
+		return cls(pack_header(data), str(bytearray(data[0:length])))
+
+	@classmethod
+	def from_section(cls, section):
+		"""Builds a record from a complete Section object"""
+		return cls.from_data(section.data_cache)
+
+	table_id                 = _packed_field(_TABLE_ID, 'table ID')
+	section_syntax_indicator = _packed_field(_SYNTAX_INDICATOR, 'section syntax indicator', True)
+	extended_header          = section_syntax_indicator
+	private_indicator        = _packed_field(_PRIVATE_INDICATOR, 'private section indicator', True)
+	section_length           = _packed_field(_SECTION_LENGTH, 'section length')
+	table_id_extension       = _packed_field(_TABLE_ID_EXTENSION, 'table id extension')
+	version                  = _packed_field(_VERSION, 'version number')
+	current_next_indicator   = _packed_field(_CURRENT_NEXT, 'current/next indicator', True)
+	section_number           = _packed_field(_SECTION_NUMBER, 'section number')
+	last_section_number      = _packed_field(_LAST_SECTION_NUMBER, 'last section number')
+
+	@property
+	def length(self):
+		"""Length of the entire section"""
+		return len(self.payload)
+
+	@property
+	def crc(self):
+		"""The section CRC (last 4 bytes), a section without an extended header has none as for a Section"""
+		if not self.header_fields & (1 << _SYNTAX_INDICATOR[0]): raise AttributeError('section has no CRC')
+		return struct.unpack_from('>I', self.payload, len(self.payload) - 4)[0]
+
+	@property
+	def data_cache(self):
+		"""The section data as a new list of bytes"""
+		return list(bytearray(self.payload))
+
+	@property
+	def table_body(self):
+		"""The section data following the basic header, including the CRC, as a new list of bytes"""
+		return list(bytearray(self.payload[3:]))
+
+	def to_section(self):
+		"""Parses the record back into a typed section object (see section_factory)"""
+		return section_factory.create_section(bytearray(self.payload))
+
+	def __eq__(self, other):
+		return isinstance(other, SectionRecord) and self.payload == other.payload
+
+	def __ne__(self, other):
+		return not self.__eq__(other)
+
+	def __hash__(self):
+		return hash(self.payload)
+
+	__str__ = Section.__dict__['__str__']
+
+'''UNIT TESTS -------------------------------------------------------------------------------------------------------------
+---------------------------------------------------------------------------------------------------------------------------
+'''
+if __name__ == '__main__':
+	import unittest
+	import sys
+	import _known_tables
+
+	nit_data_0 = _known_tables.get_sample_nit_data()[0]
+	nit_data_1 = _known_tables.get_sample_nit_data()[1]
+	cat_data   = _known_tables.get_sample_cat_data()[0]
+	pat_data   = _known_tables.get_sample_pat_data()[0]
+	pmt_data   = _known_tables.get_sample_pmt_data()[0]
+
+	def deep_size(section):
+		size = sys.getsizeof(section)
+		if hasattr(section, '__dict__'):
+			size += sys.getsizeof(section.__dict__)
+			for value in section.__dict__.values():
+				size += sys.getsizeof(value)
+				if isinstance(value, list): size += sum([sys.getsizeof(item) for item in value if item > 256])
+		else:
+			size += sys.getsizeof(section.payload)
+		return size
+
+	class Record(unittest.TestCase):
+		known_data = [nit_data_0, nit_data_1, cat_data, pat_data, pmt_data]
+		fields = ['table_id', 'section_syntax_indicator', 'private_indicator', 'section_length', 'length',
+		          'table_id_extension', 'version', 'current_next_indicator', 'section_number',
+		          'last_section_number', 'crc', 'table_body', 'data_cache', 'complete', 'header', 'extended_header']
+
+		def testFields(self):
+			for data in self.known_data:
+				section = Section(data)
+				record = SectionRecord.from_section(section)
+				for field in self.fields:
+					self.assertEqual(getattr(section, field), getattr(record, field), 'mismatch on %s'%(field))
+				self.assertEqual(str(section), str(record))
+
+		def testShortSection(self):
+			data = [0x72, 0x30, 0x02, 0xAA, 0xBB]
+			record = SectionRecord.from_data(data)
+			self.assertEqual(0x72, record.table_id)
+			self.assertFalse(record.extended_header)
+			self.assertEqual(5, record.length)
+			self.assertFalse(hasattr(Section(data), 'crc'))
+			self.assertFalse(hasattr(record, 'crc'))
+
+		def testSlots(self):
+			record = SectionRecord.from_data(cat_data)
+			self.assertFalse(hasattr(record, '__dict__'))
+			self.assertRaises(AttributeError, setattr, record, 'version', 3)
+
+		def testToSection(self):
+			pat = SectionRecord.from_data(pat_data).to_section()
+			self.assertEqual('Pat', type(pat).__name__)
+			self.assertEqual(22, len(pat.table))
+
+		def testMemory(self):
+			for data in self.known_data:
+				self.assertTrue(deep_size(SectionRecord.from_data(data)) * 10 < deep_size(Section(data)))
+
+		def testHashable(self):
+			records = set([SectionRecord.from_data(cat_data), SectionRecord.from_data(list(cat_data))])
+			self.assertEqual(1, len(records))
+
+	unittest.main()
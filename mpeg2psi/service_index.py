@@ -0,0 +1,380 @@
+"""service index module
+
+	Provides a ServiceIndex class that maps programs to their PMT PIDs and elementary stream PIDs (and back)
+	from the PAT and the PMT sections of a transport stream, and transport streams to the services listed for
+	them (and back) from the NIT sections. The index is kept up to date incrementally, only the entries touched
+	by a new PAT, PMT or NIT section version are changed.
+"""
+
+import field_spec
+import descriptor
+
+PMT_TABLE_ID = 0x02
+
+# Start of the PMT payload and one entry of its elementary stream loop
+PMT_FIELDS = [
+	('pcr_pid',             0, 3, 13, 'PCR PID'),
+	('program_info_length', 2, 4, 12, 'program info length'),
+]
+PMT_STREAM_FIELDS = [
+	('stream_type',    0, 0, 8,  'stream type'),
+	('elementary_pid', 1, 3, 13, 'elementary PID'),
+	('es_info_length', 3, 4, 12, 'ES info length'),
+]
+_PMT_FIELDS    = field_spec.compile_fields(PMT_FIELDS)
+_STREAM_FIELDS = field_spec.compile_fields(PMT_STREAM_FIELDS, relative=True)
+_get_program_info_length = _PMT_FIELDS['get_program_info_length']
+_get_stream_type         = _STREAM_FIELDS['get_stream_type']
+_get_elementary_pid      = _STREAM_FIELDS['get_elementary_pid']
+_get_es_info_length      = _STREAM_FIELDS['get_es_info_length']
+
+# One entry of a service list descriptor
+SERVICE_LIST_FIELDS = [
+	('service_id',   0, 0, 16, 'service ID'),
+	('service_type', 2, 0, 8,  'service type'),
+]
+_SERVICE_FIELDS = field_spec.compile_fields(SERVICE_LIST_FIELDS, relative=True)
+_get_service_id   = _SERVICE_FIELDS['get_service_id']
+_get_service_type = _SERVICE_FIELDS['get_service_type']
+
+def get_elementary_pids(data=None):
+	"""Returns the elementary streams described in the PMT section data
+
+	Given an array of data bytes that comprise of the PMT payload (everything after the extended header,
+	including the CRC), this method will return the PMTs elementary stream PIDs.
+	Arguments:
+		data -- Array of data bytes that represent a complete PMT payload (default None)
+	Returns:
+		A dictionary mapping elementary stream PIDs to their stream types
+	"""
+	streams = {}
+	offset = 4 + _get_program_info_length(data) # skip PCR PID and program info descriptors
+	end = len(data) - 4 # remove crc32
+	while offset + 5 <= end:
+		streams[_get_elementary_pid(data, offset)] = _get_stream_type(data, offset)
+		offset += 5 + _get_es_info_length(data, offset)
+	return streams
+
+def get_listed_services(nit, entry):
+	"""Returns the services listed for a transport stream of a NIT
+
+	Arguments:
+		nit -- complete Nit object
+		entry -- transport stream entry of the NIT as given by Nit.iter_transport_streams()
+	Returns:
+		A dictionary mapping service IDs to their service types, from the service list descriptors of the entry
+	"""
+	services = {}
+	data = nit.data_cache
+	for tag, start, length in descriptor.iter_descriptors(data, entry[2], entry[3]):
+		if tag != descriptor.SERVICE_LIST_TAG: continue
+		for offset in range(start, start + length - 2, 3):
+			services[_get_service_id(data, offset)] = _get_service_type(data, offset)
+	return services
+
+def _link(links, key, value):
+	if key in links: links[key].add(value)
+	else: links[key] = set([value])
+
+def _unlink(links, key, value):
+	values = links.get(key)
+	if not values: return
+	values.discard(value)
+	if not values: del links[key]
+
+class ServiceIndex(object):
+	"""Program to PMT PID to elementary stream PID index
+
+	Built from Pat objects, PMT sections and Nit objects passed in with ServiceIndex.update_pat(),
+	ServiceIndex.update_pmt() and ServiceIndex.update_nit(). Every lookup is a dictionary access. Transport
+	streams are keyed by their (transport stream ID, original network ID).
+	"""
+	def __init__(self):
+		"""Constructor"""
+		self.transport_stream_id = None
+		self.pat_version         = None
+		self._pmt_pid            = {} # program -> pmt pid
+		self._pmt_programs       = {} # pmt pid -> set of programs
+		self._streams            = {} # program -> {es pid: stream type}
+		self._es_programs        = {} # es pid  -> set of programs
+		self._pmt_versions       = {} # program -> pmt version
+		self._changed            = set()
+		self._pat_sections       = {} # section number -> (version, {program: pmt pid})
+		self._nit_sections       = {} # (table id, network id, section number) -> (version, transport streams)
+		self._ts_services        = {} # transport stream -> {service id: service type}
+		self._service_ts         = {} # service id -> set of transport streams
+
+	def update_pat(self, pat):
+		"""Updates the index from a complete PAT section
+
+		Nothing is done if the version of the section has already been seen. Otherwise the programs of the
+		section are added or moved to their new PMT PID, and once every section of its version has arrived the
+		programs no longer listed in any of them are removed.
+		Arguments:
+			pat -- complete and current Pat object
+		Returns:
+			The set of program numbers that changed
+		"""
+		if not pat.complete or not pat.current_next_indicator: return set()
+		if pat.transport_stream_id != self.transport_stream_id:
+			self.transport_stream_id = pat.transport_stream_id
+			self._pat_sections = {}
+		found = self._pat_sections.get(pat.section_number)
+		if found is not None and found[0] == pat.version: return set()
+		self._pat_sections[pat.section_number] = (pat.version, dict(pat.table))
+		sections = [self._pat_sections.get(number) for number in range(pat.last_section_number + 1)]
+		changed = set()
+		table = pat.table
+		if None not in sections and not [found for found in sections if found[0] != pat.version]:
+			self.pat_version = pat.version
+			for number in list(self._pat_sections):
+				if number > pat.last_section_number: del self._pat_sections[number]
+			table = {}
+			for version, programs in sections: table.update(programs)
+			for prog in list(self._pmt_pid):
+				if prog not in table:
+					self._remove_program(prog)
+					changed.add(prog)
+		for prog, pid in table.items():
+			if self._pmt_pid.get(prog) == pid: continue
+			if prog in self._pmt_pid: self._remove_program(prog)
+			self._pmt_pid[prog] = pid
+			_link(self._pmt_programs, pid, prog)
+			changed.add(prog)
+		self._changed |= changed
+		return changed
+
+	def update_pmt(self, section):
+		"""Updates the index from a complete PMT section
+
+		Nothing is done if the section is not for a program in the PAT or if its version has already been seen.
+		Otherwise only the elementary streams of its program are replaced.
+		Arguments:
+			section -- complete and current PMT Section object
+		Returns:
+			True if the program's elementary streams changed
+		"""
+		if not section.complete or not section.current_next_indicator: return False
+		if section.table_id != PMT_TABLE_ID: return False
+		prog = section.table_id_extension
+		if prog not in self._pmt_pid: return False
+		if self._pmt_versions.get(prog) == section.version: return False
+		self._pmt_versions[prog] = section.version
+		streams = get_elementary_pids(section.table_body[5:])
+		old = self._streams.get(prog, {})
+		if streams == old: return False
+		for pid in old:
+			if pid not in streams: _unlink(self._es_programs, pid, prog)
+		for pid in streams:
+			if pid not in old: _link(self._es_programs, pid, prog)
+		self._streams[prog] = streams
+		self._changed.add(prog)
+		return True
+
+	def _remove_program(self, prog):
+		_unlink(self._pmt_programs, self._pmt_pid.pop(prog), prog)
+		for pid in self._streams.pop(prog, {}):
+			_unlink(self._es_programs, pid, prog)
+		self._pmt_versions.pop(prog, None)
+
+	def update_nit(self, nit):
+		"""Updates the index from a complete NIT section
+
+		Nothing is done if the version of the section has already been seen. Otherwise only the transport
+		streams listed in the section (or in its previous version) are replaced.
+		Arguments:
+			nit -- complete and current Nit object (actual or other network)
+		Returns:
+			The set of transport streams that changed
+		"""
+		if not nit.complete or not nit.current_next_indicator: return set()
+		key = (nit.table_id, nit.network_id, nit.section_number)
+		found = self._nit_sections.get(key)
+		if found is not None and found[0] == nit.version: return set()
+		listed = {}
+		for entry in nit.iter_transport_streams():
+			listed.setdefault(entry[0:2], {}).update(get_listed_services(nit, entry))
+		changed = set()
+		if found is not None:
+			for ts in found[1]:
+				if ts in listed: continue
+				self._remove_transport_stream(ts)
+				changed.add(ts)
+		for ts, services in listed.items():
+			old = self._ts_services.get(ts, {})
+			if services == old and ts in self._ts_services: continue
+			for service in old:
+				if service not in services: _unlink(self._service_ts, service, ts)
+			for service in services:
+				if service not in old: _link(self._service_ts, service, ts)
+			self._ts_services[ts] = services
+			changed.add(ts)
+		self._nit_sections[key] = (nit.version, frozenset(listed))
+		return changed
+
+	def _remove_transport_stream(self, ts):
+		for service in self._ts_services.pop(ts, {}):
+			_unlink(self._service_ts, service, ts)
+
+	def pop_changes(self):
+		"""Gets the programs that changed since the last call and clears the list
+
+		Returns:
+			The set of changed program numbers
+		"""
+		changed = self._changed
+		self._changed = set()
+		return changed
+
+	def programs(self):
+		"""Gets the program numbers in the PAT"""
+		return self._pmt_pid.keys()
+
+	def get_pmt_pid(self, prog):
+		"""Gets the PMT PID of a program (None if the program is not in the PAT)"""
+		return self._pmt_pid.get(prog)
+
+	def get_streams(self, prog):
+		"""Gets the elementary streams of a program as a dictionary mapping PIDs to stream types"""
+		return self._streams.get(prog, {})
+
+	def get_programs_for_pid(self, pid):
+		"""Gets the programs owning a PID, either as their PMT PID or as one of their elementary streams
+
+		Returns:
+			A set of program numbers (empty if no program uses the PID)
+		"""
+		programs = self._es_programs.get(pid)
+		if pid in self._pmt_programs:
+			if programs: return programs | self._pmt_programs[pid]
+			return set(self._pmt_programs[pid])
+		if programs: return set(programs)
+		return set()
+
+	def is_pmt_pid(self, pid):
+		"""Checks if the PID carries a PMT"""
+		return pid in self._pmt_programs
+
+	def transport_streams(self):
+		"""Gets the (transport stream ID, original network ID) of the transport streams in the NIT"""
+		return self._ts_services.keys()
+
+	def get_services(self, transport_stream_id, original_network_id):
+		"""Gets the services listed for a transport stream as a dictionary mapping service IDs to service types"""
+		return self._ts_services.get((transport_stream_id, original_network_id), {})
+
+	def get_transport_streams_for_service(self, service_id):
+		"""Gets the transport streams listing a service
+
+		Returns:
+			A set of (transport stream ID, original network ID) tuples (empty if no transport stream lists it)
+		"""
+		return set(self._service_ts.get(service_id, ()))
+
+'''UNIT TESTS -------------------------------------------------------------------------------------------------------------
+---------------------------------------------------------------------------------------------------------------------------
+'''
+if __name__ == '__main__':
+	import unittest
+	import _known_tables
+	from section import Section
+	from pat import Pat
+	from nit import Nit
+	from stream_generator import build_section
+
+	pat_data = _known_tables.get_sample_pat_data()[0]
+	pmt_data = _known_tables.get_sample_pmt_data()[0]
+	nit_data = _known_tables.get_sample_nit_data()[1]
+
+	def set_version(data, version):
+		data = list(data)
+		data[5] = (data[5] & 0xC1) | (version << 1)
+		return data
+
+	class Index(unittest.TestCase):
+		def setUp(self):
+			self.index = ServiceIndex()
+			self.pat = Pat(pat_data)
+			self.pat.table[1010] = 0x100 # program of the sample PMT
+			self.pmt = Section(pmt_data)
+
+		def testElementaryPids(self):
+			streams = get_elementary_pids(self.pmt.table_body[5:])
+			self.assertEqual({0x7D3: 0x1B, 0x7D4: 0x04, 0x7D5: 0x06, 0x7D6: 0x04}, streams)
+
+		def testLookups(self):
+			self.assertEqual(23, len(self.index.update_pat(self.pat)))
+			self.assertTrue(self.index.update_pmt(self.pmt))
+			self.assertEqual(0x100, self.index.get_pmt_pid(1010))
+			self.assertEqual(set([1010]), self.index.get_programs_for_pid(0x7D4))
+			self.assertEqual(set([1010, 1696]), self.index.get_programs_for_pid(0x7D3))
+			self.assertTrue(self.index.is_pmt_pid(0x20))
+			self.assertEqual(set(), self.index.get_programs_for_pid(0x1FFF))
+
+		def testSameVersion(self):
+			self.index.update_pat(self.pat)
+			self.index.update_pmt(self.pmt)
+			self.index.pop_changes()
+			pat = Pat(pat_data)
+			pat.table[1010] = 0x100
+			self.assertEqual(set(), self.index.update_pat(pat))
+			self.assertFalse(self.index.update_pmt(Section(pmt_data)))
+			self.assertEqual(set(), self.index.pop_changes())
+
+		def testPatChange(self):
+			self.index.update_pat(self.pat)
+			self.index.update_pmt(self.pmt)
+			self.index.pop_changes()
+			pat = Pat(set_version(pat_data, 17))
+			pat.table[1659] = 0x21
+			pat.table[5000] = 0x30
+			self.assertEqual(set([1010, 1659, 5000]), self.index.update_pat(pat))
+			self.assertEqual(set(), self.index.get_programs_for_pid(0x7D4))
+			self.assertEqual(set([1696]), self.index.get_programs_for_pid(0x7D3))
+			self.assertEqual(set([1659]), self.index.get_programs_for_pid(0x21))
+			self.assertFalse(self.index.is_pmt_pid(0x20))
+			self.assertEqual(set([1010, 1659, 5000]), self.index.pop_changes())
+
+		def testPatSections(self):
+			def pat(version, section_number, programs):
+				payload = []
+				for prog, pid in sorted(programs.items()): payload += [prog >> 8, prog & 0xff, 0xE0 | (pid >> 8), pid & 0xff]
+				return Pat(build_section(0x00, 1, version, section_number, 1, payload))
+			self.assertEqual(set([1, 2]), self.index.update_pat(pat(0, 0, {1: 0x100, 2: 0x101})))
+			self.assertEqual(set([3]), self.index.update_pat(pat(0, 1, {3: 0x102})))
+			self.assertEqual(set(), self.index.update_pat(pat(0, 0, {1: 0x100, 2: 0x101})))
+			self.assertEqual(set(), self.index.update_pat(pat(0, 1, {3: 0x102})))
+			self.assertEqual([1, 2, 3], sorted(self.index.programs()))
+			self.assertEqual(0, self.index.pat_version)
+			# new version: program 2 moved, program 3 replaced by program 4, removed only once both sections are in
+			self.assertEqual(set([2]), self.index.update_pat(pat(1, 0, {1: 0x100, 2: 0x105})))
+			self.assertEqual([1, 2, 3], sorted(self.index.programs()))
+			self.assertEqual(0x105, self.index.get_pmt_pid(2))
+			self.assertEqual(set([3, 4]), self.index.update_pat(pat(1, 1, {4: 0x103})))
+			self.assertEqual([1, 2, 4], sorted(self.index.programs()))
+			self.assertEqual(1, self.index.pat_version)
+			self.assertFalse(self.index.is_pmt_pid(0x101))
+
+		def testNit(self):
+			self.assertEqual(10, len(self.index.update_nit(Nit(_known_tables.get_sample_nit_data()[0]))))
+			self.assertEqual(3, len(self.index.update_nit(Nit(nit_data))))
+			self.assertEqual(13, len(self.index.transport_streams()))
+			self.assertEqual(set([(0x0A, 0x1800)]), self.index.get_transport_streams_for_service(1010))
+			self.assertEqual(1, self.index.get_services(0x0C, 0x1800)[12010])
+			self.assertEqual({}, self.index.get_services(0x0C, 0x1801))
+			self.assertEqual(set(), self.index.update_nit(Nit(nit_data)))
+			self.assertEqual(set(), self.index.update_nit(Nit(set_version(nit_data, 2))))
+
+		def testNitChange(self):
+			self.index.update_nit(Nit(nit_data))
+			# a new version listing only the first transport stream of the section
+			data = set_version(nit_data, 2)
+			loop_length = Nit(nit_data).find_transport_stream(0x0B)[3] - 12
+			data[10] = (data[10] & 0xF0) | (loop_length >> 8)
+			data[11] = loop_length & 0xFF
+			self.assertEqual(set([(0x0C, 0x1800), (0x0D, 0x1800)]), self.index.update_nit(Nit(data)))
+			self.assertEqual([(0x0B, 0x1800)], self.index.transport_streams())
+			self.assertEqual(set(), self.index.get_transport_streams_for_service(12010))
+			self.assertEqual(set([(0x0B, 0x1800)]), self.index.get_transport_streams_for_service(1110))
+
+	unittest.main()
@@ -0,0 +1,286 @@
+"""snapshot module
+
+	Provides a set of functions to save and restore completed Section objects (and their subclasses) to a
+	compact binary snapshot file. Restoring a snapshot does not run any CRC or bit parsing, the header fields
+	and parse results are written out as they are and put straight back into the restored objects.
+"""
+
+import struct
+
+import section_parser as sparse
+from section import Section
+from pat import Pat
+from cat import Cat
+from nit import Nit
+from section_record import SectionRecord
+
+SNAPSHOT_MAGIC   = 'PSIS'
+SNAPSHOT_VERSION = 1
+
+_FILE_HEADER     = struct.Struct('>4sBI')       # magic, format version, section count
+_RECORD_HEADER   = struct.Struct('>BBBHHBBBI')  # class tag, flags, table id, section length, table id extension,
+                                                # version, section number, last section number, crc
+_PROGRAM_ENTRY   = struct.Struct('>HH')         # program number, pmt pid
+
+_FLAG_SECTION_SYNTAX = 0x01
+_FLAG_PRIVATE        = 0x02
+_FLAG_EXTENDED       = 0x04
+_FLAG_CURRENT_NEXT   = 0x08
+_FLAG_CRC            = 0x10
+
+def _pack_pat(section):
+	"""Packs the Pat specific parse results (the program map)"""
+	entries = [struct.pack('>H', len(section.table))]
+	for prog in sorted(section.table):
+		entries.append(_PROGRAM_ENTRY.pack(prog, section.table[prog]))
+	return ''.join(entries)
+
+def _unpack_pat(section, data, offset):
+	"""Restores the Pat specific parse results. Returns the offset after the Pat data"""
+	count = struct.unpack_from('>H', data, offset)[0]
+	offset += 2
+	table = {}
+	for i in range(count):
+		prog, pid = _PROGRAM_ENTRY.unpack_from(data, offset)
+		table[prog] = pid
+		offset += _PROGRAM_ENTRY.size
+	section.table = table
+	section.transport_stream_id = section.table_id_extension
+	return offset
+
+# class tag -> (class, packer, unpacker). Tags are stored in the file so only ever append to this list
+_SNAPSHOT_CLASSES = [
+	(Section, None,      None),
+	(Pat,     _pack_pat, _unpack_pat),
+	(Cat,     None,      None),
+	(Nit,     None,      None),
+]
+
+def register_snapshot_class(cls, packer=None, unpacker=None):
+	"""Registers a Section subclass so that it can be saved in a snapshot
+
+	Arguments:
+		cls -- the Section subclass
+		packer -- function(section) returning a string of class specific parse results (default None)
+		unpacker -- function(section, data, offset) restoring the class specific parse results and returning the
+		offset after them (default None)
+	Returns:
+		The class tag used in the snapshot file
+	"""
+	for tag, entry in enumerate(_SNAPSHOT_CLASSES):
+		if entry[0] is cls: return tag
+	_SNAPSHOT_CLASSES.append((cls, packer, unpacker))
+	return len(_SNAPSHOT_CLASSES) - 1
+
+def _get_class_tag(section):
+	"""Gets the tag of the closest registered class of a section, a TrustedPat being saved as a Pat"""
+	for cls in type(section).__mro__:
+		for tag, entry in enumerate(_SNAPSHOT_CLASSES):
+			if entry[0] is cls: return tag
+	raise ValueError('no snapshot support for %s'%(type(section).__name__))
+
+def pack_sections(sections):
+	"""Packs a list of completed sections into a snapshot string
+
+	Sections are restored as the closest registered class, trusted sections as their typed class and
+	SectionRecord objects as the typed class of their table ID.
+	Arguments:
+		sections -- iterable of complete Section (or subclass) or SectionRecord objects. Incomplete sections are
+		skipped.
+	Returns:
+		A string holding the binary snapshot
+	"""
+	records = []
+	count   = 0
+	for section in sections:
+		if not section.complete: continue
+		if isinstance(section, SectionRecord): section = section.to_section()
+		tag = _get_class_tag(section)
+		flags = 0
+		if section.section_syntax_indicator: flags |= _FLAG_SECTION_SYNTAX
+		if section.private_indicator:        flags |= _FLAG_PRIVATE
+		if section.extended_header:
+			flags |= _FLAG_EXTENDED
+			if section.current_next_indicator: flags |= _FLAG_CURRENT_NEXT
+			ext     = (section.table_id_extension, section.version,
+			           section.section_number, section.last_section_number)
+		else:
+			ext     = (0, 0, 0, 0)
+		crc = getattr(section, 'crc', None)
+		if crc is not None: flags |= _FLAG_CRC
+		else: crc = 0
+		records.append(_RECORD_HEADER.pack(tag, flags, section.table_id, section.section_length,
+		                                   ext[0], ext[1], ext[2], ext[3], crc))
+		records.append(str(bytearray(section.data_cache[0:section.length])))
+		packer = _SNAPSHOT_CLASSES[tag][1]
+		if packer: records.append(packer(section))
+		count += 1
+	return _FILE_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, count) + ''.join(records)
+
+def unpack_sections(data):
+	"""Restores the sections held in a snapshot string
+
+	No section data is parsed, every object is rebuilt from the stored header fields and parse results.
+	Arguments:
+		data -- snapshot string as returned by pack_sections()
+	Returns:
+		A list of the restored sections, in the order they were saved
+	"""
+	magic, version, count = _FILE_HEADER.unpack_from(data, 0)
+	if magic != SNAPSHOT_MAGIC: raise ValueError('not a PSI snapshot')
+	if version != SNAPSHOT_VERSION: raise ValueError('unsupported snapshot version %d'%(version))
+	offset = _FILE_HEADER.size
+	sections = []
+	for i in range(count):
+		(tag, flags, table_id, section_length,
+		 ext, ver, scn, lscn, crc) = _RECORD_HEADER.unpack_from(data, offset)
+		offset += _RECORD_HEADER.size
+		cls, packer, unpacker = _SNAPSHOT_CLASSES[tag]
+		section = cls.__new__(cls)
+		section.table_id                 = table_id
+		section.section_syntax_indicator = bool(flags & _FLAG_SECTION_SYNTAX)
+		section.private_indicator        = bool(flags & _FLAG_PRIVATE)
+		section.section_length           = section_length
+		section.length                   = section_length + 3
+		section.header                   = True
+		section.extended_header          = bool(flags & _FLAG_EXTENDED)
+		if section.extended_header:
+			section.table_id_extension     = ext
+			section.version                = ver
+			section.current_next_indicator = bool(flags & _FLAG_CURRENT_NEXT)
+			section.section_number         = scn
+			section.last_section_number    = lscn
+		if flags & _FLAG_CRC: section.crc  = crc
+		section.data_cache               = list(bytearray(data[offset:offset+section.length]))
+		section.table_body               = section.data_cache[3:]
+		section.complete                 = True
+		offset += section.length
+		if unpacker: offset = unpacker(section, data, offset)
+		sections.append(section)
+	return sections
+
+def save_snapshot(filename, sections):
+	"""Saves the completed sections to a snapshot file
+
+	Arguments:
+		filename -- name of the snapshot file to (over)write
+		sections -- iterable of complete Section (or subclass) objects
+	"""
+	f = open(filename, 'wb')
+	try:
+		f.write(pack_sections(sections))
+	finally:
+		f.close()
+
+def load_snapshot(filename):
+	"""Loads the sections saved in a snapshot file
+
+	Arguments:
+		filename -- name of the snapshot file to read
+	Returns:
+		A list of the restored sections
+	"""
+	f = open(filename, 'rb')
+	try:
+		data = f.read()
+	finally:
+		f.close()
+	return unpack_sections(data)
+
+def is_current(section, data):
+	"""Checks a restored section against live section data
+
+	Only the header bytes of the live data are read. Once a warm restart is done this is used to check every
+	restored section against the live stream as its sections come around again.
+	Arguments:
+		section -- restored Section object
+		data -- array of live section data bytes, at least the full section header long
+	Returns:
+		True if the live data describes the same table version as the restored section
+	"""
+	if sparse.get_table_id(data) != section.table_id: return False
+	if not section.extended_header: return True
+	return (sparse.get_table_id_extension(data)     == section.table_id_extension and
+	        sparse.get_section_number(data)         == section.section_number and
+	        sparse.get_version_number(data)         == section.version and
+	        sparse.get_current_next_indicator(data) == section.current_next_indicator)
+
+'''UNIT TESTS -------------------------------------------------------------------------------------------------------------
+---------------------------------------------------------------------------------------------------------------------------
+'''
+if __name__ == '__main__':
+	import unittest
+	import os
+	import tempfile
+	import _known_tables
+	import section_factory
+	from stream_generator import build_section
+
+	nit_data_0 = _known_tables.get_sample_nit_data()[0]
+	cat_data   = _known_tables.get_sample_cat_data()[0]
+	pat_data   = _known_tables.get_sample_pat_data()[0]
+
+	class Snapshot(unittest.TestCase):
+		def setUp(self):
+			self.sections = [Nit(nit_data_0), Cat(cat_data), Pat(pat_data), Section(nit_data_0)]
+
+		def assertSameSection(self, expected, actual):
+			self.assertEqual(type(expected), type(actual))
+			for attr in ('table_id', 'section_syntax_indicator', 'private_indicator', 'section_length',
+			             'length', 'table_id_extension', 'version', 'current_next_indicator',
+			             'section_number', 'last_section_number', 'crc', 'data_cache', 'table_body',
+			             'complete', 'header', 'extended_header'):
+				self.assertEqual(getattr(expected, attr), getattr(actual, attr), 'bad %s'%(attr))
+
+		def testRoundTrip(self):
+			restored = unpack_sections(pack_sections(self.sections))
+			self.assertEqual(len(self.sections), len(restored))
+			for expected, actual in zip(self.sections, restored):
+				self.assertSameSection(expected, actual)
+			self.assertEqual(self.sections[2].table, restored[2].table)
+			self.assertEqual(16, restored[2].transport_stream_id)
+			self.assertEqual(list(self.sections[0].iter_transport_streams()), list(restored[0].iter_transport_streams()))
+
+		def testTrusted(self):
+			unknown = build_section(0x90, 1, 0, 0, 0, [1, 2, 3])
+			trusted = [section_factory.create_section(data, trusted=True)
+			           for data in (nit_data_0, cat_data, pat_data, unknown)]
+			records = [SectionRecord.from_section(section) for section in self.sections[0:3]]
+			restored = unpack_sections(pack_sections(trusted + records))
+			self.assertEqual(['TrustedNit', 'TrustedCat', 'TrustedPat', 'TrustedSection'],
+			                 [type(section).__name__ for section in trusted])
+			sections = self.sections[0:3] + [Section(unknown)] + self.sections[0:3]
+			self.assertEqual(len(sections), len(restored))
+			for expected, actual in zip(sections, restored):
+				self.assertSameSection(expected, actual)
+			self.assertEqual(self.sections[2].table, restored[2].table)
+			self.assertEqual(self.sections[2].table, restored[6].table)
+
+		def testSkipsIncomplete(self):
+			partial = Section()
+			partial.add_data(nit_data_0[0:10])
+			self.assertEqual(1, len(unpack_sections(pack_sections([partial, Section(cat_data)]))))
+
+		def testFile(self):
+			fd, filename = tempfile.mkstemp()
+			os.close(fd)
+			try:
+				save_snapshot(filename, self.sections)
+				restored = load_snapshot(filename)
+			finally:
+				os.remove(filename)
+			for expected, actual in zip(self.sections, restored):
+				self.assertSameSection(expected, actual)
+
+		def testBadMagic(self):
+			self.assertRaises(ValueError, unpack_sections, 'XXXX' + pack_sections(self.sections)[4:])
+
+		def testIsCurrent(self):
+			restored = unpack_sections(pack_sections(self.sections))
+			self.assertTrue(is_current(restored[2], pat_data))
+			newer = list(pat_data)
+			newer[5] = (newer[5] & 0xC1) | (17 << 1)
+			self.assertFalse(is_current(restored[2], newer))
+			self.assertFalse(is_current(restored[2], cat_data))
+
+	unittest.main()
@@ -0,0 +1,460 @@
+"""stream generator module
+
+	Provides a StreamGenerator class that generates a synthetic MPEG2-TS stream for load and stress testing.
+	The stream carries a PAT, one PMT per program, a multi section NIT and EIT present/following and schedule
+	tables, repeated at a set interval, with PCRs and filler packets for the elementary streams. Version churn,
+	packet loss and CRC corruption can be switched on. Given the same settings and seed the output is always the same.
+	Settings that do not fit the stream (too many programs or PIDs, or a repetition interval too short for one
+	repetition of every table) raise a ValueError.
+"""
+
+import random
+
+import ts_packet
+from section import Section
+from pat import build_program_map
+
+PAT_PID  = 0x0000
+NIT_PID  = 0x0010
+EIT_PID  = 0x0012
+PMT_PID_BASE = 0x0100
+ES_PID_BASE  = 0x0200
+
+PAT_TABLE_ID          = 0x00
+PMT_TABLE_ID          = 0x02
+NIT_TABLE_ID          = 0x40
+EIT_PF_TABLE_ID       = 0x4E
+EIT_SCHEDULE_TABLE_ID = 0x50
+
+BASE_MJD      = 58849 # 2020-01-01
+EVENT_SECONDS = 1800
+EVENTS_PER_SECTION = 4
+PCR_HZ        = 27000000
+MAX_LISTED_SERVICES = 64
+MAX_NIT_LOOP_LENGTH = 960
+MAX_PROGRAMS  = 253 # programs held by a single section PAT
+
+def build_section(table_id, table_id_extension, version, section_number, last_section_number, payload,
+                  private_indicator=False):
+	"""Builds a long section with a CRC
+
+	Arguments:
+		table_id -- table ID
+		table_id_extension -- table ID extension
+		version -- version number
+		section_number -- section number
+		last_section_number -- last section number
+		payload -- array of data bytes following the extended header (without the CRC)
+		private_indicator -- private section indicator (default False)
+	Returns:
+		An array of data bytes holding the entire section
+	"""
+	section = Section()
+	section.table_id                 = table_id
+	section.section_syntax_indicator = True
+	section.private_indicator        = private_indicator
+	section.section_length           = len(payload) + 5 + 4
+	section.table_id_extension       = table_id_extension
+	section.version                  = version
+	section.version_number           = version
+	section.current_next_indicator   = True
+	section.section_number           = section_number
+	section.last_section_number      = last_section_number
+	section.table_body               = list(payload) + [0xff] * 4
+	section.complete                 = True
+	return section.build()
+
+def _bcd(value):
+	return ((value // 10) << 4) | (value % 10)
+
+def encode_time(seconds):
+	"""Encodes a time, in seconds since BASE_MJD, as the 5 byte MJD + BCD time used by DVB SI"""
+	days, seconds = divmod(seconds, 86400)
+	mjd = BASE_MJD + days
+	return [mjd >> 8, mjd & 0xff, _bcd(seconds // 3600), _bcd(seconds // 60 % 60), _bcd(seconds % 60)]
+
+def encode_duration(seconds):
+	"""Encodes a duration in seconds as the 3 byte BCD duration used by DVB SI"""
+	return [_bcd(seconds // 3600), _bcd(seconds // 60 % 60), _bcd(seconds % 60)]
+
+def _descriptor(tag, payload):
+	return [tag, len(payload)] + list(payload)
+
+def _loop_length(length):
+	return [0xF0 | (length >> 8), length & 0xff]
+
+def _packet_count(data):
+	"""Number of packets ts_packet.packetize_section() splits a section into"""
+	first = ts_packet.TS_PACKET_SIZE - 5 # after the header and the pointer field
+	other = ts_packet.TS_PACKET_SIZE - 4
+	return 1 + (max(0, len(data) - first) + other - 1) // other
+
+class StreamGenerator(object):
+	"""Deterministic synthetic transport stream generator
+
+	StreamGenerator.packets() generates the stream one packet at a time and StreamGenerator.write() writes a
+	given number of packets to a file. Sections are only built once per table version and then reused.
+	sections_sent counts the sections whose packets were all generated (lost packets included) and
+	sections_dropped the sections cut short at the end of a repetition interval.
+	"""
+	def __init__(self, seed=0, programs=10, streams_per_program=2, psi_interval=1000, pcr_interval=40,
+	             bitrate=20000000, version_change_rate=0.0, transport_streams=16, nit_sections=2,
+	             eit_schedule_sections=0, loss_rate=0.0, crc_error_rate=0.0,
+	             transport_stream_id=1, original_network_id=1, network_id=1):
+		"""Constructor
+
+		Arguments:
+			seed -- random seed, the same seed and settings always give the same stream (default 0)
+			programs -- number of programs, up to MAX_PROGRAMS (253) as the PAT is a single section (default 10)
+			streams_per_program -- number of elementary streams per program (default 2)
+			psi_interval -- number of packets between the start of each PSI/SI repetition, it must leave room for
+			every section of one repetition next to the PCR packets (default 1000)
+			pcr_interval -- number of packets between PCRs (default 40)
+			bitrate -- stream bitrate in bits per second, used to work out the PCR values (default 20Mbit/s)
+			version_change_rate -- chance of each table changing version on each repetition (default 0.0)
+			transport_streams -- number of transport streams described in the NIT (default 16)
+			nit_sections -- number of sections the NIT is split into, more are used if needed (default 2)
+			eit_schedule_sections -- number of EIT schedule sections per program (default 0)
+			loss_rate -- chance of each packet being dropped (default 0.0)
+			crc_error_rate -- chance of each sent section having a bad CRC (default 0.0)
+			transport_stream_id -- transport stream ID (default 1)
+			original_network_id -- original network ID (default 1)
+			network_id -- network ID (default 1)
+		"""
+		if not 0 < programs <= MAX_PROGRAMS:
+			raise ValueError('programs must be from 1 to %d, not %d'%(MAX_PROGRAMS, programs))
+		if streams_per_program < 1:
+			raise ValueError('streams_per_program must be at least 1')
+		last_pid = ES_PID_BASE + programs * streams_per_program - 1
+		if last_pid >= ts_packet.NULL_PID:
+			raise ValueError('%d programs of %d streams need PIDs up to 0x%04x, past the last usable PID 0x%04x'%(
+			                 programs, streams_per_program, last_pid, ts_packet.NULL_PID - 1))
+		self.random                = random.Random(seed)
+		self.programs              = range(1, programs + 1)
+		self.streams_per_program   = streams_per_program
+		self.psi_interval          = psi_interval
+		self.pcr_interval          = pcr_interval
+		self.bitrate               = bitrate
+		self.version_change_rate   = version_change_rate
+		self.transport_streams     = transport_streams
+		self.nit_sections          = nit_sections
+		self.eit_schedule_sections = eit_schedule_sections
+		self.loss_rate             = loss_rate
+		self.crc_error_rate        = crc_error_rate
+		self.transport_stream_id   = transport_stream_id
+		self.original_network_id   = original_network_id
+		self.network_id            = network_id
+		self.pcr_pid               = self.get_es_pids(1)[0]
+		self.versions              = {}
+		self.packet_count          = 0
+		self.packets_lost          = 0
+		self.sections_sent         = 0
+		self.sections_dropped      = 0
+		self.sections_corrupted    = 0
+		self._continuity           = {}
+		self._sections             = {} # table key -> (version, list of section data)
+		self._fillers              = {}
+		needed = self.get_repetition_packets()
+		room = psi_interval
+		if pcr_interval: room -= (psi_interval + pcr_interval - 1) // pcr_interval
+		if needed > room:
+			raise ValueError('psi_interval of %d packets leaves room for %d PSI/SI packets, one repetition needs %d'%(
+			                 psi_interval, room, needed))
+
+	def get_pmt_pid(self, prog):
+		return PMT_PID_BASE + prog
+
+	def get_es_pids(self, prog):
+		first = ES_PID_BASE + (prog - 1) * self.streams_per_program
+		return range(first, first + self.streams_per_program)
+
+	def get_program_map(self):
+		"""Gets the PAT program map of the stream"""
+		return dict([(prog, self.get_pmt_pid(prog)) for prog in self.programs])
+
+	def _build_pat(self, version):
+		return [build_section(PAT_TABLE_ID, self.transport_stream_id, version, 0, 0,
+		                      build_program_map(self.get_program_map()))]
+
+	def _build_pmt(self, prog, version):
+		es_pids = self.get_es_pids(prog)
+		payload = [0xE0 | (es_pids[0] >> 8), es_pids[0] & 0xff] + _loop_length(0)
+		for i, pid in enumerate(es_pids):
+			stream_type = i == 0 and 0x1B or 0x04
+			payload += [stream_type, 0xE0 | (pid >> 8), pid & 0xff] + _loop_length(0)
+		return [build_section(PMT_TABLE_ID, prog, version, 0, 0, payload)]
+
+	def _build_nit(self, version):
+		entries = []
+		for i in range(self.transport_streams):
+			tsid = self.transport_stream_id + i
+			services = []
+			for prog in self.programs[0:MAX_LISTED_SERVICES]:
+				services += [prog >> 8, prog & 0xff, 0x01] # service id, digital television
+			frequency = [0x03, _bcd(i % 100), 0x00, 0x00] # BCD frequency
+			descriptors = (_descriptor(0x41, services) +
+			               _descriptor(0x44, frequency + [0xFF, 0xF2, 0x03, 0x00, 0x69, 0x00, 0x0F]))
+			entries.append([tsid >> 8, tsid & 0xff, self.original_network_id >> 8, self.original_network_id & 0xff] +
+			               _loop_length(len(descriptors)) + descriptors)
+		# split the loop over at least nit_sections sections, starting a new one when a section would be too long
+		loops = [[]]
+		per_section = (len(entries) + self.nit_sections - 1) // self.nit_sections
+		for entry in entries:
+			loop = loops[-1]
+			if loop and (len(loop) == per_section or sum(map(len, loop)) + len(entry) > MAX_NIT_LOOP_LENGTH):
+				loop = []
+				loops.append(loop)
+			loop.append(entry)
+		sections = []
+		name = _descriptor(0x40, bytearray('Generated network'))
+		for n, loop in enumerate(loops):
+			loop = sum(loop, [])
+			network_descriptors = n == 0 and name or []
+			payload = (_loop_length(len(network_descriptors)) + network_descriptors +
+			           _loop_length(len(loop)) + loop)
+			sections.append(build_section(NIT_TABLE_ID, self.network_id, version, n, len(loops) - 1, payload, True))
+		return sections
+
+	def _build_eit(self, table_id, prog, version, section_count, first_event):
+		sections = []
+		last = section_count - 1
+		for n in range(section_count):
+			payload = [self.transport_stream_id >> 8, self.transport_stream_id & 0xff,
+			           self.original_network_id >> 8, self.original_network_id & 0xff, last, table_id]
+			events_per_section = table_id == EIT_PF_TABLE_ID and 1 or EVENTS_PER_SECTION
+			for e in range(events_per_section):
+				event = first_event + n * events_per_section + e
+				name = bytearray('Event %d' % event)
+				descriptors = _descriptor(0x4D, bytearray('eng') + bytearray([len(name)]) + name + bytearray([0]))
+				payload += [event >> 8 & 0xff, event & 0xff] + encode_time(event * EVENT_SECONDS)
+				payload += encode_duration(EVENT_SECONDS)
+				payload += [0x80 | (len(descriptors) >> 8), len(descriptors) & 0xff] + descriptors
+			sections.append(build_section(table_id, prog, version, n, last, payload, True))
+		return sections
+
+	def _tables(self):
+		"""Gets the tables of one repetition as a list of (key, pid, build function) tuples"""
+		tables = [(('pat',), PAT_PID, self._build_pat)]
+		for prog in self.programs:
+			tables.append((('pmt', prog), self.get_pmt_pid(prog), lambda v, p=prog: self._build_pmt(p, v)))
+		tables.append((('nit',), NIT_PID, self._build_nit))
+		for prog in self.programs:
+			tables.append((('eit_pf', prog), EIT_PID,
+			               lambda v, p=prog: self._build_eit(EIT_PF_TABLE_ID, p, v, 2, 0)))
+			if self.eit_schedule_sections:
+				tables.append((('eit_schedule', prog), EIT_PID,
+				               lambda v, p=prog: self._build_eit(EIT_SCHEDULE_TABLE_ID, p, v,
+				                                                 self.eit_schedule_sections, 0)))
+		return tables
+
+	def get_repetition_packets(self):
+		"""Gets the number of packets of one repetition of every table (at version 0, table sizes do not change with
+		the version)"""
+		count = 0
+		for key, pid, build in self._tables():
+			cached = self._sections.get(key)
+			if cached is None:
+				cached = (0, build(0))
+				self._sections[key] = cached
+			count += sum([_packet_count(data) for data in cached[1]])
+		return count
+
+	def get_sections(self, key, pid, build):
+		"""Gets the sections of a table at its current version, changing its version at the version change rate"""
+		version = self.versions.get(key, 0)
+		if self.version_change_rate and self.random.random() < self.version_change_rate:
+			version = (version + 1) & 0x1f
+		self.versions[key] = version
+		cached = self._sections.get(key)
+		if cached and cached[0] == version: return cached[1]
+		sections = build(version)
+		self._sections[key] = (version, sections)
+		return sections
+
+	def _next_continuity(self, pid):
+		cc = self._continuity.get(pid, 0)
+		self._continuity[pid] = (cc + 1) & 0x0f
+		return cc
+
+	def _psi_packets(self):
+		"""Generates the packets of one repetition
+
+		Yields:
+			(packet, corrupted) tuples, corrupted being None for every packet but the last one of a section and
+			for the last one whether the section was sent with a bad CRC
+		"""
+		for key, pid, build in self._tables():
+			for data in self.get_sections(key, pid, build):
+				corrupted = False
+				if self.crc_error_rate and self.random.random() < self.crc_error_rate:
+					data = list(data)
+					data[-1] ^= 0xff
+					corrupted = True
+				packets, cc = ts_packet.packetize_section(data, pid, self._continuity.get(pid, 0))
+				self._continuity[pid] = cc
+				for packet in packets[0:-1]: yield packet, None
+				yield packets[-1], corrupted
+
+	def _filler_packet(self, pid):
+		template = self._fillers.get(pid)
+		if template is None:
+			template = ts_packet.create_packet(pid)
+			self._fillers[pid] = template
+		packet = bytearray(template)
+		ts_packet.set_continuity_counter(packet, self._next_continuity(pid))
+		return packet
+
+	def _pcr_packet(self):
+		pcr = self.packet_count * ts_packet.TS_PACKET_SIZE * 8 * PCR_HZ // self.bitrate
+		return ts_packet.create_pcr_packet(self.pcr_pid, pcr, self._continuity.get(self.pcr_pid, 0))
+
+	def packets(self, count=None):
+		"""Generates the stream
+
+		Arguments:
+			count -- number of packets to generate, before packet loss (default None, never stops)
+		Yields:
+			188 byte bytearrays
+		"""
+		es_pids = sum([self.get_es_pids(prog) for prog in self.programs], [])
+		filler = 0
+		while True:
+			psi = self._psi_packets()
+			for i in range(self.psi_interval):
+				if count is not None and self.packet_count >= count: return
+				if self.pcr_interval and self.packet_count % self.pcr_interval == 0:
+					packet = self._pcr_packet()
+				else:
+					packet, corrupted = next(psi, (None, None))
+					if packet is None:
+						packet = self._filler_packet(es_pids[filler])
+						filler = (filler + 1) % len(es_pids)
+					elif corrupted is not None:
+						self.sections_sent += 1
+						if corrupted: self.sections_corrupted += 1
+				self.packet_count += 1
+				if self.loss_rate and self.random.random() < self.loss_rate:
+					self.packets_lost += 1
+					continue
+				yield packet
+			# PSI that did not fit in the interval is not sent, only counted
+			for packet, corrupted in psi:
+				if corrupted is not None: self.sections_dropped += 1
+
+	def write(self, f, count, chunk_packets=1024):
+		"""Writes packets to a file
+
+		Arguments:
+			f -- file object opened for binary writing
+			count -- number of packets to generate, before packet loss
+			chunk_packets -- number of packets per write (default 1024)
+		Returns:
+			The number of packets written
+		"""
+		written = 0
+		chunk = []
+		for packet in self.packets(count):
+			chunk.append(str(packet))
+			if len(chunk) == chunk_packets:
+				f.write(''.join(chunk))
+				written += len(chunk)
+				chunk = []
+		if chunk:
+			f.write(''.join(chunk))
+			written += len(chunk)
+		return written
+
+'''UNIT TESTS -------------------------------------------------------------------------------------------------------------
+---------------------------------------------------------------------------------------------------------------------------
+'''
+if __name__ == '__main__':
+	import unittest
+	from StringIO import StringIO
+	import section_builder as sbuild
+	from assembler_pool import AssemblerPool
+
+	def demux(packets):
+		"""Reassembles the sections of a list of packets"""
+		pool = AssemblerPool()
+		sections = []
+		for packet in packets:
+			payload = ts_packet.get_payload_offset(packet)
+			if payload is None: continue
+			pid = ts_packet.get_pid(packet)
+			if ts_packet.get_payload_unit_start_indicator(packet):
+				payload += 1 + packet[payload]
+				sections += [(pid, s) for s in pool.add_data(pid, packet[payload:], start=True)]
+			else:
+				sections += [(pid, s) for s in pool.add_data(pid, packet[payload:])]
+		return sections
+
+	def crc_ok(section):
+		data = section.data_cache
+		return sbuild.calculate_crc(data[0:-4]) == list(data[-4:])
+
+	class Generator(unittest.TestCase):
+		def testDeterministic(self):
+			a = StringIO()
+			b = StringIO()
+			settings = dict(seed=5, programs=3, psi_interval=200, version_change_rate=0.5, loss_rate=0.01)
+			StreamGenerator(**settings).write(a, 1000)
+			StreamGenerator(**settings).write(b, 1000)
+			self.assertEqual(a.getvalue(), b.getvalue())
+			self.assertEqual(0, len(a.getvalue()) % ts_packet.TS_PACKET_SIZE)
+
+		def testTables(self):
+			generator = StreamGenerator(programs=4, psi_interval=300, eit_schedule_sections=3)
+			sections = demux(list(generator.packets(300)))
+			tables = {}
+			for pid, section in sections:
+				self.assertTrue(crc_ok(section), 'bad crc')
+				tables.setdefault((pid, section.table_id), []).append(section)
+			self.assertEqual(generator.get_program_map(), tables[(PAT_PID, PAT_TABLE_ID)][0].table)
+			self.assertEqual(4, len(tables[(0x101, PMT_TABLE_ID)] + tables[(0x102, PMT_TABLE_ID)] +
+			                        tables[(0x103, PMT_TABLE_ID)] + tables[(0x104, PMT_TABLE_ID)]))
+			self.assertEqual([0, 1], [s.section_number for s in tables[(NIT_PID, NIT_TABLE_ID)]])
+			self.assertEqual(8, len(tables[(EIT_PID, EIT_PF_TABLE_ID)]))
+			self.assertEqual(12, len(tables[(EIT_PID, EIT_SCHEDULE_TABLE_ID)]))
+
+		def testPcr(self):
+			generator = StreamGenerator(pcr_interval=10, bitrate=188 * 8 * 1000)
+			packets = list(generator.packets(100))
+			pcrs = [ts_packet.get_pcr(p) for p in packets if ts_packet.get_pid(p) == generator.pcr_pid]
+			pcrs = [pcr for pcr in pcrs if pcr is not None]
+			self.assertEqual(10, len(pcrs))
+			self.assertEqual(10 * PCR_HZ // 1000, pcrs[1] - pcrs[0])
+
+		def testVersionChurn(self):
+			generator = StreamGenerator(programs=2, psi_interval=100, version_change_rate=1.0)
+			versions = [s.version for pid, s in demux(list(generator.packets(500))) if s.table_id == PAT_TABLE_ID]
+			self.assertEqual([1, 2, 3, 4, 5], versions)
+
+		def testErrors(self):
+			generator = StreamGenerator(programs=2, psi_interval=100, crc_error_rate=0.5, loss_rate=0.05, seed=3)
+			packets = list(generator.packets(2000))
+			self.assertEqual(2000, len(packets) + generator.packets_lost)
+			self.assertTrue(generator.packets_lost > 0)
+			self.assertTrue(generator.sections_corrupted > 0)
+
+		def testSectionsSent(self):
+			generator = StreamGenerator(programs=3, psi_interval=200, eit_schedule_sections=2, crc_error_rate=0.2)
+			sections = demux(list(generator.packets(700)))
+			self.assertEqual(len(sections), generator.sections_sent)
+			self.assertEqual(len([s for pid, s in sections if not crc_ok(s)]), generator.sections_corrupted)
+			self.assertEqual(0, generator.sections_dropped)
+
+		def testLimits(self):
+			self.assertRaises(ValueError, StreamGenerator, programs=300)
+			self.assertRaises(ValueError, StreamGenerator, programs=0)
+			self.assertRaises(ValueError, StreamGenerator, programs=253, streams_per_program=32)
+			self.assertRaises(ValueError, StreamGenerator, programs=10, psi_interval=37)
+			self.assertEqual(37, StreamGenerator(programs=10).get_repetition_packets())
+			StreamGenerator(programs=10, psi_interval=37, pcr_interval=0)
+			generator = StreamGenerator(programs=253, streams_per_program=30)
+			self.assertTrue(generator.get_es_pids(253)[-1] < ts_packet.NULL_PID)
+
+		def testTime(self):
+			self.assertEqual([0xE5, 0xE2, 0x01, 0x02, 0x03], encode_time(86400 + 3600 + 120 + 3))
+			self.assertEqual([0x01, 0x30, 0x00], encode_duration(5400))
+
+	unittest.main()
@@ -0,0 +1,451 @@
+"""time index module
+
+	Provides a TimeIndex class, a sparse index of a transport stream capture mapping PCR derived time to the
+	byte offset of a packet together with the PAT and PMT sections in effect at that packet. The index is built
+	once with build_time_index() and stored next to the capture (capture name + INDEX_SUFFIX). Seeking to a time
+	is then a binary search over the index points and the parsing of the PSI from the point found up to the time.
+	A table not repeated between the point and the time is read back from the packet offset recorded for it
+	with the point.
+"""
+
+import bisect
+import mmap
+import os
+import struct
+
+import ts_packet
+from demux import Demux
+
+INDEX_MAGIC   = 'PSIT'
+INDEX_VERSION = 2
+INDEX_SUFFIX  = '.tidx'
+
+PCR_HZ   = 27000000
+PCR_WRAP = (1 << 33) * 300 # PCR values wrap around after the 33 bit base overflows
+
+PAT_PID      = 0x0000
+PAT_TABLE_ID = 0x00
+PMT_TABLE_ID = 0x02
+
+TS_PACKET_SIZE = ts_packet.TS_PACKET_SIZE
+
+_FILE_HEADER   = struct.Struct('>4sBdI')   # magic, format version, interval, point count
+_POINT         = struct.Struct('>dQH')     # time, byte offset, version count
+_VERSION_ENTRY = struct.Struct('>BHBHQ')   # table id, table id extension, version, pid, section offset
+
+def get_index_filename(filename):
+	"""Gets the name of the index file stored next to a capture"""
+	return filename + INDEX_SUFFIX
+
+class TimeIndex(object):
+	"""Sparse time to byte offset index of a capture
+
+	Each index point is a time in seconds, the byte offset of the PCR packet it was taken at and a tuple of the
+	(table id, table id extension, version, pid, section offset) of the last section of every PAT and PMT seen
+	up to that packet. The section offset is that of a packet of the PID from which demultiplexing gives back
+	the section, the packet it started in or the payload unit start before it.
+	"""
+	def __init__(self, interval=1.0):
+		"""Constructor
+
+		Arguments:
+			interval -- number of seconds between index points (default 1.0)
+		"""
+		self.interval = interval
+		self.times    = []
+		self.offsets  = []
+		self.versions = []
+
+	def __len__(self):
+		return len(self.times)
+
+	def add_point(self, time, offset, versions):
+		"""Appends an index point, points must be added in time order"""
+		if self.versions and self.versions[-1] == versions: versions = self.versions[-1] # share unchanged tuples
+		self.times.append(time)
+		self.offsets.append(offset)
+		self.versions.append(versions)
+
+	def find(self, time):
+		"""Finds the last index point at or before a time
+
+		Arguments:
+			time -- time in seconds, a time before the first point gives the first point
+		Returns:
+			The index position of the point or None if the index is empty
+		"""
+		if not self.times: return None
+		return max(bisect.bisect_right(self.times, time) - 1, 0)
+
+	def get_point(self, i):
+		"""Gets the (time, offset, versions) of an index point"""
+		return self.times[i], self.offsets[i], self.versions[i]
+
+	def seek(self, filename, time):
+		"""Parses the PAT and PMTs in effect at a time
+
+		The sections in effect are the last ones received before the first PCR past the time. They are taken
+		from the capture between the index point found and the time. A table not repeated in that stretch is
+		parsed again from the packet offset recorded for it at the index point, which reads only the few packets
+		of that one section.
+		Arguments:
+			filename -- name of the capture the index was built from
+			time -- time in seconds
+		Returns:
+			A (pat, pmts) tuple as returned by read_psi(), (None, {}) if the index is empty
+		"""
+		i = self.find(time)
+		if i is None: return None, {}
+		target = self._find_offset(filename, i, time)
+		found = {} # (table id, table id extension) -> (pid, section)
+		pat = None
+		for offset, pid, section in _iter_psi(filename, self.offsets[i], target):
+			found[(section.table_id, section.table_id_extension)] = (pid, section)
+			if section.table_id == PAT_TABLE_ID: pat = section
+
+		# tables not repeated since the index point, from where they were last sent before it
+		if pat is None:
+			pats = [entry for entry in self.versions[i] if entry[0] == PAT_TABLE_ID]
+			if pats: pat = _read_section(filename, max(pats, key=lambda entry: entry[4]))
+			if pat is None: return None, {}
+		previous = dict([(entry[1], entry) for entry in self.versions[i] if entry[0] == PMT_TABLE_ID])
+		pmts = {}
+		for prog, pmt_pid in pat.table.items():
+			pid, section = found.get((PMT_TABLE_ID, prog), (None, None))
+			if pid is None and prog in previous:
+				pid = previous[prog][3]
+				if pid == pmt_pid: section = _read_section(filename, previous[prog])
+			if pid == pmt_pid and section is not None: pmts[prog] = section
+		return pat, pmts
+
+	def _find_offset(self, filename, i, time):
+		"""Finds the byte offset of the first PCR packet past a time, starting from an index point
+
+		Returns:
+			The offset or None if the capture ends first
+		"""
+		start = self.offsets[i]
+		end = i + 1 < len(self.offsets) and self.offsets[i + 1] + TS_PACKET_SIZE or None
+		pcr_pid = last_pcr = None
+		elapsed = 0
+		for base, data in _iter_chunks(filename, start, end):
+			for offset in xrange(0, len(data), TS_PACKET_SIZE):
+				pid = ts_packet.get_pid(data, offset)
+				if pcr_pid is not None and pid != pcr_pid: continue
+				pcr = ts_packet.get_pcr(data, offset)
+				if pcr is None: continue
+				if pcr_pid is None: pcr_pid = pid # the index point is taken at a PCR packet
+				else: elapsed += (pcr - last_pcr) % PCR_WRAP
+				last_pcr = pcr
+				if self.times[i] + float(elapsed) / PCR_HZ > time: return base + offset
+		return None
+
+	def save(self, filename):
+		"""Writes the index to a file"""
+		records = [_FILE_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, self.interval, len(self.times))]
+		for time, offset, versions in zip(self.times, self.offsets, self.versions):
+			records.append(_POINT.pack(time, offset, len(versions)))
+			for entry in versions: records.append(_VERSION_ENTRY.pack(*entry))
+		f = open(filename, 'wb')
+		try:
+			f.write(''.join(records))
+		finally:
+			f.close()
+
+	@classmethod
+	def load(cls, filename):
+		"""Reads an index written by TimeIndex.save()"""
+		f = open(filename, 'rb')
+		try:
+			data = f.read()
+		finally:
+			f.close()
+		magic, version, interval, count = _FILE_HEADER.unpack_from(data, 0)
+		if magic != INDEX_MAGIC: raise ValueError('not a time index')
+		if version != INDEX_VERSION: raise ValueError('unsupported time index version %d'%(version))
+		index = cls(interval)
+		offset = _FILE_HEADER.size
+		for i in range(count):
+			time, packet_offset, version_count = _POINT.unpack_from(data, offset)
+			offset += _POINT.size
+			versions = []
+			for j in range(version_count):
+				versions.append(_VERSION_ENTRY.unpack_from(data, offset))
+				offset += _VERSION_ENTRY.size
+			index.add_point(time, packet_offset, tuple(versions))
+		return index
+
+def _iter_chunks(filename, offset=0, end=None, chunk_packets=4096):
+	"""Reads a capture through a memory map in chunks of whole packets
+
+	The memory map cannot be read as integers in place, so each chunk is copied once into a bytearray.
+	Yields:
+		(chunk offset, bytearray) tuples
+	"""
+	f = open(filename, 'rb')
+	try:
+		size = os.fstat(f.fileno()).st_size
+		if end is None or end > size: end = size
+		end -= (end - offset) % TS_PACKET_SIZE
+		if end <= offset: return
+		data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		try:
+			chunk_size = chunk_packets * TS_PACKET_SIZE
+			while offset < end:
+				yield offset, bytearray(data[offset:min(offset + chunk_size, end)])
+				offset += chunk_size
+		finally:
+			data.close()
+	finally:
+		f.close()
+
+def build_time_index(filename, interval=1.0, pcr_pid=None, start_time=0.0):
+	"""Builds the time index of a capture
+
+	Time is worked out from the PCR, starting at start_time on the first PCR and carrying on across PCR wrap
+	arounds.
+	Arguments:
+		filename -- name of the capture file (back to back 188 byte packets)
+		interval -- number of seconds between index points (default 1.0)
+		pcr_pid -- PID to take the PCR from (default None, the first PID carrying a PCR)
+		start_time -- time of the first PCR in seconds (default 0.0)
+	Returns:
+		The TimeIndex
+	"""
+	index = TimeIndex(interval)
+	demux = Demux(pids=set([PAT_PID]))
+	versions = {} # (table id, table id extension) -> (version, pid, section offset)
+	starts = {}   # pid -> offset of the last packet with a payload unit start
+	first_pcr = last_pcr = None
+	wraps = 0
+	next_time = start_time
+	for base, data in _iter_chunks(filename):
+		for offset in xrange(0, len(data), TS_PACKET_SIZE):
+			pid = ts_packet.get_pid(data, offset)
+			if pcr_pid is None or pid == pcr_pid:
+				pcr = ts_packet.get_pcr(data, offset)
+				if pcr is not None:
+					pcr_pid = pid
+					if first_pcr is None: first_pcr = pcr
+					elif pcr < last_pcr: wraps += 1
+					last_pcr = pcr
+					time = start_time + float(pcr + wraps * PCR_WRAP - first_pcr) / PCR_HZ
+					if time >= next_time:
+						current = sorted([key + value for key, value in versions.items()])
+						index.add_point(time, base + offset, tuple(current))
+						next_time += interval * (int((time - next_time) / interval) + 1)
+			if pid not in demux.pids: continue
+			# a section completed in this packet started in it or at the previous payload unit start
+			start = starts.get(pid, base + offset)
+			if ts_packet.get_payload_unit_start_indicator(data, offset): starts[pid] = base + offset
+			for pid, section in demux.feed(data, offset):
+				if not section.extended_header or not section.current_next_indicator: continue
+				if section.table_id == PAT_TABLE_ID:
+					demux.pids.update(section.table.values())
+				elif section.table_id != PMT_TABLE_ID:
+					continue
+				versions[(section.table_id, section.table_id_extension)] = (section.version, pid, start)
+	return index
+
+def get_time_index(filename, interval=1.0, pcr_pid=None, start_time=0.0):
+	"""Loads the time index stored next to a capture, building and storing it first if needed
+
+	An index file older than the capture or of another format version is rebuilt.
+	Arguments:
+		See build_time_index()
+	Returns:
+		The TimeIndex
+	"""
+	index_filename = get_index_filename(filename)
+	if os.path.exists(index_filename) and os.path.getmtime(index_filename) >= os.path.getmtime(filename):
+		try:
+			return TimeIndex.load(index_filename)
+		except ValueError:
+			pass
+	index = build_time_index(filename, interval, pcr_pid, start_time)
+	index.save(index_filename)
+	return index
+
+def _iter_psi(filename, offset=0, end=None, pmt_pids=(), chunk_packets=4096):
+	"""Walks the current PAT and PMT sections of a capture
+
+	The PMT PIDs of every PAT seen are followed from then on.
+	Arguments:
+		filename -- name of the capture file
+		offset -- byte offset of the packet to start from (default 0)
+		end -- byte offset to stop at (default None, the end of the capture)
+		pmt_pids -- PMT PIDs to follow from the start (default (), none)
+		chunk_packets -- number of packets read at a time (default 4096)
+	Yields:
+		(packet offset, pid, section) tuples, the packet being the one completing the section
+	"""
+	demux = Demux(pids=set([PAT_PID]) | set(pmt_pids))
+	for base, data in _iter_chunks(filename, offset, end, chunk_packets):
+		for packet in xrange(0, len(data), TS_PACKET_SIZE):
+			for pid, section in demux.feed(data, packet):
+				if not section.extended_header or not section.current_next_indicator: continue
+				if section.table_id == PAT_TABLE_ID:
+					if pid != PAT_PID: continue
+					demux.pids.update(section.table.values())
+				elif section.table_id != PMT_TABLE_ID:
+					continue
+				yield base + packet, pid, section
+
+def _read_section(filename, entry):
+	"""Parses the section of an index point entry again from its recorded offset
+
+	Returns:
+		The section or None if it is not found
+	"""
+	table_id, extension, version, pid, offset = entry
+	for found, section_pid, section in _iter_psi(filename, offset, None, (pid,), chunk_packets=64):
+		if section_pid != pid or section.table_id != table_id or section.table_id_extension != extension: continue
+		return section.version == version and section or None
+	return None
+
+def read_psi(filename, offset=0, end=None):
+	"""Parses the first PAT and the PMTs of its programs from a point in a capture
+
+	Parsing stops as soon as the PAT and every PMT it lists have been seen.
+	Arguments:
+		filename -- name of the capture file
+		offset -- byte offset of the packet to start from (default 0)
+		end -- byte offset to stop at (default None, the end of the capture)
+	Returns:
+		A (pat, pmts) tuple, pat being the Pat (None if not found) and pmts a dictionary mapping program numbers
+		to their PMT sections
+	"""
+	demux = Demux(pids=set([PAT_PID]))
+	pat = None
+	pmts = {}
+	for base, data in _iter_chunks(filename, offset, end):
+		for packet in xrange(0, len(data), TS_PACKET_SIZE):
+			for pid, section in demux.feed(data, packet):
+				if not section.extended_header or not section.current_next_indicator: continue
+				if section.table_id == PAT_TABLE_ID and pat is None:
+					pat = section
+					demux.pids = set(pat.table.values())
+				elif section.table_id == PMT_TABLE_ID and pat is not None:
+					if pat.table.get(section.table_id_extension) == pid:
+						pmts.setdefault(section.table_id_extension, section)
+				if pat is not None and len(pmts) == len(pat.table): return pat, pmts
+	return pat, pmts
+
+'''UNIT TESTS -------------------------------------------------------------------------------------------------------------
+---------------------------------------------------------------------------------------------------------------------------
+'''
+if __name__ == '__main__':
+	import unittest
+	import tempfile
+	from stream_generator import StreamGenerator
+
+	class Index(unittest.TestCase):
+		def setUp(self):
+			fd, self.filename = tempfile.mkstemp()
+			f = os.fdopen(fd, 'wb')
+			# 1000 packets per second, PSI every 100ms, versions changing now and then
+			self.generator = StreamGenerator(seed=3, programs=4, psi_interval=100, pcr_interval=10,
+			                                 bitrate=TS_PACKET_SIZE * 8 * 1000, version_change_rate=0.2,
+			                                 transport_streams=2)
+			self.generator.write(f, 6000)
+			f.close()
+
+		def tearDown(self):
+			for name in (self.filename, get_index_filename(self.filename)):
+				if os.path.exists(name): os.remove(name)
+
+		def testBuild(self):
+			index = build_time_index(self.filename, start_time=100.0)
+			self.assertEqual(6, len(index))
+			self.assertEqual([100.0, 101.0, 102.0], index.times[0:3])
+			self.assertEqual(1000 * TS_PACKET_SIZE, index.offsets[1])
+			self.assertEqual((), index.versions[0])
+			self.assertEqual(5, len(index.versions[1]))
+			self.assertEqual(4, index.find(104.5))
+			self.assertEqual(0, index.find(10.0))
+
+		def get_expected(self, time):
+			"""Works out the PAT and PMTs in effect at a time by walking the whole capture"""
+			pcrs = [] # (time, offset) of every PCR
+			for base, data in _iter_chunks(self.filename):
+				for offset in xrange(0, len(data), TS_PACKET_SIZE):
+					pcr = ts_packet.get_pcr(data, offset)
+					if pcr is not None: pcrs.append((float(pcr - self.first_pcr) / PCR_HZ, base + offset))
+			later = [offset for pcr_time, offset in pcrs if pcr_time > time]
+			target = later and later[0] or None
+			pat = None
+			pmts = {}
+			for offset, pid, section in _iter_psi(self.filename, 0, target):
+				if section.table_id == PAT_TABLE_ID: pat = section
+				else: pmts[section.table_id_extension] = (pid, section)
+			return pat, dict([(prog, pmts[prog][1]) for prog in pat.table if pmts[prog][0] == pat.table[prog]])
+
+		def testSeek(self):
+			index = build_time_index(self.filename)
+			self.first_pcr = ts_packet.get_pcr(bytearray(open(self.filename, 'rb').read(TS_PACKET_SIZE)))
+			changes = 0
+			previous = None
+			for step in range(1, 94):
+				time = step * 0.0625
+				pat, pmts = index.seek(self.filename, time)
+				expected_pat, expected_pmts = self.get_expected(time)
+				self.assertEqual(expected_pat.version, pat.version, 'PAT version at %.4f'%(time))
+				self.assertEqual(expected_pat.table, pat.table)
+				self.assertEqual(sorted(expected_pmts), sorted(pmts))
+				for prog, section in expected_pmts.items():
+					self.assertEqual((section.version, section.crc), (pmts[prog].version, pmts[prog].crc),
+					                 'PMT %d version at %.4f'%(prog, time))
+				if previous is not None and previous != pat.version: changes += 1
+				previous = pat.version
+			self.assertTrue(changes > 5)
+			pat, pmts = index.seek(self.filename, 100.0) # past the end of the capture
+			self.assertEqual(self.get_expected(100.0)[0].version, pat.version)
+
+		def testSeekReads(self):
+			# two programs, the PMT of the second one never sent
+			generator = StreamGenerator(seed=5, programs=2, psi_interval=300, pcr_interval=10,
+			                            bitrate=TS_PACKET_SIZE * 8 * 1000)
+			packets = list(generator.packets(30000))
+			f = open(self.filename, 'wb')
+			f.write(''.join([str(packet) for packet in packets]))
+			f.close()
+			pat = read_psi(self.filename)[0]
+			missing = pat.table[max(pat.table)]
+			f = open(self.filename, 'wb')
+			f.write(''.join([str(packet) for packet in packets if ts_packet.get_pid(packet) != missing]))
+			f.close()
+			index = build_time_index(self.filename)
+			calls = []
+			def counting(filename, offset=0, end=None, chunk_packets=4096):
+				calls.append((offset, end, chunk_packets))
+				return iter_chunks(filename, offset, end, chunk_packets)
+			iter_chunks = _iter_chunks
+			globals()['_iter_chunks'] = counting
+			try:
+				pat, pmts = index.seek(self.filename, 25.1) # no PSI between the index point and the time
+			finally:
+				globals()['_iter_chunks'] = iter_chunks
+			self.assertEqual(2, len(pat.table))
+			self.assertEqual([min(pat.table)], pmts.keys())
+			# the time, the stretch from the index point and one section each for the PAT and the PMT sent
+			self.assertEqual(4, len(calls))
+			self.assertEqual(index.offsets[25], calls[1][0])
+			for offset, end, chunk_packets in calls[2:]: self.assertEqual(64, chunk_packets)
+
+		def testStored(self):
+			built = get_time_index(self.filename)
+			self.assertTrue(os.path.exists(get_index_filename(self.filename)))
+			loaded = get_time_index(self.filename)
+			self.assertEqual(built.times, loaded.times)
+			self.assertEqual(built.offsets, loaded.offsets)
+			self.assertEqual(built.versions, loaded.versions)
+
+		def testPcrWrap(self):
+			f = open(self.filename, 'wb')
+			for i, pcr in enumerate([PCR_WRAP - PCR_HZ, PCR_WRAP - PCR_HZ / 2, PCR_HZ / 2, PCR_HZ]):
+				f.write(str(ts_packet.create_pcr_packet(0x100, pcr, i)))
+			f.close()
+			index = build_time_index(self.filename, interval=1.0)
+			self.assertEqual([0.0, 1.5, 2.0], index.times)
+
+	unittest.main()
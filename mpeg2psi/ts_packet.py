@@ -0,0 +1,201 @@
+"""transport stream packet module
+
+	Provides a set of functions to parse and build MPEG2-TS packets, and to split sections into packets.
+	The getters take an offset so that packets can be read in place from a larger buffer of packets.
+"""
+
+import field_spec
+
+TS_PACKET_SIZE = 188
+SYNC_BYTE      = 0x47
+NULL_PID       = 0x1FFF
+STUFFING_BYTE  = 0xFF
+
+TS_PACKET_FIELDS = [
+	('sync_byte',                    0, 0, 8,  'sync byte'),
+	('transport_error_indicator',    1, 0, 1,  'transport error indicator'),
+	('payload_unit_start_indicator', 1, 1, 1,  'payload unit start indicator'),
+	('transport_priority',           1, 2, 1,  'transport priority'),
+	('pid',                          1, 3, 13, 'PID'),
+	('transport_scrambling_control', 3, 0, 2,  'transport scrambling control'),
+	('adaptation_field_control',     3, 2, 2,  'adaptation field control'),
+	('continuity_counter',           3, 4, 4,  'continuity counter'),
+	# adaptation field
+	('adaptation_field_length',      4, 0, 8,  'adaptation field length'),
+	('discontinuity_indicator',      5, 0, 1,  'discontinuity indicator'),
+	('random_access_indicator',      5, 1, 1,  'random access indicator'),
+	('pcr_flag',                     5, 3, 1,  'PCR flag'),
+	('pcr_base',                     6, 0, 33, 'PCR base'),
+	('pcr_extension',               10, 7, 9,  'PCR extension'),
+]
+_FIELDS = field_spec.compile_fields(TS_PACKET_FIELDS, relative=True)
+
+get_sync_byte                    = _FIELDS['get_sync_byte']
+get_transport_error_indicator    = _FIELDS['get_transport_error_indicator']
+get_payload_unit_start_indicator = _FIELDS['get_payload_unit_start_indicator']
+get_pid                          = _FIELDS['get_pid']
+get_adaptation_field_control     = _FIELDS['get_adaptation_field_control']
+get_continuity_counter           = _FIELDS['get_continuity_counter']
+get_adaptation_field_length      = _FIELDS['get_adaptation_field_length']
+get_discontinuity_indicator      = _FIELDS['get_discontinuity_indicator']
+get_pcr_flag                     = _FIELDS['get_pcr_flag']
+get_pcr_base                     = _FIELDS['get_pcr_base']
+get_pcr_extension                = _FIELDS['get_pcr_extension']
+
+set_payload_unit_start_indicator = _FIELDS['set_payload_unit_start_indicator']
+set_pid                          = _FIELDS['set_pid']
+set_adaptation_field_control     = _FIELDS['set_adaptation_field_control']
+set_continuity_counter           = _FIELDS['set_continuity_counter']
+set_adaptation_field_length      = _FIELDS['set_adaptation_field_length']
+set_pcr_flag                     = _FIELDS['set_pcr_flag']
+set_pcr_base                     = _FIELDS['set_pcr_base']
+set_pcr_extension                = _FIELDS['set_pcr_extension']
+
+def has_adaptation_field(data, offset=0):
+	"""True if the packet carries an adaptation field"""
+	return (data[offset+3] & 0x20) != 0
+
+def has_payload(data, offset=0):
+	"""True if the packet carries a payload"""
+	return (data[offset+3] & 0x10) != 0
+
+def get_payload_offset(data, offset=0):
+	"""Gets the offset of the packet payload
+
+	Arguments:
+		data -- array of data bytes holding the packet
+		offset -- offset of the packet in data (default 0)
+	Returns:
+		The offset (in data) of the first payload byte or None if the packet has no payload
+	"""
+	if not data[offset+3] & 0x10: return None
+	if data[offset+3] & 0x20:
+		payload = offset + 5 + data[offset+4]
+		if payload >= offset + TS_PACKET_SIZE: return None
+		return payload
+	return offset + 4
+
+def get_pcr(data, offset=0):
+	"""Gets the program clock reference of the packet
+
+	Returns:
+		The PCR in 27MHz units or None if the packet carries no PCR
+	"""
+	if not data[offset+3] & 0x20: return None
+	if data[offset+4] < 7 or not data[offset+5] & 0x10: return None
+	return get_pcr_base(data, offset) * 300 + get_pcr_extension(data, offset)
+
+def create_packet(pid, continuity_counter=0, payload_unit_start=False):
+	"""Creates a packet with a payload only and every payload byte set to stuffing (0xFF)
+
+	Returns:
+		A bytearray of 188 bytes
+	"""
+	data = bytearray([STUFFING_BYTE]) * TS_PACKET_SIZE
+	data[0] = SYNC_BYTE
+	data[1] = 0x00
+	data[2] = 0x00
+	data[3] = 0x10
+	set_payload_unit_start_indicator(data, payload_unit_start)
+	set_pid(data, pid)
+	set_continuity_counter(data, continuity_counter)
+	return data
+
+def create_pcr_packet(pid, pcr, continuity_counter=0):
+	"""Creates an adaptation field only packet carrying a PCR
+
+	Arguments:
+		pid -- PID of the packet
+		pcr -- program clock reference in 27MHz units
+		continuity_counter -- counter value, not incremented by adaptation field only packets (default 0)
+	Returns:
+		A bytearray of 188 bytes
+	"""
+	data = create_packet(pid, continuity_counter)
+	set_adaptation_field_control(data, 2)
+	set_adaptation_field_length(data, TS_PACKET_SIZE - 5)
+	data[5] = 0x00
+	set_pcr_flag(data, True)
+	data[10] = 0x7E # reserved bits
+	set_pcr_base(data, (pcr // 300) & 0x1FFFFFFFF)
+	set_pcr_extension(data, pcr % 300)
+	return data
+
+def packetize_section(data, pid, continuity_counter=0):
+	"""Splits a section into transport stream packets
+
+	The first packet has the payload unit start indicator set and a zero pointer field. The last packet is
+	padded with stuffing bytes.
+	Arguments:
+		data -- array of data bytes of the entire section
+		pid -- PID of the packets
+		continuity_counter -- counter value of the first packet (default 0)
+	Returns:
+		A tuple (list of 188 byte bytearrays, counter value for the next packet on the PID)
+	"""
+	packets = []
+	offset = 0
+	length = len(data)
+	while offset < length or not packets:
+		packet = create_packet(pid, continuity_counter, not packets)
+		start = 4
+		if len(packets) == 0:
+			packet[4] = 0 # pointer field
+			start = 5
+		chunk = data[offset:offset + TS_PACKET_SIZE - start]
+		packet[start:start+len(chunk)] = bytearray(chunk)
+		offset += len(chunk)
+		packets.append(packet)
+		continuity_counter = (continuity_counter + 1) & 0x0f
+	return packets, continuity_counter
+
+'''UNIT TESTS -------------------------------------------------------------------------------------------------------------
+---------------------------------------------------------------------------------------------------------------------------
+'''
+if __name__ == '__main__':
+	import unittest
+	import _known_tables
+
+	nit_data_0 = _known_tables.get_sample_nit_data()[0]
+	cat_data   = _known_tables.get_sample_cat_data()[0]
+
+	class Packets(unittest.TestCase):
+		def testHeader(self):
+			packet = create_packet(0x1234, 7, True)
+			self.assertEqual(TS_PACKET_SIZE, len(packet))
+			self.assertEqual(SYNC_BYTE, get_sync_byte(packet))
+			self.assertTrue(get_payload_unit_start_indicator(packet))
+			self.assertEqual(0x1234, get_pid(packet))
+			self.assertEqual(7, get_continuity_counter(packet))
+			self.assertEqual(4, get_payload_offset(packet))
+			self.assertEqual(None, get_pcr(packet))
+
+		def testOffset(self):
+			packets = create_packet(1, 1) + create_packet(2, 2)
+			self.assertEqual(2, get_pid(packets, TS_PACKET_SIZE))
+			self.assertEqual(TS_PACKET_SIZE + 4, get_payload_offset(packets, TS_PACKET_SIZE))
+
+		def testPcr(self):
+			pcr = (0x1ABCDEF01 * 300) + 299
+			packet = create_pcr_packet(0x100, pcr, 3)
+			self.assertEqual(pcr, get_pcr(packet))
+			self.assertEqual(None, get_payload_offset(packet))
+			self.assertEqual(0x100, get_pid(packet))
+
+		def testPacketize(self):
+			packets, cc = packetize_section(nit_data_0, 0x10, 14)
+			self.assertEqual(6, len(packets))
+			self.assertEqual(4, cc)
+			self.assertEqual([14, 15, 0, 1, 2, 3], [get_continuity_counter(p) for p in packets])
+			self.assertEqual([True] + [False] * 5, [get_payload_unit_start_indicator(p) for p in packets])
+			payload = packets[0][5:]
+			for packet in packets[1:]: payload += packet[4:]
+			self.assertEqual(bytearray(nit_data_0), payload[0:len(nit_data_0)])
+			self.assertEqual(bytearray([STUFFING_BYTE]) * (len(payload) - len(nit_data_0)), payload[len(nit_data_0):])
+
+		def testSmallSection(self):
+			packets, cc = packetize_section(cat_data, 1)
+			self.assertEqual(1, len(packets))
+			self.assertEqual(bytearray(cat_data), packets[0][5:5+len(cat_data)])
+
+	unittest.main()
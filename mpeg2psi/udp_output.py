@@ -0,0 +1,210 @@
+"""UDP output module
+
+	Provides a UdpOutput class that sends 188 byte transport stream packets over UDP at a constant bitrate.
+	Packets are grouped into datagrams of (normally) 7 packets held in reusable buffers, and the datagrams
+	are sent in batches paced against the target bitrate: there is one wait per batch, until the batch is due,
+	and the datagrams of the batch are then sent back to back. A batch lasts long enough at the target bitrate
+	for the wait to be well above the resolution of time.sleep().
+"""
+
+import socket
+import time
+
+TS_PACKET_SIZE       = 188
+PACKETS_PER_DATAGRAM = 7
+
+class UdpOutput(object):
+	"""Paced UDP transport stream sink
+
+	Packets are written with UdpOutput.write(). Every full datagram is queued and the queue is sent once it
+	holds a batch of datagrams, the batch being sent no earlier than its due time at the target bitrate (the
+	time at which every byte sent before it has gone out at the bitrate). The timing error (how late each batch
+	went out) is recorded in the max_lateness and total_lateness members.
+	"""
+	def __init__(self, address, bitrate, packets_per_datagram=PACKETS_PER_DATAGRAM, batch_size=8,
+	             sock=None, clock=time.time, sleep=time.sleep):
+		"""Constructor
+
+		Arguments:
+			address -- (host, port) tuple to send to
+			bitrate -- target output bitrate in bits per second (None or 0 to send as fast as possible)
+			packets_per_datagram -- number of TS packets per datagram (default 7)
+			batch_size -- number of datagrams sent back to back after each pacing wait (default 8)
+			sock -- UDP socket to send with (default None, a new one is created)
+			clock -- function returning the current time in seconds (default time.time)
+			sleep -- function sleeping for a number of seconds (default time.sleep)
+		"""
+		self.address              = address
+		self.bitrate              = bitrate
+		self.packets_per_datagram = packets_per_datagram
+		self.batch_size           = batch_size
+		self.clock                = clock
+		self.sleep                = sleep
+		self.sock                 = sock or socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		self.sock.connect(address)
+		self.datagram_size        = packets_per_datagram * TS_PACKET_SIZE
+		# one reusable buffer per queued datagram, filled in place
+		self._buffers             = [bytearray(self.datagram_size) for i in range(batch_size)]
+		self._queued              = 0 # full datagrams in the buffers
+		self._fill                = 0 # bytes written to the buffer being filled
+		self.start_time           = None
+		self.bytes_sent           = 0
+		self.datagrams_sent       = 0
+		self.batches_sent         = 0
+		self.max_lateness         = 0.0
+		self.total_lateness       = 0.0
+
+	def write(self, packet):
+		"""Writes a TS packet to the output
+
+		Arguments:
+			packet -- string, bytearray or list of 188 bytes
+		"""
+		if len(packet) != TS_PACKET_SIZE:
+			raise ValueError('TS packets are %d bytes long, not %d'%(TS_PACKET_SIZE, len(packet)))
+		buf = self._buffers[self._queued]
+		buf[self._fill:self._fill+TS_PACKET_SIZE] = packet
+		self._fill += TS_PACKET_SIZE
+		if self._fill == self.datagram_size:
+			self._fill = 0
+			self._queued += 1
+			if self._queued == self.batch_size: self._send_batch()
+
+	def write_packets(self, packets):
+		"""Writes an iterable of TS packets to the output"""
+		for packet in packets: self.write(packet)
+
+	def _due_time(self):
+		"""Time at which the next batch is due at the target bitrate"""
+		return self.start_time + (self.bytes_sent * 8.0) / self.bitrate
+
+	def _send_batch(self, partial=0):
+		if self.start_time is None: self.start_time = self.clock()
+		if self.bitrate:
+			due = self._due_time()
+			now = self.clock()
+			if now < due:
+				self.sleep(due - now)
+				now = self.clock()
+			lateness = now - due
+			self.total_lateness += lateness
+			if lateness > self.max_lateness: self.max_lateness = lateness
+		send = self.sock.send
+		for i in range(self._queued + (partial and 1 or 0)):
+			size = self.datagram_size
+			if i == self._queued: size = partial
+			send(memoryview(self._buffers[i])[0:size])
+			self.bytes_sent += size
+			self.datagrams_sent += 1
+		self.batches_sent += 1
+		self._queued = 0
+
+	def flush(self):
+		"""Sends every queued datagram, including a last short datagram for the packets written so far"""
+		partial = self._fill
+		self._fill = 0
+		if self._queued or partial: self._send_batch(partial)
+
+	def get_timing_error(self):
+		"""Gets the pacing error
+
+		Returns:
+			A tuple (average lateness, maximum lateness) in seconds over every batch sent
+		"""
+		if not self.batches_sent: return (0.0, 0.0)
+		return (self.total_lateness / self.batches_sent, self.max_lateness)
+
+	def get_bitrate(self):
+		"""Gets the achieved output bitrate in bits per second since the first datagram"""
+		if self.start_time is None: return 0.0
+		elapsed = self.clock() - self.start_time
+		if elapsed <= 0: return 0.0
+		return self.bytes_sent * 8.0 / elapsed
+
+	def close(self):
+		"""Flushes the output and closes the socket"""
+		self.flush()
+		self.sock.close()
+
+'''UNIT TESTS -------------------------------------------------------------------------------------------------------------
+---------------------------------------------------------------------------------------------------------------------------
+'''
+if __name__ == '__main__':
+	import unittest
+
+	def make_packet(i):
+		return bytearray([0x47, 0x00, 0x10, 0x10 | (i & 0x0f)]) + bytearray([i & 0xff]) * (TS_PACKET_SIZE - 4)
+
+	class FakeClock(object):
+		def __init__(self): self.now = 0.0
+		def __call__(self): return self.now
+		def sleep(self, seconds): self.now += seconds
+
+	class Loopback(unittest.TestCase):
+		def setUp(self):
+			self.receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+			self.receiver.bind(('127.0.0.1', 0))
+			self.receiver.settimeout(1.0)
+			self.receiver.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+
+		def tearDown(self):
+			self.receiver.close()
+
+		def receive(self, count):
+			return [self.receiver.recv(2048) for i in range(count)]
+
+		def testDatagrams(self):
+			output = UdpOutput(self.receiver.getsockname(), None, batch_size=2)
+			for i in range(7 * 3 + 2):
+				output.write(make_packet(i))
+			datagrams = self.receive(2)
+			output.close()
+			datagrams += self.receive(2)
+			self.assertEqual([1316, 1316, 1316, 376], [len(d) for d in datagrams])
+			data = ''.join(datagrams)
+			for i in range(7 * 3 + 2):
+				self.assertEqual(str(make_packet(i)), data[i*TS_PACKET_SIZE:(i+1)*TS_PACKET_SIZE])
+
+		def testPacketSize(self):
+			output = UdpOutput(self.receiver.getsockname(), None)
+			self.assertRaises(ValueError, output.write, make_packet(0)[0:100])
+			self.assertRaises(ValueError, output.write, make_packet(0) + bytearray(1))
+			output.write(make_packet(1))
+			output.close()
+			self.assertEqual([str(make_packet(1))], self.receive(1))
+			self.assertEqual(set([output.datagram_size]), set([len(buf) for buf in output._buffers]))
+
+		def testPacing(self):
+			clock = FakeClock()
+			sleeps = []
+			def sleep(seconds):
+				sleeps.append(seconds)
+				clock.sleep(seconds)
+			bitrate = 100 * 1000 * 1000
+			output = UdpOutput(self.receiver.getsockname(), bitrate, clock=clock, sleep=sleep)
+			for i in range(7 * 24):
+				output.write(make_packet(i))
+			output.flush()
+			self.receive(24)
+			self.assertEqual(24, output.datagrams_sent)
+			self.assertEqual(3, output.batches_sent)
+			# one wait per batch after the first, each one batch of datagrams long
+			self.assertEqual(2, len(sleeps))
+			self.assertAlmostEqual(8 * 1316 * 8.0 / bitrate, sleeps[0])
+			# the last batch is due once the first sixteen datagrams have gone out
+			self.assertAlmostEqual(16 * 1316 * 8.0 / bitrate, clock.now)
+			self.assertEqual((0.0, 0.0), output.get_timing_error())
+
+		def testLateness(self):
+			clock = FakeClock()
+			def slow_sleep(seconds): clock.now += seconds + 0.001
+			output = UdpOutput(self.receiver.getsockname(), 10 * 1000 * 1000, batch_size=1,
+			                   clock=clock, sleep=slow_sleep)
+			for i in range(7 * 3):
+				output.write(make_packet(i))
+			self.receive(3)
+			average, maximum = output.get_timing_error()
+			self.assertTrue(maximum > 0.0)
+			self.assertTrue(average <= maximum)
+
+	unittest.main()
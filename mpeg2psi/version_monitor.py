@@ -0,0 +1,180 @@
+"""version monitor module
+
+	Provides a VersionMonitor class that lets callers subscribe to table version changes. Sections are pushed in
+	as they are received and the subscribed callbacks are only called when a table (table ID, table ID extension)
+	reaches a new version or current/next state. Each callback is given a TableDiff describing the change.
+"""
+
+def diff_program_maps(old, new):
+	"""Compares two PAT program maps
+
+	Arguments:
+		old -- dictionary mapping program numbers to PMT PIDs (Pat.table) before the change
+		new -- dictionary mapping program numbers to PMT PIDs after the change
+	Returns:
+		A tuple of dictionaries (added, removed, remapped). added and removed map program numbers to PMT PIDs,
+		remapped maps program numbers to (old PMT PID, new PMT PID) tuples
+	"""
+	added    = {}
+	removed  = {}
+	remapped = {}
+	for prog, pid in new.items():
+		old_pid = old.get(prog)
+		if old_pid is None: added[prog] = pid
+		elif old_pid != pid: remapped[prog] = (old_pid, pid)
+	for prog, pid in old.items():
+		if prog not in new: removed[prog] = pid
+	return added, removed, remapped
+
+class TableDiff(object):
+	"""Describes a table version change
+
+	For tables with a program map (Pat) the added, removed and remapped members hold the program changes,
+	for other tables they are empty.
+	"""
+	def __init__(self, section, old_version, old_current_next_indicator):
+		self.table_id                   = section.table_id
+		self.table_id_extension         = section.table_id_extension
+		self.version                    = section.version
+		self.current_next_indicator     = section.current_next_indicator
+		self.old_version                = old_version
+		self.old_current_next_indicator = old_current_next_indicator
+		self.section                    = section
+		self.added                      = {}
+		self.removed                    = {}
+		self.remapped                   = {}
+
+	def is_new(self):
+		"""True if the table had not been seen before"""
+		return self.old_version is None
+
+	def __str__(self):
+		res = 'TableDiff:\n'
+		res += '\tTableID            [%d]\n'%(self.table_id)
+		res += '\tTableID Extension  [%d]\n'%(self.table_id_extension)
+		res += '\tVersion            [%s -> %d]\n'%(str(self.old_version), self.version)
+		res += '\tCurrent Next flag  [%s -> %s]\n'%(str(self.old_current_next_indicator), str(self.current_next_indicator))
+		for prog in self.added:    res += '\tadded    prog[%x] - pid[%x]\n'%(prog, self.added[prog])
+		for prog in self.removed:  res += '\tremoved  prog[%x] - pid[%x]\n'%(prog, self.removed[prog])
+		for prog in self.remapped: res += '\tremapped prog[%x] - pid[%x -> %x]\n'%((prog,) + self.remapped[prog])
+		return res
+
+class VersionMonitor(object):
+	"""Table version change notifier
+
+	Sections are passed in with VersionMonitor.update(). A section of an already known table version costs a
+	single dictionary lookup, callbacks are only called on a change.
+	"""
+	def __init__(self):
+		"""Constructor"""
+		self._tables      = {} # (table id, table id extension) -> [version, current next indicator, program map]
+		self._subscribers = {} # (table id or None, table id extension or None) -> list of callbacks
+
+	def subscribe(self, callback, table_id=None, table_id_extension=None):
+		"""Subscribes a callback to table changes
+
+		Arguments:
+			callback -- function(diff) called with a TableDiff on every matching table change
+			table_id -- only call back for this table ID (default None, any table ID)
+			table_id_extension -- only call back for this table ID extension (default None, any extension)
+		"""
+		self._subscribers.setdefault((table_id, table_id_extension), []).append(callback)
+
+	def unsubscribe(self, callback, table_id=None, table_id_extension=None):
+		"""Removes a callback subscribed with the same arguments"""
+		callbacks = self._subscribers.get((table_id, table_id_extension))
+		if callbacks and callback in callbacks: callbacks.remove(callback)
+
+	def update(self, section):
+		"""Passes a received section to the monitor
+
+		Arguments:
+			section -- complete Section object (with a long header)
+		Returns:
+			The TableDiff given to the callbacks or None if the table did not change
+		"""
+		if not section.complete or not section.extended_header: return None
+		key = (section.table_id, section.table_id_extension)
+		state = self._tables.get(key)
+		if state and state[0] == section.version and state[1] == section.current_next_indicator: return None
+
+		program_map = getattr(section, 'table', None)
+		if state: diff = TableDiff(section, state[0], state[1])
+		else:     diff = TableDiff(section, None, None)
+		if program_map is not None:
+			diff.added, diff.removed, diff.remapped = diff_program_maps(state and state[2] or {}, program_map)
+		self._tables[key] = [section.version, section.current_next_indicator, program_map]
+
+		for subscriber in (key, (key[0], None), (None, key[1]), (None, None)):
+			for callback in self._subscribers.get(subscriber, ()):
+				callback(diff)
+		return diff
+
+	def forget(self, table_id, table_id_extension):
+		"""Forgets a table so that its next section is reported as new"""
+		self._tables.pop((table_id, table_id_extension), None)
+
+'''UNIT TESTS -------------------------------------------------------------------------------------------------------------
+---------------------------------------------------------------------------------------------------------------------------
+'''
+if __name__ == '__main__':
+	import unittest
+	import _known_tables
+	from section import Section
+	from pat import Pat
+
+	cat_data = _known_tables.get_sample_cat_data()[0]
+	pat_data = _known_tables.get_sample_pat_data()[0]
+
+	def set_version(data, version, current_next=True):
+		data = list(data)
+		data[5] = (data[5] & 0xC0) | (version << 1) | int(current_next)
+		return data
+
+	class Monitor(unittest.TestCase):
+		def setUp(self):
+			self.monitor = VersionMonitor()
+			self.diffs = []
+			self.pat_diffs = []
+			self.monitor.subscribe(self.diffs.append)
+			self.monitor.subscribe(self.pat_diffs.append, table_id=0x00)
+
+		def testNewTables(self):
+			self.monitor.update(Pat(pat_data))
+			self.monitor.update(Section(cat_data))
+			self.assertEqual(2, len(self.diffs))
+			self.assertEqual(1, len(self.pat_diffs))
+			self.assertTrue(self.pat_diffs[0].is_new())
+			self.assertEqual(22, len(self.pat_diffs[0].added))
+
+		def testSameVersion(self):
+			self.monitor.update(Pat(pat_data))
+			self.assertEqual(None, self.monitor.update(Pat(pat_data)))
+			self.assertEqual(1, len(self.diffs))
+
+		def testProgramDiff(self):
+			self.monitor.update(Pat(pat_data))
+			pat = Pat(set_version(pat_data, 17))
+			del pat.table[1605]
+			pat.table[1607] = 0x100
+			pat.table[42] = 0x200
+			diff = self.monitor.update(pat)
+			self.assertEqual(16, diff.old_version)
+			self.assertEqual(17, diff.version)
+			self.assertEqual({42: 0x200}, diff.added)
+			self.assertEqual({1605: 1984}, diff.removed)
+			self.assertEqual({1607: (1859, 0x100)}, diff.remapped)
+			self.assertEqual(2, len(self.pat_diffs))
+
+		def testCurrentNext(self):
+			self.monitor.update(Section(cat_data))
+			diff = self.monitor.update(Section(set_version(cat_data, 0, False)))
+			self.assertEqual(True, diff.old_current_next_indicator)
+			self.assertEqual(False, diff.current_next_indicator)
+
+		def testUnsubscribe(self):
+			self.monitor.unsubscribe(self.diffs.append)
+			self.monitor.update(Section(cat_data))
+			self.assertEqual([], self.diffs)
+
+	unittest.main()